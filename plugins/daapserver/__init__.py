@@ -1,58 +1,224 @@
-
 import logging
+import threading
 from xl import event, settings
+from spydaap.daap import do
 import exaile_parser
-from server import DaapServer
+from server import DaapServer, dmap_container
 import daapserverprefs
 
 logger = logging.getLogger(__file__)
 
+# Tags that end up in the DMAP encoding of a track
+DMAP_TAGS = (
+    frozenset(exaile_parser.ExaileParser._string_map)
+    | frozenset(exaile_parser.ExaileParser._int_map)
+    | frozenset(['__length', '__loc'])
+)
+
 
 # todo support multiple connections?
 class CollectionWrapper:
-    '''Class to wrap Exaile's collection to make it spydaap compatible'''
+    '''
+        Class to wrap Exaile's collection to make it spydaap compatible
+
+        Items keep their id for as long as they are in the collection.
+        Their DMAP encoding is kept until their tags change. Every change
+        to the items increments :attr:`revision`, so that clients can ask
+        for the changes since the revision they know, see
+        :meth:`get_changes`.
+    '''
+
+    #: How many deleted item ids to remember for deltas
+    max_deleted = 10000
 
     class TrackWrapper:
         '''Wrap a single track for spydaap'''
 
-        def __init__(self, id, track):
+        def __init__(self, id, track, wrapper):
             self.track = track
             self.id = id
-            self.parser = exaile_parser.ExaileParser()
-            self.daap = None
+            self.wrapper = wrapper
 
         def get_dmap_raw(self):
-            if self.daap is None:
-                do = self.parser.parse(self.track)[0]
-                if do is not None:
-                    self.daap = ''.join([d.encode() for d in do])
-                else:
-                    self.daap = ''
-            return self.daap
+            return self.wrapper.get_encoded(self)[self.wrapper.raw_offset :]
 
         def get_original_filename(self):
             return self.track.get_local_path()
 
     def __init__(self, collection):
         self.collection = collection
-        self.map = []
+        self.parser = exaile_parser.ExaileParser()
+        self.lock = threading.Lock()
+        self.revision_changed = threading.Condition(self.lock)
+        self.revision = 1
+        #: id -> TrackWrapper
+        self.items = {}
+        #: track -> id
+        self.ids = {}
+        self.next_id = 1
+        #: id -> revision of the last change
+        self.updated = {}
+        #: id -> revision it was deleted in
+        self.deleted = {}
+        #: the oldest revision that deltas can be made from
+        self.oldest_delta = self.revision
+        #: track -> listing item, encoded
+        self.encoded = {}
+        #: where the raw tags start in the listing items
+        self.raw_offset = len(self._encode_item(0, ''))
+
+        with self.lock:
+            for track in collection:
+                self._add(track)
+        event.add_callback(self._on_tracks_added, 'tracks_added', collection)
+        event.add_callback(self._on_tracks_removed, 'tracks_removed', collection)
+        event.add_callback(self._on_track_tags_changed, 'track_tags_changed', bulk=True)
+
+    def destroy(self):
+        event.remove_callback(self._on_tracks_added, 'tracks_added', self.collection)
+        event.remove_callback(
+            self._on_tracks_removed, 'tracks_removed', self.collection
+        )
+        event.remove_callback(self._on_track_tags_changed, 'track_tags_changed')
 
     def __iter__(self):
-        i = 0
-        self.map = []
-        for t in self.collection:
-            self.map.append(self.TrackWrapper(i, t))
-            yield self.map[i]
-            i += 1
+        with self.lock:
+            items = self.items.values()
+        return iter(items)
 
     def get_item_by_id(self, id):
-        return self.map[int(id)]
+        return self.items[int(id)]
 
     def __getitem__(self, idx):
-        return self.map[idx]
+        return self.items[int(idx)]
 
     def __len__(self):
-        return len(self.collection)
+        return len(self.items)
+
+    @staticmethod
+    def _encode_item(id, raw):
+        body = ''.join(
+            [
+                do('dmap.itemkind', 2).encode(),
+                do('dmap.containeritemid', id).encode(),
+                do('dmap.itemid', id).encode(),
+                raw,
+            ]
+        )
+        return dmap_container('mlit', len(body)) + body
+
+    def get_encoded(self, item):
+        """
+            Returns the DMAP listing item of item. Its raw tags start at
+            :attr:`raw_offset`.
+        """
+        with self.lock:
+            try:
+                return self.encoded[item.track]
+            except KeyError:
+                revision = self.updated.get(item.id)
+
+        tags = self.parser.parse(item.track)[0]
+        raw = ''.join([d.encode() for d in tags]) if tags is not None else ''
+        encoded = self._encode_item(item.id, raw)
+
+        with self.lock:
+            # Don't keep it if the track changed in the meantime
+            if (
+                self.items.get(item.id) is item
+                and self.updated.get(item.id) == revision
+            ):
+                self.encoded[item.track] = encoded
+        return encoded
+
+    def get_changes(self, revision):
+        """
+            Returns the items that were added or changed after revision,
+            and the ids of the items that were deleted after it, or None
+            if revision is too old to know
+        """
+        with self.lock:
+            if revision < self.oldest_delta or revision > self.revision:
+                return None
+            items = [
+                self.items[id]
+                for id, updated in self.updated.iteritems()
+                if updated > revision
+            ]
+            deleted = [
+                id for id, deleted in self.deleted.iteritems() if deleted > revision
+            ]
+            return items, deleted
+
+    def wait_for_revision(self, revision, timeout):
+        """
+            Waits up to timeout seconds for the revision to change from
+            revision, and returns the current revision
+        """
+        with self.lock:
+            if self.revision == revision:
+                self.revision_changed.wait(timeout)
+            return self.revision
+
+    def _add(self, track):
+        id = self.next_id
+        self.next_id += 1
+        self.ids[track] = id
+        self.items[id] = self.TrackWrapper(id, track, self)
+        return id
+
+    def _bump_revision(self):
+        self.revision += 1
+        if len(self.deleted) > self.max_deleted:
+            # Forget the older half
+            revisions = sorted(self.deleted.itervalues())
+            cutoff = revisions[len(revisions) // 2]
+            self.deleted = {
+                id: deleted
+                for id, deleted in self.deleted.iteritems()
+                if deleted > cutoff
+            }
+            self.oldest_delta = cutoff
+        self.revision_changed.notify_all()
+        return self.revision
+
+    def _changed(self, added=(), updated=(), removed=()):
+        with self.lock:
+            added = [track for track in added if track not in self.ids]
+            updated = [track for track in updated if track in self.ids]
+            removed = [track for track in removed if track in self.ids]
+            if not (added or updated or removed):
+                return
+            revision = self._bump_revision()
+            for track in added:
+                self.updated[self._add(track)] = revision
+            for track in updated:
+                self.encoded.pop(track, None)
+                self.updated[self.ids[track]] = revision
+            for track in removed:
+                self.encoded.pop(track, None)
+                id = self.ids.pop(track)
+                del self.items[id]
+                self.updated.pop(id, None)
+                self.deleted[id] = revision
+        logger.debug('Collection changed, revision is now %d', revision)
+        event.log_event('daapserver_revision_changed', self, revision)
+
+    def _on_tracks_added(self, type, collection, locations):
+        tracks = [collection.get_track_by_loc(loc) for loc in locations]
+        self._changed(added=[track for track in tracks if track is not None])
+
+    def _on_tracks_removed(self, type, collection, locations):
+        locations = set(locations)
+        with self.lock:
+            removed = [
+                track for track in self.ids if track.get_loc_for_io() in locations
+            ]
+        self._changed(removed=removed)
+
+    def _on_track_tags_changed(self, type, tracks, tags):
+        if tags & DMAP_TAGS:
+            self._changed(updated=tracks)
 
 
 class DaapServerPlugin(object):
@@ -80,6 +246,7 @@ class DaapServerPlugin(object):
 
     def disable(self, exaile):
         self.teardown(exaile)
+        self.__daapserver.library.destroy()
         self.__daapserver = None
 
     def get_preferences_pane(self):
@@ -23,6 +23,11 @@ class EnabledPreference(widgets.CheckPreference):
     name = 'plugin/daapserver/enabled'
 
 
+class CompressPreference(widgets.CheckPreference):
+    default = True
+    name = 'plugin/daapserver/compress'
+
+
 class HostPreference(widgets.Preference):
     default = '0.0.0.0'
     name = 'plugin/daapserver/host'
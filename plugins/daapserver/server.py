@@ -17,10 +17,15 @@
 
 import BaseHTTPServer
 import SocketServer
+import itertools
 import logging
+import re
 import select
 import socket
 import os
+import struct
+import urlparse
+import zlib
 
 import spydaap
 import spydaap.daap
@@ -29,8 +34,9 @@ import spydaap.containers
 import spydaap.cache
 import spydaap.server
 import spydaap.zeroconfimpl
+from spydaap.daap import do
 
-from xl import common, event, xdg
+from xl import common, event, settings, xdg
 
 # Notes for debugging:
 # You might want to run
@@ -69,6 +75,167 @@ logger = logging.getLogger('daapserver')
 
 __all__ = ['DaapServer']
 
+ITEMS_RE = re.compile(r'^/databases/[0-9]+/items$')
+
+#: How long to hold /update requests of clients that are up to date
+UPDATE_TIMEOUT = 60
+
+#: The size of the blocks responses are streamed in
+BLOCK_SIZE = 64 * 1024
+
+
+def dmap_container(code, body_length):
+    """
+        Returns the header of a DMAP container, which is followed by
+        body_length bytes of content
+    """
+    return struct.pack('!4sI', code, body_length)
+
+
+def _get_int(query, name):
+    try:
+        return int(query[name][0])
+    except (KeyError, ValueError):
+        return None
+
+
+def _blocks(strings, size):
+    """
+        Joins strings into blocks of at least size bytes
+    """
+    block = []
+    length = 0
+    for string in strings:
+        block.append(string)
+        length += len(string)
+        if length >= size:
+            yield ''.join(block)
+            block = []
+            length = 0
+    if block:
+        yield ''.join(block)
+
+
+def makeDAAPHandlerClass(server_name, cache, library):
+    """
+        Extends the spydaap handler with revision updates and streamed
+        item listings. library is a CollectionWrapper.
+    """
+    base = spydaap.server.makeDAAPHandlerClass(server_name, cache, library, [])
+
+    class DAAPHandler(base):
+        @property
+        def daap_server_revision(self):
+            return library.revision
+
+        def do_GET(self):
+            url = urlparse.urlparse(self.path)
+            query = urlparse.parse_qs(url.query)
+            if url.path == '/update':
+                self.do_GET_update_revision(query)
+            elif ITEMS_RE.match(url.path):
+                self.do_GET_item_list_streamed(query)
+            else:
+                base.do_GET(self)
+
+        def do_GET_update_revision(self, query):
+            """
+                Replies with the current revision. Clients that already
+                know it are held until it changes, or UPDATE_TIMEOUT
+                passes.
+            """
+            revision = library.revision
+            if _get_int(query, 'revision-number') == revision:
+                revision = library.wait_for_revision(revision, UPDATE_TIMEOUT)
+            update = do(
+                'dmap.updateresponse',
+                [do('dmap.status', 200), do('dmap.serverrevision', revision)],
+            )
+            self.h(update.encode())
+
+        def do_GET_item_list_streamed(self, query):
+            """
+                Sends all items, or only the changes since the revision
+                given by delta
+            """
+            changes = None
+            delta = _get_int(query, 'delta')
+            if delta:
+                changes = library.get_changes(delta)
+            if changes is None:
+                items, deleted = list(library), []
+            else:
+                items, deleted = changes
+
+            listing = [library.get_encoded(item) for item in items]
+            listing_length = sum(len(item) for item in listing)
+            head = ''.join(
+                [
+                    do('dmap.status', 200).encode(),
+                    do('dmap.updatetype', 0 if changes is None else 1).encode(),
+                    do('dmap.specifiedtotalcount', len(library)).encode(),
+                    do('dmap.returnedcount', len(items)).encode(),
+                    dmap_container('mlcl', listing_length),
+                ]
+            )
+            tail = ''
+            if deleted:
+                tail = ''.join(do('dmap.itemid', id).encode() for id in deleted)
+                tail = dmap_container('mudl', len(tail)) + tail
+            length = len(head) + listing_length + len(tail)
+            head = dmap_container('adbs', length) + head
+
+            self.send_stream(
+                itertools.chain([head], listing, [tail]),
+                len(head) + listing_length + len(tail),
+            )
+
+        def send_stream(self, strings, length):
+            """
+                Sends the concatenation of strings, which is length bytes
+                long, in blocks. It is gzip compressed if the client
+                accepts that and it is worth it.
+            """
+            compress = (
+                length > BLOCK_SIZE
+                and self.request_version == 'HTTP/1.1'
+                and 'gzip' in self.headers.get('Accept-Encoding', '')
+                and settings.get_option('plugin/daapserver/compress', True)
+            )
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-dmap-tagged')
+            self.send_header('DAAP-Server', 'Simple')
+            self.send_header('Expires', '-1')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Content-Language', 'en_us')
+            if compress:
+                self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Transfer-Encoding', 'chunked')
+                compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            else:
+                self.send_header('Content-Length', str(length))
+            self.end_headers()
+
+            try:
+                for block in _blocks(strings, BLOCK_SIZE):
+                    if compress:
+                        self.write_chunk(compressor.compress(block))
+                    else:
+                        self.wfile.write(block)
+                if compress:
+                    self.write_chunk(compressor.flush())
+                    self.wfile.write('0\r\n\r\n')
+            except socket.error as e:
+                logger.debug('Client went away while sending items: %s', e)
+                self.close_connection = 1
+
+        def write_chunk(self, data):
+            if data:
+                self.wfile.write('%x\r\n%s\r\n' % (len(data), data))
+
+    return DAAPHandler
+
 
 class MyThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
     """Handle requests in a separate thread."""
@@ -95,17 +262,12 @@ class DaapServer:
         self.__cache.clean()
 
         # Set a callback that will let us propagate library changes to clients
-        event.add_callback(self.update_rev, 'libraries_modified', library.collection)
-
-    def update_rev(self, *args):
-        if self.handler is not None:
-            # Updating the server revision, so if a client checks
-            # it can see the library has changed
-            self.handler.daap_server_revision += 1
-            logger.info(
-                'Libraries Changed, incrementing revision to %d.'
-                % self.handler.daap_server_revision
-            )
+        event.add_callback(self.update_rev, 'daapserver_revision_changed', library)
+
+    def update_rev(self, type, library, revision):
+        # The handler takes the revision from the library, so that a
+        # client checking for updates can see the library has changed
+        logger.info('Library changed, revision is now %d.', revision)
         self.__cache.clean()
 
     def set(self, **kwargs):
@@ -117,9 +279,7 @@ class DaapServer:
         self.zeroconf = spydaap.zeroconfimpl.ZeroconfImpl(
             self.name, self.port, stype="_daap._tcp"
         )
-        self.handler = spydaap.server.makeDAAPHandlerClass(
-            str(self.name), self.__cache, self.library, []
-        )
+        self.handler = makeDAAPHandlerClass(str(self.name), self.__cache, self.library)
         self.httpd = MyThreadedHTTPServer((self.host, self.port), self.handler)
 
         # signal.signal(signal.SIGTERM, make_shutdown(httpd))
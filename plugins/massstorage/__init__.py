@@ -24,12 +24,17 @@
 # do so. If you do not wish to do so, delete this exception statement
 # from your version.
 
-from xl import providers, collection
+from gi.repository import Gio
+from gi.repository import GLib
+
+from xl import providers, collection, event, settings, transcoder, trax
 from xl.hal import Handler
 from xl.devices import Device
+from collections import deque
 import dbus
 import logging
 import os
+import threading
 
 logger = logging.getLogger(__name__)
 
@@ -67,9 +72,11 @@ class MassStorageDevice(Device):
         if self.mountpoints == []:
             raise IOError("Device is not mounted.")
         for mountpoint in self.mountpoints:
-            library = self.library_class(mountpoint)
+            library = self.library_class(Gio.File.new_for_path(mountpoint).get_uri())
             self.collection.add_library(library)
-        self.transfer = collection.TransferQueue(self.collection.get_libraries()[0])
+        self.transfer = MassStorageTransferQueue(
+            self.collection.get_libraries()[0], self
+        )
         self.connected = True  # set this here so the UI can react
 
     def disconnect(self):
@@ -78,6 +85,186 @@ class MassStorageDevice(Device):
         self.transfer = None
         self.connected = False
 
+    def get_transcode_format(self):
+        """
+            Returns the (format, quality) that tracks are transcoded to
+            when transferred to this device, or (None, None) to copy them
+            as they are
+        """
+        formats = settings.get_option('plugin/massstorage/transcode_formats', {})
+        try:
+            format, quality = formats[self.name]
+        except (KeyError, TypeError, ValueError):
+            return None, None
+        if format not in transcoder.get_formats():
+            logger.warning("Cannot transcode to %s for %s", format, self.name)
+            return None, None
+        return format, quality
+
+    def set_transcode_format(self, format, quality=None):
+        """
+            Sets the format to transcode tracks to when transferring them
+            to this device; None to copy them as they are
+
+            :param quality: the quality, the default of the format if None
+        """
+        formats = settings.get_option('plugin/massstorage/transcode_formats', {})
+        if format is None:
+            formats.pop(self.name, None)
+        else:
+            if quality is None:
+                quality = transcoder.FORMATS[format]['default']
+            formats[self.name] = [format, quality]
+        settings.set_option('plugin/massstorage/transcode_formats', formats)
+
+
+class MassStorageTransferQueue(collection.TransferQueue):
+    """
+        Transfers tracks to a mass storage device, copying several files
+        at once and transcoding them to the format of the device if one
+        is set, see :meth:`MassStorageDevice.get_transcode_format`
+    """
+
+    #: How many files to copy at once
+    workers = 2
+
+    def __init__(self, library, device):
+        collection.TransferQueue.__init__(self, library)
+        self.device = device
+        self.transcodes = None
+        self._sizes = {}
+        self._done = {}
+
+    def transfer(self):
+        """
+            Transfers the queued tracks to the library, returning once
+            all of them are done. Needs the GLib main loop to be running
+            if tracks are transcoded.
+        """
+        self.transferring = True
+        self.cancellable = Gio.Cancellable()
+        tracks = self.queue[self.current_pos + 1 :]
+        format, quality = self.device.get_transcode_format()
+        if format is not None:
+            extension = transcoder.FORMATS[format]['extension']
+            directory = Gio.File.new_for_uri(self.library.location).get_path()
+
+        copies = deque()
+        transcodes = []
+        for track in tracks:
+            self._sizes[track] = collection.get_file_size(track)
+            self._done[track] = 0
+            path = track.get_local_path()
+            if format is None or path is None:
+                copies.append(track)
+                continue
+            base, ext = os.path.splitext(os.path.basename(path))
+            if ext[1:].lower() == extension:
+                copies.append(track)
+            else:
+                transcodes.append((track, path, base))
+
+        if transcodes:
+            self.transcodes = transcoder.TranscodeQueue(
+                format, quality, workers=self.workers, job_callback=self._on_transcoded
+            )
+            # Outputs must not overwrite each other, nor the copied files
+            used = set()
+            for track in copies:
+                gloc = Gio.File.new_for_uri(track.get_loc_for_io())
+                used.add(os.path.join(directory, gloc.get_basename()))
+            for track, path, base in transcodes:
+                output = transcoder.get_output_path(directory, base, extension, used)
+                self.transcodes.add(path, output, track=track)
+
+        total = sum(self._sizes.itervalues())
+        threads = []
+        for i in xrange(min(self.workers, len(copies))):
+            thread = threading.Thread(
+                target=self._copy_tracks,
+                args=(copies,),
+                name='MassStorageTransfer-%d' % i,
+            )
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        transcodes = self.transcodes
+
+        try:
+            if transcodes is not None:
+                transcodes.start()
+            while True:
+                threads = [thread for thread in threads if thread.is_alive()]
+                if threads:
+                    threads[0].join(0.5)
+                elif transcodes is None or transcodes.wait(0.5):
+                    break
+                self._report_progress(self._get_done(), total)
+        finally:
+            # Stops whatever is left if we were interrupted
+            self.cancel()
+            for thread in threads:
+                thread.join()
+            self.queue = []
+            self.transferring = False
+            self.cancellable = None
+            self.transcodes = None
+            self.current_pos = -1
+            self._stop = False
+            self._progress = -1
+            self._sizes = {}
+            self._done = {}
+            event.log_event('track_transfer_progress', self, 100)
+
+    def cancel(self):
+        collection.TransferQueue.cancel(self)
+        transcodes = self.transcodes
+        if transcodes is not None:
+            transcodes.cancel()
+
+    def _get_done(self):
+        done = sum(self._done.itervalues())
+        transcodes = self.transcodes
+        if transcodes is not None:
+            for job in transcodes.jobs:
+                if job.state == 'running':
+                    done += job.get_progress() * self._sizes[job.track]
+        return done
+
+    def _copy_tracks(self, copies):
+        """
+            Copies tracks from copies until there are none left
+        """
+        while not self._stop:
+            try:
+                track = copies.popleft()
+            except IndexError:
+                return
+
+            def on_copy_progress(current, size, *args):
+                self._done[track] = current
+
+            loc = track.get_loc_for_io()
+            try:
+                self.library.add(
+                    loc,
+                    cancellable=self.cancellable,
+                    progress_callback=on_copy_progress,
+                )
+            except GLib.Error as e:
+                if self.cancellable.is_cancelled():
+                    return
+                logger.warning("Could not transfer %s: %s", loc, e)
+            self._done[track] = self._sizes[track]
+
+    def _on_transcoded(self, queue, job):
+        self._done[job.track] = self._sizes[job.track]
+        if job.state not in ('done', 'skipped'):
+            return
+        track = trax.Track(Gio.File.new_for_path(job.output).get_uri())
+        if track._scan_valid:
+            self.library.collection.add(track)
+
 
 class HalMountpoint(object):
     """
@@ -811,8 +811,19 @@ class PlaylistButtonControl(Gtk.ToggleButton, BaseControl, QueueAdapter):
         """
         columns = self.view.get_model().column_names
         model = PlaylistModel(playlist, columns, player.PLAYER, self.view)
+        model.connect('data-loading', self.on_data_loading)
         self.view.set_model(model)
 
+    def on_data_loading(self, model, loading):
+        """
+            Detaches the model while it loads many tracks
+        """
+        if loading:
+            if self.view.get_model() is model:
+                self.view.set_model(None)
+        elif self.view.get_model() is None:
+            self.view.set_model(model)
+
     def do_scroll_event(self, event):
         """
             Changes the current track
@@ -228,10 +228,10 @@ class Notifier(PlaybackAdapter):
         if media_icon and self.settings.use_media_icons:
             icon_name = media_icon
         elif self.settings.show_covers:
+            size = DEFAULT_ICON_SIZE if self.settings.resize_covers else None
             cover_data = covers.MANAGER.get_cover(
-                track, set_only=True, use_default=True
+                track, set_only=True, use_default=True, size=size and size[0]
             )
-            size = DEFAULT_ICON_SIZE if self.settings.resize_covers else None
             new_icon = pixbuf_from_data(cover_data, size)
             self.notification.set_image_from_pixbuf(new_icon)
         return icon_name
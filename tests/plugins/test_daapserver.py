@@ -0,0 +1,171 @@
+import StringIO
+import struct
+import zlib
+
+import pytest
+
+pytest.importorskip('spydaap')
+
+from xl.trax import Track, TrackDB
+
+from plugins.daapserver import CollectionWrapper
+from plugins.daapserver import server
+from plugins.daapserver.server import _blocks
+
+
+def get_track(i, title):
+    tr = Track('file:///daapserver/%d.ogg' % i, scan=False)
+    tr.set_tags(title=title, __length=60)
+    return tr
+
+
+def parse(data):
+    '''
+        Splits DMAP data into a list of (code, body)
+    '''
+    items = []
+    while data:
+        code, length = struct.unpack('!4sI', data[:8])
+        items.append((code, data[8 : 8 + length]))
+        data = data[8 + length :]
+    return items
+
+
+@pytest.yield_fixture
+def wrapper():
+    db = TrackDB('daapserver-test')
+    db.add_tracks([get_track(1, u'one'), get_track(2, u'two')])
+    wrapper = CollectionWrapper(db)
+    wrapper.db = db
+    yield wrapper
+    wrapper.destroy()
+
+
+def make_handler(library, headers={}, request_version='HTTP/1.1'):
+    '''
+        Returns a DAAP handler that records what it sends, without a
+        connection
+    '''
+
+    class FakeHandler(server.makeDAAPHandlerClass('test', None, library)):
+        def __init__(self):
+            self.headers = headers
+            self.request_version = request_version
+            self.wfile = StringIO.StringIO()
+            self.sent_headers = {}
+
+        def send_response(self, code):
+            pass
+
+        def send_header(self, name, value):
+            self.sent_headers[name] = value
+
+        def end_headers(self):
+            pass
+
+        def output(self):
+            return self.wfile.getvalue()
+
+    return FakeHandler()
+
+
+def get_item_list(wrapper, delta=None):
+    handler = make_handler(wrapper)
+    query = {} if delta is None else {'delta': [str(delta)]}
+    handler.do_GET_item_list_streamed(query)
+    [(code, body)] = parse(handler.output())
+    assert code == 'adbs'
+    return dict(parse(body))
+
+
+def test_get_encoded(wrapper):
+    item = wrapper.get_item_by_id(1)
+    encoded = wrapper.get_encoded(item)
+    assert wrapper.get_encoded(item) is encoded
+    [(code, body)] = parse(encoded)
+    assert code == 'mlit'
+    assert encoded.endswith(item.get_dmap_raw())
+    assert 'one' in item.get_dmap_raw()
+    assert 'miid' not in item.get_dmap_raw()
+
+    item.track.set_tags(title=u'changed')
+    assert 'changed' in wrapper.get_encoded(item)
+    assert wrapper.get_encoded(wrapper.get_item_by_id(2)) is not encoded
+
+
+def test_get_changes(wrapper):
+    revision = wrapper.revision
+    assert wrapper.get_changes(revision) == ([], [])
+    assert wrapper.get_changes(revision + 1) is None
+
+    one = wrapper.get_item_by_id(1)
+    wrapper.db.add_tracks([get_track(3, u'three')])
+    wrapper.db.remove(one.track)
+    items, deleted = wrapper.get_changes(revision)
+    assert [item.track.get_tag_raw('title') for item in items] == [[u'three']]
+    assert deleted == [1]
+    assert wrapper.get_changes(wrapper.revision) == ([], [])
+
+    wrapper.oldest_delta = wrapper.revision
+    assert wrapper.get_changes(revision) is None
+
+
+def test_item_list(wrapper):
+    listing = get_item_list(wrapper)
+    assert struct.unpack('!b', listing['muty'][-1:]) == (0,)
+    assert len(parse(listing['mlcl'])) == 2
+    assert 'mudl' not in listing
+
+
+def test_item_list_delta(wrapper):
+    revision = wrapper.revision
+    wrapper.db.add_tracks([get_track(3, u'three')])
+    wrapper.db.remove(wrapper.get_item_by_id(1).track)
+
+    listing = get_item_list(wrapper, delta=revision)
+    items = parse(listing['mlcl'])
+    assert len(items) == 1
+    assert items[0][1].endswith(wrapper.get_item_by_id(3).get_dmap_raw())
+    [(code, body)] = parse(listing['mudl'])
+    assert code == 'miid'
+    assert struct.unpack('!i', body) == (1,)
+
+    # too old to know the changes: everything is sent
+    listing = get_item_list(wrapper, delta=wrapper.revision + 1)
+    assert len(parse(listing['mlcl'])) == 2
+    assert 'mudl' not in listing
+
+
+def test_blocks():
+    assert list(_blocks([], 4)) == []
+    assert list(_blocks(['ab', 'cd', 'e', 'fghij', 'k'], 4)) == ['abcd', 'efghij', 'k']
+
+
+def test_send_stream():
+    strings = ['%d' % i * 100 for i in range(2000)]
+    data = ''.join(strings)
+
+    handler = make_handler(None)
+    handler.send_stream(iter(strings), len(data))
+    assert handler.sent_headers['Content-Length'] == str(len(data))
+    assert handler.output() == data
+
+    handler = make_handler(None, headers={'Accept-Encoding': 'gzip'})
+    handler.send_stream(iter(strings), len(data))
+    assert handler.sent_headers['Content-Encoding'] == 'gzip'
+    output = handler.output()
+    compressed = []
+    while True:
+        size, output = output.split('\r\n', 1)
+        if not int(size, 16):
+            break
+        compressed.append(output[: int(size, 16)])
+        output = output[int(size, 16) + 2 :]
+    assert zlib.decompress(''.join(compressed), 16 + zlib.MAX_WBITS) == data
+
+    # HTTP/1.0 has no chunked encoding
+    handler = make_handler(
+        None, headers={'Accept-Encoding': 'gzip'}, request_version='HTTP/1.0'
+    )
+    handler.send_stream(iter(strings), len(data))
+    assert handler.output() == data
@@ -0,0 +1,144 @@
+import os
+
+from gi.repository import Gio
+
+import pytest
+
+pytest.importorskip('dbus')
+
+from xl import trax
+from xl.collection import Collection, Library
+
+import plugins.massstorage as massstorage
+from plugins.massstorage import MassStorageTransferQueue
+
+
+class FakeDevice(object):
+    def __init__(self, format=None):
+        self.format = format
+
+    def get_transcode_format(self):
+        if self.format is None:
+            return None, None
+        return self.format, 128000
+
+
+class FakeJob(object):
+    def __init__(self, input, output, track):
+        self.input = input
+        self.output = output
+        self.track = track
+        self.state = 'pending'
+
+    def get_progress(self):
+        return 0.5
+
+
+class FakeTranscodeQueue(object):
+    '''
+        Finishes all jobs when started, without transcoding anything
+    '''
+
+    def __init__(self, format, quality, workers=None, job_callback=None):
+        self.job_callback = job_callback
+        self.jobs = []
+
+    def add(self, input, output, track=None):
+        self.jobs.append(FakeJob(input, output, track))
+
+    def start(self):
+        for job in self.jobs:
+            with open(job.output, 'wb') as f:
+                f.write(b'transcoded')
+            job.state = 'done'
+            self.job_callback(self, job)
+
+    def wait(self, timeout=None):
+        return True
+
+    def cancel(self):
+        pass
+
+
+@pytest.yield_fixture
+def library(tmpdir):
+    collection = Collection('massstorage-test')
+    library = Library(Gio.File.new_for_path(str(tmpdir.mkdir('device'))).get_uri())
+    collection.add_library(library)
+    library.path = str(tmpdir.join('device'))
+    yield library
+    collection.close()
+
+
+def make_track(path, size=1000):
+    path.write(b'x' * size, mode='wb', ensure=True)
+    return trax.Track(Gio.File.new_for_path(str(path)).get_uri(), scan=False)
+
+
+def test_copy(tmpdir, library):
+    tracks = [make_track(tmpdir.join('source', '%d.ogg' % i)) for i in range(3)]
+    queue = MassStorageTransferQueue(library, FakeDevice())
+    queue.enqueue(tracks)
+    queue.transfer()
+
+    assert sorted(os.listdir(library.path)) == ['0.ogg', '1.ogg', '2.ogg']
+    assert queue.queue == []
+    assert not queue.transferring
+
+
+def test_transcode_output_names(tmpdir, library, monkeypatch):
+    monkeypatch.setattr(massstorage.transcoder, 'TranscodeQueue', FakeTranscodeQueue)
+    tracks = [
+        make_track(tmpdir.join('source', 'song.opus')),
+        make_track(tmpdir.join('source', 'song.flac')),
+        make_track(tmpdir.join('source', 'other', 'song.flac')),
+    ]
+    queue = MassStorageTransferQueue(library, FakeDevice('Opus'))
+    queue.enqueue(tracks)
+    queue.transfer()
+
+    # neither the copy nor the other output is overwritten
+    assert sorted(os.listdir(library.path)) == [
+        'song (2).opus',
+        'song (3).opus',
+        'song.opus',
+    ]
+    with open(os.path.join(library.path, 'song.opus'), 'rb') as f:
+        assert f.read() == b'x' * 1000
+
+
+def test_cancel_removes_partial_copy(tmpdir, library):
+    tracks = [make_track(tmpdir.join('source', 'big.ogg'), 4 * 1024 * 1024)]
+    queue = MassStorageTransferQueue(library, FakeDevice())
+    cancelled = []
+
+    class CancelOnProgress(dict):
+        def __setitem__(self, track, done):
+            dict.__setitem__(self, track, done)
+            if 0 < done < queue._sizes[track] and not cancelled:
+                cancelled.append(done)
+                queue.cancel()
+
+    queue._done = CancelOnProgress()
+    queue.enqueue(tracks)
+    queue.transfer()
+    if not cancelled:
+        pytest.skip("the copy was not reported in parts")
+
+    assert os.listdir(library.path) == []
+    assert not queue.transferring
+
+
+def test_progress_counts_bytes(tmpdir, library):
+    copied = make_track(tmpdir.join('source', 'copied.ogg'), 3000)
+    transcoded = make_track(tmpdir.join('source', 'transcoded.flac'), 1000)
+    queue = MassStorageTransferQueue(library, FakeDevice())
+    queue._sizes = {copied: 3000, transcoded: 1000}
+    queue._done = {copied: 1500, transcoded: 0}
+    queue.transcodes = FakeTranscodeQueue('Opus', 128000)
+    queue.transcodes.add(transcoded.get_local_path(), 'out.opus', track=transcoded)
+    assert queue._get_done() == 1500
+
+    # running transcodes count by their progress
+    queue.transcodes.jobs[0].state = 'running'
+    assert queue._get_done() == 2000
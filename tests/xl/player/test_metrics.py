@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+from xl.player import metrics
+from xl.player.metrics import LatencyHistogram
+
+
+@pytest.yield_fixture
+def clean_metrics():
+    saved = dict(metrics._METRICS)
+    metrics._METRICS.clear()
+    yield
+    metrics._METRICS.clear()
+    metrics._METRICS.update(saved)
+
+
+def test_buckets():
+    histogram = LatencyHistogram()
+    for seconds in (0.005, 0.010, 0.011, 0.3, 20.0):
+        histogram.add(seconds)
+    assert histogram.buckets == [2, 1, 0, 0, 0, 1, 0, 0, 0, 0, 1]
+    assert histogram.count == 5
+    assert histogram.min == 5
+    assert histogram.max == 20000
+
+    data = histogram.as_dict()
+    assert data['buckets_ms'][0] == ('<=10', 2)
+    assert data['buckets_ms'][-1] == ('>10000', 1)
+    assert data['mean_ms'] == pytest.approx(4065.2)
+
+
+def test_percentiles():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) is None
+    assert histogram.as_dict()['p50_ms'] is None
+
+    for i in range(90):
+        histogram.add(0.02)
+    for i in range(9):
+        histogram.add(0.2)
+    histogram.add(12.0)
+    assert histogram.percentile(50) == 25
+    assert histogram.percentile(90) == 25
+    assert histogram.percentile(99) == 250
+    # the last bucket has no upper bound
+    assert histogram.percentile(100) == 12000
+
+    histogram = LatencyHistogram()
+    histogram.add(0.03)
+    # not above what was recorded
+    assert histogram.percentile(50) == 30
+
+
+def test_get_all(clean_metrics):
+    assert metrics.get('engine') is metrics.get('engine')
+    metrics.get('engine').add_latency('seek', 0.1)
+    metrics.get('engine').increment('errors')
+    metrics.get('engine').increment('errors')
+    metrics.get('other').increment('buffering')
+
+    data = metrics.get_all()
+    assert sorted(data) == ['engine', 'other']
+    assert data['engine']['counters'] == {'errors': 2}
+    assert data['engine']['latencies']['seek']['count'] == 1
+    assert data['other']['latencies'] == {}
+
+    metrics.get('engine').reset()
+    assert metrics.get_all()['engine']['counters'] == {}
+
+
+def test_dump(tmpdir, clean_metrics):
+    metrics.get('engine').add_latency('start', 0.5)
+    location = str(tmpdir.join('metrics.json'))
+    metrics.dump(location)
+
+    with open(location) as f:
+        data = json.load(f)
+    start = data['engine']['latencies']['start']
+    assert start['count'] == 1
+    assert start['p50_ms'] == 500
+    assert ['<=500', 1] in start['buckets_ms']
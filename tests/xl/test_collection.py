@@ -0,0 +1,192 @@
+import os
+import shutil
+
+from gi.repository import Gio
+
+import pytest
+
+from xl import event, trax
+from xl.collection import Collection, Library, TransferQueue
+
+MUSIC = os.path.join(
+    os.path.dirname(__file__), '..', 'data', 'music', 'testartist', 'first'
+)
+
+
+@pytest.yield_fixture
+def library(tmpdir, monkeypatch):
+    '''
+        A library in a copy of some test tracks, counting the files whose
+        tags are read
+    '''
+    music = tmpdir.mkdir('music')
+    shutil.copytree(MUSIC, str(music.join('first')))
+
+    read = []
+    read_file_tags = trax.Track._read_file_tags
+
+    def _read_file_tags(loc, modified=None, mtime=None):
+        read.append(loc)
+        return read_file_tags(loc, modified, mtime)
+
+    monkeypatch.setattr(trax.Track, '_read_file_tags', staticmethod(_read_file_tags))
+
+    collection = Collection('test')
+    library = Library(Gio.File.new_for_path(str(music)).get_uri())
+    collection.add_library(library)
+    library.read = read
+    library.path = str(music)
+    yield library
+    collection.close()
+
+
+def rescan(library, force_update=False):
+    del library.read[:]
+    library.rescan(force_update=force_update)
+    return sorted(os.path.basename(loc) for loc in library.read)
+
+
+def get_titles(library):
+    return sorted(tr.get_tag_raw('title')[0] for tr in library.collection.get_tracks())
+
+
+def uri(path):
+    return Gio.File.new_for_path(path).get_uri()
+
+
+def test_rescan_skips_unchanged(library):
+    names = sorted(os.listdir(os.path.join(library.path, 'first')))
+    assert rescan(library) == names
+    assert len(library.collection) == len(names)
+    assert rescan(library) == []
+    assert len(library.collection) == len(names)
+
+
+def test_rescan_reads_modified_file(library):
+    rescan(library)
+    path = os.path.join(library.path, 'first', '1-black.ogg')
+    tr = library.collection.get_track_by_loc(uri(path))
+    title = tr.get_tag_raw('title')
+
+    # saved through a temporary file, as most tag editors do
+    tmp = os.path.join(library.path, 'first', 'saving.ogg')
+    shutil.copyfile(path, tmp)
+    copy = trax.Track(uri(tmp))
+    copy.set_tags(title=u'changed')
+    assert copy.write_tags()
+    os.rename(tmp, path)
+    mtime = os.path.getmtime(path) + 10
+    os.utime(path, (mtime, mtime))
+
+    assert rescan(library) == ['1-black.ogg']
+    assert tr.get_tag_raw('title') == [u'changed']
+    assert title != [u'changed']
+
+
+def test_rescan_finds_new_directory(library):
+    rescan(library)
+    os.mkdir(os.path.join(library.path, 'second'))
+    shutil.copyfile(
+        os.path.join(MUSIC, '2-white.ogg'),
+        os.path.join(library.path, 'second', 'white.ogg'),
+    )
+
+    assert rescan(library) == ['white.ogg']
+    path = os.path.join(library.path, 'second', 'white.ogg')
+    assert library.collection.get_track_by_loc(uri(path)) is not None
+
+
+def test_rescan_removes_deleted_file(library):
+    rescan(library)
+    path = os.path.join(library.path, 'first', '1-black.ogg')
+    os.remove(path)
+
+    assert rescan(library) == []
+    assert library.collection.get_track_by_loc(uri(path)) is None
+    assert len(library.collection) == len(os.listdir(os.path.dirname(path)))
+
+
+def test_forced_rescan_reads_all(library):
+    names = rescan(library)
+    path = os.path.join(library.path, 'first', '1-black.ogg')
+    tr = library.collection.get_track_by_loc(uri(path))
+
+    # changed in place, which leaves the directory alone
+    tr.set_tags(title=u'changed')
+    assert tr.write_tags()
+    tr.set_tags(title=u'stale')
+
+    assert rescan(library, force_update=True) == names
+    assert tr.get_tag_raw('title') == [u'changed']
+
+
+class Events(list):
+    pass
+
+
+@pytest.yield_fixture
+def progress():
+    '''
+        Records the track_transfer_progress events
+    '''
+    events = Events()
+
+    def on_progress(type, queue, percent):
+        events.append(percent)
+        if events.on_progress is not None:
+            events.on_progress(queue, percent)
+
+    events.on_progress = None
+    event.add_callback(on_progress, 'track_transfer_progress')
+    yield events
+    event.remove_callback(on_progress, 'track_transfer_progress')
+
+
+def make_source(tmpdir, sizes):
+    '''
+        Creates files of the given sizes, returns their tracks
+    '''
+    source = tmpdir.mkdir('source')
+    tracks = []
+    for i, size in enumerate(sizes):
+        path = source.join('%d.ogg' % i)
+        path.write(b'x' * size, mode='wb')
+        tracks.append(trax.Track(uri(str(path)), scan=False))
+    return tracks
+
+
+def test_transfer_progress(tmpdir, library, progress):
+    tracks = make_source(tmpdir, [3000, 1000])
+    queue = TransferQueue(library)
+    queue.enqueue(tracks)
+    queue.transfer()
+
+    # progress is counted in bytes, not in tracks
+    assert 75 in progress
+    assert 50 not in progress
+    assert progress == sorted(progress)
+    assert progress[-1] == 100
+    for tr in tracks:
+        path = os.path.join(library.path, os.path.basename(tr.get_local_path()))
+        assert os.path.getsize(path) == os.path.getsize(tr.get_local_path())
+    assert queue.queue == []
+    assert not queue.transferring
+
+
+def test_transfer_cancel_removes_partial_copy(tmpdir, library, progress):
+    tracks = make_source(tmpdir, [4 * 1024 * 1024, 1000])
+    queue = TransferQueue(library)
+    queue.enqueue(tracks)
+
+    def on_progress(queue, percent):
+        if 0 < percent < 99:
+            queue.cancel()
+
+    progress.on_progress = on_progress
+    queue.transfer()
+    if not 0 < progress[0] < 99:
+        pytest.skip("the copy was not reported in parts")
+
+    assert os.listdir(library.path) == ['first']
+    assert progress[-1] == 100
+    assert not queue.transferring
@@ -0,0 +1,182 @@
+import cPickle as pickle
+import os
+import socket
+import threading
+import time
+
+from xl import common, covers
+from xl.covers import Cacher, CoverFetchScheduler, CoverManager, CoverSearchMethod
+from xl.trax import Track
+
+
+def test_cacher_shards(tmpdir):
+    cache_dir = str(tmpdir)
+    with open(os.path.join(cache_dir, 'abcdef'), 'wb') as f:
+        f.write(b'old')
+    cacher = Cacher(cache_dir)
+    assert cacher.get('abcdef') == b'old'
+    key = cacher.add(b'data')
+    assert os.path.exists(os.path.join(cache_dir, key[:2], key))
+    assert cacher.get(key) == b'data'
+    cacher.remove(key)
+    assert cacher.get(key) is None
+
+
+def test_cacher_evicts_least_recently_used(tmpdir):
+    cacher = Cacher(str(tmpdir), max_size=10)
+    cacher.set('aa1', b'1234')
+    cacher.set('bb2', b'1234')
+    cacher.get('aa1')
+    cacher.set('cc3', b'1234')
+    assert cacher.get('bb2') is None
+    assert cacher.get('aa1') == b'1234'
+    assert cacher.get('cc3') == b'1234'
+    # Entries are picked up again by a new instance
+    assert Cacher(str(tmpdir), max_size=10).get('aa1') == b'1234'
+
+
+def test_cacher_reads_outside_lock(tmpdir, monkeypatch):
+    cacher = Cacher(str(tmpdir), max_size=10)
+    cacher.set('aa1', b'1234')
+    cacher.set('bb2', b'1234')
+    opened = []
+
+    def _open(path, mode='r'):
+        opened.append((os.path.basename(path), mode, cacher.lock.locked()))
+        return open(path, mode)
+
+    monkeypatch.setattr(covers, 'open', _open, raising=False)
+    assert cacher.get('aa1') == b'1234'
+    cacher.set('cc3', b'1234')
+    assert opened == [('aa1', 'rb', False)]
+    # the entry that was read is still the most recently used
+    assert cacher.get('bb2') is None
+    assert cacher.get('aa1') == b'1234'
+    assert not [name for name in os.listdir(str(tmpdir.join('cc'))) if name != 'cc3']
+
+
+class SlowMethod(CoverSearchMethod):
+    name = 'slow'
+
+    def find_covers(self, track, limit=-1):
+        return [common.get_url_contents('http://slow.invalid/', 'test')]
+
+
+class AlbumMethod(CoverSearchMethod):
+    name = 'album'
+
+    def __init__(self):
+        self.searched = []
+
+    def find_covers(self, track, limit=-1):
+        self.searched.append(track)
+        return [track.get_tag_raw('album')[0]]
+
+    def get_cover_data(self, db_string):
+        return db_string
+
+
+def test_fetch_scheduler(tmpdir, monkeypatch):
+    timeouts = []
+
+    def urlopen(request, timeout=None):
+        timeouts.append(timeout)
+        raise socket.timeout()
+
+    monkeypatch.setattr('urllib2.urlopen', urlopen)
+    manager = CoverManager(str(tmpdir))
+    method = AlbumMethod()
+    manager.methods = {'slow': SlowMethod(), 'album': method}
+    manager.order = ['slow', 'album']
+
+    tracks = []
+    for i in range(6):
+        track = Track('file:///tmp/covers/%d.ogg' % i, scan=False)
+        track.set_tags(album=u'album%d' % (i // 2), artist=u'artist')
+        tracks.append(track)
+
+    results = {}
+    scheduler = CoverFetchScheduler(manager, workers=3, timeout=0.1)
+    assert scheduler.fetch(tracks, results.__setitem__, save_cover=False)
+
+    # The slow method timed out, and each album was searched once
+    assert timeouts == [0.1] * 3
+    assert len(method.searched) == 3
+    assert [results[track] for track in tracks] == [
+        u'album0',
+        u'album0',
+        u'album1',
+        u'album1',
+        u'album2',
+        u'album2',
+    ]
+
+
+class BlockingMethod(CoverSearchMethod):
+    name = 'blocking'
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def find_covers(self, track, limit=-1):
+        self.started.set()
+        self.release.wait(5)
+        return []
+
+
+def test_fetch_scheduler_stopped_with_joined_request(tmpdir):
+    manager = CoverManager(str(tmpdir))
+    method = BlockingMethod()
+    manager.methods = {'blocking': method}
+    manager.order = ['blocking']
+
+    tracks = []
+    for i in range(3):
+        track = Track('file:///tmp/covers/joined%d.ogg' % i, scan=False)
+        track.set_tags(album=u'album%d' % min(i, 1), artist=u'artist')
+        tracks.append(track)
+
+    scheduler = CoverFetchScheduler(manager, workers=1, timeout=5)
+    stopper = threading.Event()
+    first = threading.Thread(
+        target=scheduler.fetch,
+        args=(tracks[:2], lambda track, data: None, stopper, False, False),
+    )
+    first.daemon = True
+    first.start()
+    assert method.started.wait(5)
+
+    # The second fetch joins the lookup that the first one has queued
+    results = {}
+    second = threading.Thread(
+        target=scheduler.fetch,
+        args=(tracks[2:], results.__setitem__, None, False, False),
+    )
+    second.daemon = True
+    second.start()
+    key = manager._get_track_key(tracks[1])
+    while len(scheduler.requests[key].waiters) < 2:
+        time.sleep(0.01)
+
+    stopper.set()
+    second.join(5)
+    method.release.set()
+    first.join(5)
+
+    assert not second.is_alive()
+    assert results == {tracks[2]: None}
+
+
+def test_import_pickled_db(tmpdir):
+    with open(str(tmpdir.join('covers.db')), 'wb') as f:
+        pickle.dump({'version': 2, u'album\0a': 'localfile:file:///a.jpg'}, f)
+
+    manager = CoverManager(str(tmpdir))
+    assert manager.db.get(u'album\0a') == 'localfile:file:///a.jpg'
+    assert not tmpdir.join('covers.db').exists()
+
+    manager.db[u'album\0b'] = 'localfile:file:///b.jpg'
+    manager.save()
+    manager.db.close()
+    assert CoverManager(str(tmpdir)).db.get(u'album\0b') == 'localfile:file:///b.jpg'
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+from xl import dynamic, event
+from xl.dynamic import DynamicManager, SimilarArtistCache
+from xl.trax import Track, TrackDB
+
+
+@pytest.yield_fixture
+def make_cache(tmpdir):
+    caches = []
+
+    def make_cache(legacy_dir=None):
+        cache = SimilarArtistCache(str(tmpdir.join('dynamic.db')), legacy_dir)
+        caches.append(cache)
+        return cache
+
+    yield make_cache
+    for cache in caches:
+        cache.on_quit_application()
+        event.remove_callback(cache.on_quit_application, 'quit_application')
+
+
+def test_key_encoding(make_cache):
+    cache = make_cache()
+    cache.set(u'Sigur Rós', [(0.5, u'Múm')])
+    assert cache.get(u'Sigur Rós')[1] == [(0.5, u'Múm')]
+    assert cache.get(u'Sigur Ros') is None
+    assert u'Sigur Rós'.encode('utf-8') in cache.db
+
+
+def test_import_legacy_dir(tmpdir, make_cache):
+    legacy_dir = tmpdir.mkdir('dynamic')
+    legacy_dir.join(u'Sigur Rós'.encode('utf-8')).write(
+        u'1234.5\n0.9 Múm\n0.5 Amiina\nbroken\n'.encode('utf-8'), mode='wb'
+    )
+    legacy_dir.join('damaged').write('not a time\n0.5 Amiina\n')
+
+    cache = make_cache(str(legacy_dir))
+    assert cache.get(u'Sigur Rós') == (1234.5, [(0.9, u'Múm'), (0.5, u'Amiina')])
+    assert cache.get(u'damaged') is None
+    assert not os.path.exists(str(legacy_dir))
+
+
+def test_purge(make_cache, monkeypatch):
+    class FakeTime(object):
+        now = 1000.0
+
+        @classmethod
+        def time(cls):
+            cls.now += 1
+            return cls.now
+
+    monkeypatch.setattr(dynamic, 'time', FakeTime)
+    cache = make_cache()
+    cache.max_entries = 2
+    cache.set(u'a', [])
+    cache.db['damaged'] = 'damaged'
+    cache.count += 1
+    cache.set(u'b', [])
+    cache.set(u'c', [])
+
+    assert sorted(cache.db.keys()) == ['b', 'c']
+    assert cache.count == 2
+
+
+class FirstRandom(object):
+    '''
+        Keeps the similar artists in order and picks the first track
+    '''
+
+    @staticmethod
+    def shuffle(items):
+        pass
+
+    @staticmethod
+    def choice(items):
+        return min(items, key=lambda tr: tr.get_loc_for_io())
+
+
+@pytest.fixture
+def manager(make_cache, monkeypatch):
+    monkeypatch.setattr(
+        dynamic, 'SimilarArtistCache', lambda path, legacy_dir: make_cache()
+    )
+    monkeypatch.setattr(dynamic, 'random', FirstRandom)
+
+    tracks = []
+    for i, artist in enumerate([u'Foo', [u'foo', u'Bär'], u'BÄR', u'Other']):
+        tr = Track('file:///dynamic/%d.ogg' % i, scan=False)
+        tr.set_tags(artist=artist)
+        tracks.append(tr)
+    db = TrackDB('dynamic-test')
+    db.add_tracks(tracks)
+
+    manager = DynamicManager(db)
+    manager.tracks = tracks
+    manager.find_similar_artists = lambda track: [
+        (0.9, u'FOO'),
+        (0.8, u'bär'),
+        (0.5, u'Nobody'),
+    ]
+    return manager
+
+
+def test_find_similar_tracks(manager):
+    first, both, bar, other = manager.tracks
+    # the track of both artists is picked once only
+    assert manager.find_similar_tracks(other) == [first, both]
+    assert manager.find_similar_tracks(other, exclude=[first]) == [both, bar]
+    assert manager.find_similar_tracks(other, limit=1) == [first]
+    assert manager.find_similar_tracks(other, exclude=[first, both, bar]) == []
+
+
+def test_find_similar_tracks_without_index(manager):
+    first, both, bar, other = manager.tracks
+    manager.collection = list(manager.tracks)
+    assert manager.find_similar_tracks(other, exclude=[first]) == [both, bar]
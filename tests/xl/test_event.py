@@ -98,3 +98,47 @@ def test_thread_events():
     ncb.destroy()
 
     _finish_events()
+
+
+class Sender(object):
+    pass
+
+
+class RecordingCallback(object):
+    def __init__(self, bulk):
+        self.calls = []
+        event.add_callback(self.on_cb, 'test', bulk=bulk)
+
+    def destroy(self):
+        event.remove_callback(self.on_cb, 'test')
+
+    def on_cb(self, type, obj, data):
+        self.calls.append((obj, data))
+
+
+def test_batch_events():
+    _init_events()
+    bcb = RecordingCallback(bulk=True)
+    ncb = RecordingCallback(bulk=False)
+    a, b = Sender(), Sender()
+
+    with event.batch_events('test'):
+        event.log_event('test', a, {'artist'})
+        with event.batch_events('test'):
+            event.log_event('test', b, {'title'})
+        event.log_event('test', a, {'album'})
+        assert bcb.calls == []
+        assert ncb.calls == []
+
+    assert bcb.calls == [({a, b}, {'artist', 'album', 'title'})]
+    assert ncb.calls == [(a, {'artist', 'album'}), (b, {'title'})]
+
+    # outside of a batch, bulk callbacks get a set of one object
+    event.log_event('test', a, {'genre'})
+    assert bcb.calls[-1] == ({a}, {'genre'})
+    assert ncb.calls[-1] == (a, {'genre'})
+
+    bcb.destroy()
+    ncb.destroy()
+
+    _finish_events()
@@ -0,0 +1,22 @@
+from xl import formatter
+from xl.trax import Track
+
+
+def test_format_template():
+    f = formatter.Formatter('$$a ${a:prefix=[, suffix=]} ${b:pad=3, padstring=0} $c')
+    f._substitutions = {'a': 'x', 'b': lambda: '7'}
+    assert f.format() == '$a [x] 007 $c'
+    assert f.extract()['b:pad=3, padstring=0'] == ('b', {'pad': '3', 'padstring': '0'})
+
+
+def test_track_format_cache(monkeypatch):
+    # registers with the current event manager
+    monkeypatch.setattr(
+        formatter, '_TRACK_FORMAT_CACHE', formatter._TrackFormatCache(10)
+    )
+    tr = Track('file:///tmp/formatter-test.ogg', scan=False)
+    tr.set_tags(artist=u'a', title=u'b')
+    f = formatter.TrackFormatter('$artist - $title', cache=True)
+    assert f.format(tr) == u'a - b'
+    tr.set_tags(title=u'c')
+    assert f.format(tr) == u'a - c'
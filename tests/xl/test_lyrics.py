@@ -0,0 +1,131 @@
+from datetime import datetime, timedelta
+import os
+import threading
+import time
+
+import pytest
+
+from xl import event, settings, xdg
+from xl.lyrics import (
+    LyricsCache,
+    LyricsManager,
+    LyricsNotFoundException,
+    LyricSearchMethod,
+)
+from xl.trax import Track
+
+
+def close_cache(cache):
+    if not cache.closed:
+        cache.on_quit_application()
+    event.remove_callback(cache.on_quit_application, 'quit_application')
+
+
+@pytest.yield_fixture
+def cache(tmpdir, monkeypatch):
+    # keep changes pending until flushed
+    monkeypatch.setattr(LyricsCache, 'flush_delay', 3600)
+    monkeypatch.setattr(LyricsCache, 'expire_delay', 3600)
+    cache = LyricsCache(os.path.join(str(tmpdir), 'lyrics.db'))
+    yield cache
+    close_cache(cache)
+
+
+def test_pending_changes(cache):
+    cache['a'] = ('lyrics', 'source', 'url', datetime.now())
+    assert 'a' in cache
+    assert 'a' not in cache.db
+    cache.flush()
+    assert cache.db['a'][0] == 'lyrics'
+
+    del cache['a']
+    assert 'a' not in cache
+    assert 'a' in cache.db
+    cache.flush()
+    assert 'a' not in cache.db
+
+
+def test_expire(cache, monkeypatch):
+    values = {'lyrics/cache_time': 24, 'lyrics/cache_size': 2}
+    monkeypatch.setattr(settings, 'get_option', lambda name, default=None: values[name])
+    now = datetime.now()
+    cache.db['old'] = ('', '', '', now - timedelta(days=2))
+    cache.db['damaged'] = 'damaged'
+    cache.db['new1'] = ('', '', '', now - timedelta(hours=2))
+    cache.db['new2'] = ('', '', '', now - timedelta(hours=1))
+    cache['new3'] = ('', '', '', now)
+
+    cache.expire()
+    assert sorted(cache.keys()) == ['new2', 'new3']
+    cache.on_quit_application()
+    assert cache.closed
+
+
+class FakeSearch(LyricSearchMethod):
+    def __init__(self, name, lyrics=None, delay=0, timeout=None):
+        self.name = self.display_name = name
+        self.lyrics = lyrics
+        self.delay = delay
+        self.timeout = timeout
+        self.searched = 0
+        self.release = threading.Event()
+
+    def find_lyrics(self, track):
+        self.searched += 1
+        self.release.wait(self.delay)
+        if self.lyrics is None:
+            raise LyricsNotFoundException()
+        return (self.lyrics, self.name, '')
+
+
+@pytest.yield_fixture
+def manager(tmpdir, monkeypatch):
+    monkeypatch.setattr(LyricsCache, 'flush_delay', 3600)
+    monkeypatch.setattr(LyricsCache, 'expire_delay', 3600)
+    monkeypatch.setattr(xdg, 'get_cache_dir', lambda: str(tmpdir))
+    manager = LyricsManager()
+    yield manager
+    close_cache(manager.cache)
+    event.remove_callback(manager.on_track_tags_changed, 'track_tags_changed')
+
+
+def get_track():
+    track = Track('file:///tmp/lyrics-test.ogg', scan=False)
+    track.set_tags(artist=u'artist', title=u'title')
+    return track
+
+
+def test_find_lyrics_order(manager, monkeypatch):
+    methods = [
+        FakeSearch('none'),
+        FakeSearch('slow', u'slow lyrics', delay=0.2),
+        FakeSearch('fast', u'fast lyrics'),
+    ]
+    monkeypatch.setattr(manager, 'get_providers', lambda: methods)
+    track = get_track()
+
+    assert manager.find_lyrics(track) == (u'slow lyrics', 'slow', '')
+
+    # The answer of slow is cached now, and fast is not asked again
+    searched = [method.searched for method in methods]
+    assert manager.find_lyrics(track) == (u'slow lyrics', 'slow', '')
+    assert [method.searched for method in methods] == [searched[0] + 1] + searched[1:]
+
+    assert len(manager.find_all_lyrics(track)) == 2
+
+    methods[1:] = []
+    with pytest.raises(LyricsNotFoundException):
+        manager.find_lyrics(track)
+
+
+def test_find_lyrics_timeout(manager, monkeypatch):
+    hung = FakeSearch('hung', u'late lyrics', delay=10, timeout=0.1)
+    methods = [hung, FakeSearch('fast', u'fast lyrics')]
+    monkeypatch.setattr(manager, 'get_providers', lambda: methods)
+
+    start = time.time()
+    try:
+        assert manager.find_lyrics(get_track()) == (u'fast lyrics', 'fast', '')
+        assert time.time() - start < 5
+    finally:
+        hung.release.set()
@@ -0,0 +1,24 @@
+from xl import playlist
+from xl.trax import Track
+
+
+def get_track(i, length):
+    tr = Track('file:///tmp/playlist-test-%d.ogg' % i, scan=False)
+    tr.set_tags(__length=length)
+    return tr
+
+
+def test_total_length():
+    a, b, c = get_track(1, 10), get_track(2, 20), get_track(3, None)
+    pl = playlist.Playlist('test', [a, b])
+    assert pl.get_total_length() == 30
+    pl.extend([a, c])
+    assert pl.get_total_length() == 40
+    del pl[0]
+    assert pl.get_total_length() == 30
+    a.set_tag_raw('__length', 100)
+    assert pl.get_total_length() == 120
+    pl[1:2] = [b]
+    assert pl.get_total_length() == 40
+    pl.clear()
+    assert pl.get_total_length() == 0
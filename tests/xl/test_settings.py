@@ -0,0 +1,24 @@
+from xl.settings import SettingsManager
+
+
+def test_option_cache():
+    manager = SettingsManager(None)
+    manager.set_option('test/list', [1, 2])
+    value = manager.get_option('test/list')
+    value.append(3)
+    assert manager.get_option('test/list') == [1, 2]
+
+    manager.set_option('test/list', [4])
+    assert manager.get_option('test/list') == [4]
+    manager.remove_option('test/list')
+    assert manager.get_option('test/list', 'default') == 'default'
+
+
+def test_option_handle():
+    manager = SettingsManager(None)
+    handle = manager.get_option_handle('test/number', 5)
+    assert handle.get() == 5
+    manager.set_option('test/number', 10)
+    assert handle.get() == 10
+    handle.set(20, save=False)
+    assert manager.get_option('test/number') == 20
@@ -0,0 +1,152 @@
+import os
+
+import pytest
+
+from xl import transcoder
+from xl.transcoder import TranscodeError, TranscodeQueue
+
+
+class FakeTranscoder(object):
+    '''
+        Stands in for a GStreamer pipeline; tests end it by calling finish()
+    '''
+
+    instances = []
+
+    def __init__(self, destformat, quality, error_callback, end_callback):
+        self.error_cb = error_callback
+        self.end_cb = end_callback
+        self.output = None
+        self.time = 0.0
+        self.stopped = False
+
+    def set_input(self, uri):
+        self.input = uri
+
+    def set_raw_input(self, raw):
+        self.input = raw
+
+    def set_output(self, uri):
+        self.output = uri
+
+    def start_transcode(self):
+        with open(self.output, 'wb') as fp:
+            fp.write(b'partial')
+        self.instances.append(self)
+
+    def get_time(self):
+        return self.time
+
+    def stop(self):
+        self.stopped = True
+        self.end_cb()
+
+    def finish(self):
+        self.instances.remove(self)
+        self.end_cb()
+
+
+@pytest.fixture
+def fake_transcoder(monkeypatch):
+    monkeypatch.setattr(transcoder, 'Transcoder', FakeTranscoder)
+    FakeTranscoder.instances = []
+    return FakeTranscoder
+
+
+def make_inputs(tmpdir, count):
+    inputs = []
+    for i in range(count):
+        path = str(tmpdir.join('in%d.flac' % i))
+        with open(path, 'wb') as fp:
+            fp.write(b'input')
+        inputs.append(path)
+    return inputs
+
+
+def test_workers(tmpdir, fake_transcoder):
+    done = []
+    queue = TranscodeQueue(
+        'Opus', 128000, workers=2, job_callback=lambda q, job: done.append(job)
+    )
+    jobs = [
+        queue.add(path, str(tmpdir.join('out', 'out%d.opus' % i)))
+        for i, path in enumerate(make_inputs(tmpdir, 3))
+    ]
+    assert not fake_transcoder.instances
+
+    queue.start()
+    assert [job.state for job in jobs] == ['running', 'running', 'pending']
+    assert len(fake_transcoder.instances) == 2
+
+    # the output only gets its name once it is complete
+    assert not os.path.exists(jobs[0].output)
+    assert os.path.exists(jobs[0].partial_output)
+    fake_transcoder.instances[0].finish()
+    assert jobs[0].state == 'done'
+    assert os.path.exists(jobs[0].output)
+    assert not os.path.exists(jobs[0].partial_output)
+    assert jobs[2].state == 'running'
+
+    for instance in list(fake_transcoder.instances):
+        instance.finish()
+    assert queue.wait(0)
+    assert not queue.is_running()
+    assert done == jobs
+
+
+def test_skip_up_to_date(tmpdir, fake_transcoder):
+    inputs = make_inputs(tmpdir, 2)
+    output = str(tmpdir.join('out0.opus'))
+    with open(output, 'wb') as fp:
+        fp.write(b'output')
+    os.utime(inputs[0], (1, 1))
+
+    queue = TranscodeQueue('Opus', 128000)
+    skipped = queue.add(inputs[0], output)
+    # an unfinished output of an earlier run is not up to date
+    partial = queue.add(inputs[1], str(tmpdir.join('out1.opus')))
+    with open(partial.partial_output, 'wb') as fp:
+        fp.write(b'partial')
+    queue.start()
+
+    assert skipped.state == 'skipped'
+    assert partial.state == 'running'
+
+
+def test_cancel(tmpdir, fake_transcoder):
+    queue = TranscodeQueue('Opus', 128000, workers=1)
+    running, pending = [
+        queue.add(path, str(tmpdir.join('out%d.opus' % i)))
+        for i, path in enumerate(make_inputs(tmpdir, 2))
+    ]
+    queue.start()
+    instance = fake_transcoder.instances[0]
+
+    queue.cancel()
+    assert instance.stopped
+    assert running.state == 'cancelled'
+    assert pending.state == 'cancelled'
+    assert not os.path.exists(running.partial_output)
+    assert not os.path.exists(running.output)
+    assert queue.wait(0)
+
+    with pytest.raises(TranscodeError):
+        queue.add(str(tmpdir.join('in0.flac')), str(tmpdir.join('more.opus')))
+
+
+def test_get_progress(tmpdir, fake_transcoder):
+    queue = TranscodeQueue('Opus', 128000, workers=2)
+    inputs = make_inputs(tmpdir, 3)
+    first = queue.add(inputs[0], str(tmpdir.join('out0.opus')), length=10)
+    second = queue.add(inputs[1], str(tmpdir.join('out1.opus')), length=30)
+    queue.add(inputs[2], str(tmpdir.join('out2.opus')), length=60)
+    assert queue.get_progress() == 0.0
+
+    queue.start()
+    fake_transcoder.instances[1].time = 15.0
+    assert second.get_progress() == 0.5
+    assert queue.get_progress() == 0.15
+
+    fake_transcoder.instances[0].finish()
+    assert first.get_progress() == 1.0
+    assert queue.get_progress() == 0.25
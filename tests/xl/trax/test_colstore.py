@@ -0,0 +1,74 @@
+from os.path import join
+
+import pytest
+
+from xl.trax import colstore
+
+
+TRACKS = [
+    {
+        '__loc': 'file:///music/01.ogg',
+        '__length': 183.5,
+        '__compilation': ('/music', u'album'),
+        'artist': [u'Art\xefst'],
+        'album': [u'Album'],
+        'title': [u'One'],
+    },
+    {
+        '__loc': 'file:///music/02.ogg',
+        'artist': [u'Art\xefst', u'Other'],
+        'album': [u'Album'],
+        'comment': [u'with\x00nul'],
+        'genre': None,
+    },
+]
+
+
+@pytest.fixture
+def store(tmpdir):
+    path = join(str(tmpdir), 'music.db')
+    writer = colstore.ColumnStoreWriter()
+    for i, tags in enumerate(TRACKS):
+        writer.add_row(tags, i + 10, {'row': i} if i else None)
+    writer.write(path, {'name': 'test', '_key': 12})
+
+    store = colstore.ColumnStore(path)
+    yield store
+    store.close()
+
+
+def test_roundtrip(store):
+    assert colstore.is_column_store(store.path)
+    assert len(store) == 2
+    assert store.attrs == {'name': 'test', '_key': 12}
+
+    for i, tags in enumerate(TRACKS):
+        assert store.get_loc(i) == tags['__loc']
+        assert store.get_key(i) == i + 10
+        assert store.get_tags(i) == tags
+
+    assert store.get_row_attrs(0) == {}
+    assert store.get_row_attrs(1) == {'row': 1}
+
+
+def test_copy_raw_rows(store, tmpdir):
+    path = join(str(tmpdir), 'copy.db')
+    writer = colstore.ColumnStoreWriter()
+    for i in range(len(store)):
+        writer.add_raw_row(store.get_raw(i), store.get_key(i))
+    writer.write(path, {})
+
+    copy = colstore.ColumnStore(path)
+    try:
+        for i, tags in enumerate(TRACKS):
+            assert copy.get_tags(i) == tags
+    finally:
+        copy.close()
+
+
+def test_not_a_store(tmpdir):
+    path = join(str(tmpdir), 'other')
+    with open(path, 'wb') as fp:
+        fp.write(b'something else')
+    assert not colstore.is_column_store(path)
+    assert not colstore.is_column_store(join(str(tmpdir), 'missing'))
@@ -427,3 +427,106 @@ class TestSearchTracks(object):
         assert gen.next().track == tracks[2]
         with pytest.raises(StopIteration):
             gen.next()
+
+
+class TestSearchIndex(object):
+    def setup(self):
+        from xl.trax import TrackDB
+
+        self.db = TrackDB('index-test')
+        self.tracks = []
+        for i, (artist, album) in enumerate(
+            [
+                (u'Foo Fighters', u'Wasting Light'),
+                (u'Foo', u'Bar'),
+                (u'Mötley Crüe', u'Dr. Feelgood'),
+                (None, u'Untitled'),
+            ]
+        ):
+            tr = track.Track('file:///index/%d.ogg' % i, scan=False)
+            tr.set_tags(artist=artist, album=album, __length=60 * (i + 1))
+            self.tracks.append(tr)
+        self.db.add_tracks(self.tracks)
+
+    @pytest.mark.parametrize(
+        "sstr",
+        [
+            u'foo',
+            u'fighters light',
+            u'oo',
+            u'crue',
+            u'artist==foo',
+            u'artist==Foo',
+            u'artist==__null__',
+            u'! artist=foo',
+            u'artist=foo | album=untitled',
+            u'__length>100',
+            u'__length<130',
+            u'album~^[WD]',
+            u'dr.',
+            u'',
+        ],
+    )
+    @pytest.mark.parametrize("case_sensitive", [True, False])
+    def test_same_results(self, sstr, case_sensitive):
+        kwargs = dict(case_sensitive=case_sensitive, keyword_tags=['artist', 'album'])
+        expected = search.search_tracks_from_string(self.tracks, sstr, **kwargs)
+        found = search.search_tracks_from_string(self.db, sstr, **kwargs)
+        assert {r.track for r in found} == {r.track for r in expected}
+
+    def test_tags_changed(self):
+        gen = search.search_tracks_from_string(self.db, u'artist==baz')
+        assert list(gen) == []
+        self.tracks[1].set_tags(artist=u'baz')
+        gen = search.search_tracks_from_string(self.db, u'artist==baz')
+        assert [r.track for r in gen] == [self.tracks[1]]
+
+    def test_removed(self):
+        self.db.remove(self.tracks[0])
+        gen = search.search_tracks_from_string(self.db, u'Foo', keyword_tags=['artist'])
+        assert [r.track for r in gen] == [self.tracks[1]]
+
+    def test_group_lowered(self):
+        both = track.Track('file:///index/both.ogg', scan=False)
+        both.set_tags(artist=[u'FOO', u'Mötley Crüe'])
+        self.db.add_tracks([both])
+
+        # the index holds the values without diacritics
+        groups = self.db.get_search_index().group_lowered(
+            'artist', {u'foo', u'motley crue', u'nobody'}
+        )
+        assert groups == {
+            u'foo': {self.tracks[1], both},
+            u'motley crue': {self.tracks[2], both},
+        }
+
+    @pytest.mark.parametrize(
+        "sstr", [u'foo', u'artist==foo', u'artist=foo album=light', u'! album=bar']
+    )
+    def test_same_on_tags(self, sstr):
+        kwargs = dict(case_sensitive=False, keyword_tags=['artist', 'album'])
+        expected = search.search_tracks_from_string(self.tracks, sstr, **kwargs)
+        found = search.search_tracks_from_string(self.db, sstr, **kwargs)
+        assert {r.track: r.on_tags for r in found} == {
+            r.track: r.on_tags for r in expected
+        }
+
+    def test_exact_not_matched_again(self, monkeypatch):
+        matched = []
+        match = search._Matcher.match
+
+        def record_match(matcher, srtrack):
+            matched.append(srtrack.track)
+            return match(matcher, srtrack)
+
+        monkeypatch.setattr(search._Matcher, 'match', record_match)
+        gen = search.search_tracks_from_string(self.db, u'artist==Foo')
+        assert [r.track for r in gen] == [self.tracks[1]]
+        assert matched == []
+
+        # keywords have to be matched to know the tags they matched in
+        gen = search.search_tracks_from_string(
+            self.db, u'Foo', keyword_tags=['artist', 'album']
+        )
+        assert {r.track for r in gen} == {self.tracks[0], self.tracks[1]}
+        assert matched
@@ -469,6 +469,24 @@ class TestTrack(object):
         tr.set_tag_raw('coverart', val)
         assert tr.get_tag_sort('coverart') == ret
 
+    def test_get_sort_tag_cache_tags_changed(self):
+        tr = track.Track('/foo')
+        tr.set_tag_raw('artist', u'foo')
+        assert tr.get_tag_sort('artist') == u'foo foo foo foo'
+        tr.set_tag_raw('artist', u'bar')
+        assert tr.get_tag_sort('artist') == u'bar bar bar bar'
+
+    def test_get_sort_tag_cache_strip_list(self):
+        tr = track.Track('/foo')
+        tr.set_tag_raw('artist', u'The Foo')
+        settings.set_option('collection/strip_list', [])
+        track.Track._the_cuts_cb(None, None, 'collection/strip_list')
+        assert tr.get_tag_sort('artist') == u'the foo the foo The Foo The Foo'
+
+        settings.set_option('collection/strip_list', ['the'])
+        track.Track._the_cuts_cb(None, None, 'collection/strip_list')
+        assert tr.get_tag_sort('artist') == u'foo the foo The Foo The Foo'
+
     ## Display Tags
     def test_get_display_tag_loc(self):
         tr = track.Track('/foo')
@@ -0,0 +1,181 @@
+import os
+from os.path import join
+
+import pytest
+
+from xl import settings
+from xl.trax import Track, TrackDB, colstore
+
+
+@pytest.fixture
+def location(tmpdir):
+    return join(str(tmpdir), 'music.db')
+
+
+def _forget_tracks():
+    for key in Track._Track__tracksdict.keys():
+        del Track._Track__tracksdict[key]
+
+
+def _make_db(location, count=3):
+    db = TrackDB('test', location)
+    for i in range(count):
+        tr = Track('file:///music/%d.ogg' % i, scan=False)
+        tr.set_tags(title=u'title %d' % i)
+        db.add(tr)
+    db.compact()
+    return db
+
+
+def test_journal_replay(location):
+    db = _make_db(location)
+    db.get_track_by_loc('file:///music/1.ogg').set_tags(title=u'changed')
+    db.remove(db.get_track_by_loc('file:///music/2.ogg'))
+    db.save_to_location()
+
+    assert os.path.exists(location + '.journal')
+
+    del db
+    _forget_tracks()
+
+    db = TrackDB('test', location)
+    assert len(db) == 2
+    assert db.get_track_by_loc('file:///music/1.ogg').get_tag_raw('title') == [
+        u'changed'
+    ]
+    assert db.get_track_by_loc('file:///music/2.ogg') is None
+
+
+def test_journal_replay_keeps_keys_unique(location):
+    db = _make_db(location)
+    db.add(Track('file:///music/3.ogg', scan=False))
+    db.save_to_location()
+
+    assert os.path.exists(location + '.journal')
+
+    del db
+    _forget_tracks()
+
+    db = TrackDB('test', location)
+    db.add(Track('file:///music/4.ogg', scan=False))
+    keys = [holder._key for holder in db.tracks.values()]
+    assert len(keys) == 5
+    assert len(set(keys)) == 5
+
+
+def test_journal_damaged_end(location):
+    db = _make_db(location)
+    db.get_track_by_loc('file:///music/0.ogg').set_tags(title=u'saved')
+    db.save_to_location()
+
+    with open(location + '.journal', 'ab') as fp:
+        fp.write(b'\x80\x02(U\x05tra')
+
+    del db
+    _forget_tracks()
+
+    db = TrackDB('test', location)
+    assert db.get_track_by_loc('file:///music/0.ogg').get_tag_raw('title') == [u'saved']
+
+
+def test_compact(location):
+    db = _make_db(location)
+    db.journal_compact_threshold = 1
+    db.get_track_by_loc('file:///music/0.ogg').set_tags(title=u'one')
+    db.save_to_location()
+    db.get_track_by_loc('file:///music/0.ogg').set_tags(title=u'two')
+    db.save_to_location()
+
+    assert not os.path.exists(location + '.journal')
+
+    del db
+    _forget_tracks()
+
+    db = TrackDB('test', location)
+    assert db.get_track_by_loc('file:///music/0.ogg').get_tag_raw('title') == [u'two']
+
+
+def test_compact_keeps_unloaded_tracks(location, monkeypatch):
+    _make_db(location)
+    _forget_tracks()
+
+    # the store is closed before the file is replaced there
+    monkeypatch.setattr('sys.platform', 'win32')
+    db = TrackDB('test', location)
+    db.journal_compact_threshold = 1
+
+    titles = []
+    write_temp = colstore.ColumnStoreWriter.write_temp
+
+    def write_while_loading(writer, path, attrs):
+        # another thread creating a track while the new file is written
+        track = db.get_track_by_loc('file:///music/1.ogg')
+        titles.append(track.get_tag_raw('title'))
+        return write_temp(writer, path, attrs)
+
+    monkeypatch.setattr(colstore.ColumnStoreWriter, 'write_temp', write_while_loading)
+    db.get_track_by_loc('file:///music/0.ogg').set_tags(title=u'one')
+    db.save_to_location()
+    db.get_track_by_loc('file:///music/0.ogg').set_tags(title=u'two')
+    db.save_to_location()
+
+    assert not os.path.exists(location + '.journal')
+    assert titles == [[u'title 1']]
+    assert db.get_track_by_loc('file:///music/2.ogg').get_tag_raw('title') == [
+        u'title 2'
+    ]
+
+
+def test_track_groups():
+    db = TrackDB('test')
+    tracks = []
+    for i, (artist, album) in enumerate(
+        [(u'a', u'x'), (u'a', u'y'), (u'b', u'x'), (u'b', u'x')]
+    ):
+        tr = Track('file:///music/groups/%d.ogg' % i, scan=False)
+        tr.set_tags(artist=artist, album=album, title=u'%d' % i)
+        tracks.append(tr)
+    db.add_tracks(tracks)
+
+    def keys(children):
+        return [key for key, groups in children]
+
+    a, b = [(tr.get_tag_sort('artist'),) for tr in tracks[1:3]]
+    x = (tracks[0].get_tag_sort('album'),)
+
+    groups = db.get_track_groups([('artist',), ('album',), ('title',)])
+    artists = groups.get_children(None)
+    assert keys(artists) == [a, b]
+    albums = groups.get_children(artists[1][1])
+    assert keys(albums) == [x]
+    assert groups.get_tracks(albums[0][1]) == set(tracks[2:])
+
+    tracks[0].set_tags(artist=u'b')
+    assert groups.get_tracks(artists[1][1]) == {tracks[0]} | set(tracks[2:])
+
+    db.remove_tracks(tracks[1:2])
+    assert keys(groups.get_children(None)) == [b]
+    assert db.get_track_groups([('artist',), ('album',), ('title',)]) is groups
+
+
+def test_track_groups_follow_strip_list(monkeypatch):
+    def set_strip_list(strip_list):
+        monkeypatch.setattr(
+            settings, 'get_option', lambda name, default=None: strip_list
+        )
+        Track._the_cuts_cb('collection_option_set', None, 'collection/strip_list')
+
+    db = TrackDB('test')
+    tr = Track('file:///music/groups/strip.ogg', scan=False)
+    tr.set_tags(artist=u'The Band')
+    db.add_tracks([tr])
+    levels = [('artist',), ('title',)]
+
+    set_strip_list(['the'])
+    groups = db.get_track_groups(levels)
+    old_keys = [key for key, group in groups.get_children(None)]
+    set_strip_list([])
+    groups = db.get_track_groups(levels)
+    new_keys = [key for key, group in groups.get_children(None)]
+    assert new_keys == [(tr.get_tag_sort('artist'),)]
+    assert new_keys != old_keys
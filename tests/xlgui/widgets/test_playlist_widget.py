@@ -0,0 +1,303 @@
+import threading
+
+from gi.repository import Gtk
+
+import pytest
+
+from xl import playlist, trax
+from xl.trax import Track
+from xl.trax.index import TrackIndex
+from xlgui.widgets import playlist as playlist_widget
+from xlgui.widgets.playlist import PlaylistModel, PlaylistView, _is_filter_refinement
+
+
+def get_track(i, title):
+    tr = Track('file:///tmp/playlist-widget-test-%d.ogg' % i, scan=False)
+    tr.set_tags(title=title)
+    return tr
+
+
+class FakeView(object):
+    '''
+        Runs the filter code of PlaylistView without a widget
+    '''
+
+    _filter_tracks_thread = PlaylistView.__dict__['_filter_tracks_thread']
+    _filter_tracks_done = PlaylistView.__dict__['_filter_tracks_done']
+    _forget_filter_results = PlaylistView.__dict__['_forget_filter_results']
+    _modelfilter_visible_func = PlaylistView.__dict__['_modelfilter_visible_func']
+    on_track_tags_changed = PlaylistView.__dict__['on_track_tags_changed']
+
+    def __init__(self, pl):
+        self.playlist = pl
+        self._filter_matcher = None
+        self._filter_state = None
+        self._filter_generation = 1
+        self._filter_changed = set()
+        self.refiltered = 0
+
+    def _refilter(self):
+        self.refiltered += 1
+
+    def filter(self, filter_string, previous=None, generation=1):
+        '''
+            Runs _filter_tracks_thread and waits for it
+        '''
+        matcher = trax.TracksMatcher(
+            filter_string, case_sensitive=False, keyword_tags=['title']
+        )
+        running = set(threading.enumerate())
+        self._filter_tracks_thread(
+            generation,
+            filter_string,
+            set(['title']),
+            matcher,
+            TrackIndex(self.playlist),
+            previous,
+        )
+        for thread in set(threading.enumerate()) - running:
+            thread.join(5)
+
+    def is_visible(self, track):
+        return self._modelfilter_visible_func(FakeModel(), track, None)
+
+
+class FakeModel(object):
+    def get_value(self, iter, column):
+        return iter
+
+
+def done_calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        playlist_widget.GLib, 'idle_add', lambda *args: calls.append(args)
+    )
+    return calls
+
+
+def test_is_filter_refinement():
+    assert _is_filter_refinement(u'foo', u'foo bar')
+    assert not _is_filter_refinement(u'foo bar', u'foo')
+    assert not _is_filter_refinement(u'foo', u'bar')
+    assert not _is_filter_refinement(u'foo', u'foo | bar')
+    assert not _is_filter_refinement(u'foo', u'foo title=bar')
+    assert not _is_filter_refinement(u'foo', u'foo "bar')
+
+
+def test_filter(monkeypatch):
+    calls = done_calls(monkeypatch)
+    a, b, c = get_track(1, u'one'), get_track(2, u'two'), get_track(3, u'three')
+    view = FakeView(playlist.Playlist('test', [a, b, c]))
+
+    view.filter(u'o')
+    assert len(calls) == 1
+    view._filter_tracks_done(*calls[0][1:])
+    assert view.refiltered == 1
+    assert view._filter_state[2] == set([a, b])
+    assert view._filter_state[3] == set([a, b, c])
+    assert [view.is_visible(tr) for tr in (a, b, c)] == [True, True, False]
+
+
+def test_filter_refinement(monkeypatch):
+    calls = done_calls(monkeypatch)
+    a, b, c = get_track(1, u'one'), get_track(2, u'two'), get_track(3, u'tone')
+    view = FakeView(playlist.Playlist('test', [a, b, c]))
+
+    # c was added after the previous filter, a and b were checked
+    view.filter(u'on', previous=(set([b]), set([a, b])))
+    matches = calls[0][3][2]
+    assert matches == set([c])
+
+
+def test_filter_cancelled(monkeypatch):
+    calls = done_calls(monkeypatch)
+    tracks = [get_track(i, u'title') for i in range(3)]
+    view = FakeView(playlist.Playlist('test', tracks))
+
+    # a newer filter was started already
+    view._filter_generation = 2
+    view.filter(u'title', generation=1)
+    assert calls == []
+
+    # a newer filter is started while this one runs
+    searched = []
+
+    def search_tracks(trackiter, matchers, index):
+        for track in trackiter:
+            searched.append(track)
+            view._filter_generation += 1
+            yield trax.SearchResultTrack(track)
+
+    monkeypatch.setattr(trax, 'search_tracks', search_tracks)
+    view.filter(u'title', generation=view._filter_generation)
+    assert len(searched) == 1
+    assert calls == []
+
+    # results of a filter that was replaced are dropped
+    view._filter_tracks_done(1, None, (u'title', set(), set(), set()))
+    assert view._filter_state is None
+    assert view.refiltered == 0
+
+
+def test_filter_follows_tag_changes(monkeypatch):
+    calls = done_calls(monkeypatch)
+    a, b = get_track(1, u'one'), get_track(2, u'two')
+    view = FakeView(playlist.Playlist('test', [a, b]))
+
+    view.filter(u'one')
+    view._filter_tracks_done(*calls[0][1:])
+    assert [view.is_visible(tr) for tr in (a, b)] == [True, False]
+
+    a.set_tags(title=u'two')
+    b.set_tags(title=u'one')
+    view.on_track_tags_changed('track_tags_changed', set([a, b]), set(['title']))
+    assert [view.is_visible(tr) for tr in (a, b)] == [False, True]
+
+
+def test_filter_forgets_tracks_changed_while_running(monkeypatch):
+    calls = done_calls(monkeypatch)
+    a, b = get_track(1, u'one'), get_track(2, u'two')
+    view = FakeView(playlist.Playlist('test', [a, b]))
+
+    view.filter(u'one')
+    # changed before the results arrive on the main thread
+    a.set_tags(title=u'two')
+    view.on_track_tags_changed('track_tags_changed', set([a]), set(['title']))
+    view._filter_tracks_done(*calls[0][1:])
+    assert not view.is_visible(a)
+
+
+class FakePixbuf(object):
+    def __init__(self, name):
+        self.pixbuf = name
+
+
+class FakePlayer(object):
+    class queue(object):
+        current_playlist = None
+
+    current = None
+
+    def get_state(self):
+        return 'stopped'
+
+
+class FakeParent(object):
+    '''
+        Removes the event callbacks of the model when destroyed
+    '''
+
+    def __init__(self):
+        self.callbacks = []
+
+    def connect(self, signal, callback):
+        self.callbacks.append(callback)
+
+    def destroy(self):
+        for callback in self.callbacks:
+            callback(self)
+
+
+@pytest.yield_fixture
+def make_model(monkeypatch):
+    def _setup_icons(self):
+        for name in ('play', 'pause', 'stop', 'play_stop', 'pause_stop', 'clear'):
+            setattr(self, name + '_pixbuf', FakePixbuf(name))
+
+    monkeypatch.setattr(PlaylistModel, '_setup_icons', _setup_icons)
+    parent = FakeParent()
+
+    def make_model(tracks):
+        pl = playlist.Playlist('test', tracks)
+        return PlaylistModel(pl, ['title'], FakePlayer(), parent)
+
+    yield make_model
+    parent.destroy()
+
+
+def get_tracks(count):
+    return [get_track(i, u'track %d' % i) for i in range(count)]
+
+
+def test_model_iter(make_model):
+    tracks = get_tracks(3)
+    model = make_model(tracks)
+    assert model.do_iter_n_children(None) == 3
+
+    valid, itr = model.do_get_iter(Gtk.TreePath((0,)))
+    assert valid
+    values = [model.do_get_value(itr, model.COL_TRACK)]
+    while model.do_iter_next(itr):
+        values.append(model.do_get_value(itr, model.COL_TRACK))
+    assert values == tracks
+    assert model.do_get_path(itr).get_indices() == [2]
+
+    assert model.do_get_iter(Gtk.TreePath((3,))) == (False, None)
+    valid, itr = model.do_iter_nth_child(None, 1)
+    assert model.do_get_value(itr, model.COL_TRACK) is tracks[1]
+
+
+def test_model_row_params(make_model, monkeypatch):
+    model = make_model(get_tracks(2))
+    computed = []
+    compute_row_params = model._compute_row_params
+
+    def _compute_row_params(position):
+        computed.append(position)
+        return compute_row_params(position)
+
+    monkeypatch.setattr(model, '_compute_row_params', _compute_row_params)
+    itr = model.do_get_iter(Gtk.TreePath((1,)))[1]
+    values = [model.do_get_value(itr, column) for column in model.PARAM_COLS]
+    assert values[:2] == ['clear', True]
+    assert computed == [1]
+
+    # rows are computed again when they change
+    model.playlist.spat_position = 0
+    model.on_spat_position_changed('playlist_spat_position_changed', None, [-1, 0])
+    assert model.do_get_value(itr, model.COL_PIXBUF) == 'clear'
+    assert computed == [1, 1]
+    itr = model.do_get_iter(Gtk.TreePath((0,)))[1]
+    assert model.do_get_value(itr, model.COL_PIXBUF) == 'stop'
+
+
+def test_model_insert_remove(make_model):
+    tracks = get_tracks(4)
+    model = make_model(tracks[:2])
+    inserted, deleted = [], []
+    model.connect('row-inserted', lambda m, path, itr: inserted.append(path))
+    model.connect('row-deleted', lambda m, path: deleted.append(path))
+
+    model.on_tracks_added(
+        'playlist_tracks_added', model.playlist, [(1, tracks[2]), (3, tracks[3])]
+    )
+    assert [path.get_indices() for path in inserted] == [[1], [3]]
+    assert model.do_iter_n_children(None) == 4
+    itr = model.do_get_iter(Gtk.TreePath((1,)))[1]
+    assert model.do_get_value(itr, model.COL_TRACK) is tracks[2]
+
+    model.on_tracks_removed(
+        'playlist_tracks_removed', model.playlist, [(0, tracks[0]), (1, tracks[2])]
+    )
+    assert [path.get_indices() for path in deleted] == [[1], [0]]
+    itr = model.do_get_iter(Gtk.TreePath((0,)))[1]
+    assert model.do_get_value(itr, model.COL_TRACK) is tracks[1]
+    assert model.do_get_iter(Gtk.TreePath((2,))) == (False, None)
+
+
+def test_model_loading(make_model):
+    tracks = get_tracks(1000)
+    model = make_model([])
+    inserted, loading = [], []
+    model.connect('row-inserted', lambda m, path, itr: inserted.append(path))
+    model.connect('data-loading', lambda m, value: loading.append(value))
+
+    # many rows are loaded without a signal for each of them
+    model.on_tracks_added(
+        'playlist_tracks_added', model.playlist, list(enumerate(tracks))
+    )
+    assert inserted == []
+    assert loading == [True, False]
+    assert model.do_iter_n_children(None) == 1000
+    itr = model.do_get_iter(Gtk.TreePath((999,)))[1]
+    assert model.do_get_value(itr, model.COL_TRACK) is tracks[999]
@@ -0,0 +1,82 @@
+#!/usr/bin/env python2
+#
+# Copyright (C) 2018 The Exaile developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+'''
+    Measures formatting tracks with a TrackFormatter, with and without
+    the track format cache.
+
+    Run from the source directory:
+
+        EXAILE_DIR=. PYTHONPATH=. python2 tools/benchmarks/format_tracks.py
+'''
+
+from __future__ import print_function
+
+import argparse
+import time
+
+TEMPLATES = [
+    '$title',
+    '${tracknumber:pad=2, padstring=0} - $title',
+    '${artist:compilate} - ${album:prefix=[, suffix=]} (${__length:format=long})',
+]
+
+
+def make_tracks(count):
+    from xl.trax import Track
+
+    tracks = []
+    for i in xrange(count):
+        tr = Track('file:///music/format/%d.ogg' % i, scan=False)
+        tr.set_tags(
+            artist=u'The Artist %d' % (i // 120),
+            album=u'Album %d' % (i // 12),
+            title=u'Title %d' % i,
+            tracknumber=u'%d/12' % (i % 12 + 1),
+            __length=180.0 + i % 120,
+        )
+        tracks.append(tr)
+    return tracks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tracks', type=int, default=2000)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    from xl.formatter import TrackFormatter
+
+    tracks = make_tracks(args.tracks)
+
+    for template in TEMPLATES:
+        for label, cache in (('uncached', False), ('cached', True)):
+            formatter = TrackFormatter(template, cache=cache)
+            best = None
+            for _ in xrange(args.runs):
+                start = time.time()
+                for track in tracks:
+                    formatter.format(track)
+                elapsed = time.time() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print('%-9s %8.3fus  %s' % (label, best / len(tracks) * 1e6, template))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python2
+#
+# Copyright (C) 2018 The Exaile developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+
+'''
+    Measures reading some of the most frequently read options: parsing
+    the stored string each time (as get_option used to do), get_option
+    with its value cache, and an option handle.
+
+    Run from the source directory:
+
+        EXAILE_DIR=. PYTHONPATH=. python2 tools/benchmarks/settings_options.py
+'''
+
+from __future__ import print_function
+
+import argparse
+import functools
+import time
+
+OPTIONS = [
+    ('gui/sync_on_tag_change', True),
+    ('rating/maximum', 5),
+    ('gui/display_track_counts', True),
+    ('gui/columns', ['tracknumber', 'title', 'album', 'artist', '__length']),
+    ('collection/strip_list', ['the', 'a', 'an']),
+]
+
+
+def parse(manager, option):
+    # what get_option did before values were cached
+    section, key = option.rsplit('/', 1)
+    return manager._str_to_val(manager.get(section, key))
+
+
+def measure(label, readers, count):
+    for option, read in readers:
+        start = time.time()
+        for _ in xrange(count):
+            read()
+        elapsed = time.time() - start
+        print('%-10s %-26s %8.3fus' % (label, option, elapsed / count * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--reads', type=int, default=100000)
+    args = parser.parse_args()
+
+    from xl.settings import SettingsManager
+
+    manager = SettingsManager(None)
+    for option, value in OPTIONS:
+        manager.set_option(option, value, save=False)
+
+    def readers(make):
+        return [(option, make(option, default)) for option, default in OPTIONS]
+
+    measure(
+        'parse', readers(lambda o, d: functools.partial(parse, manager, o)), args.reads
+    )
+    measure(
+        'get',
+        readers(lambda o, d: functools.partial(manager.get_option, o, d)),
+        args.reads,
+    )
+    measure(
+        'handle', readers(lambda o, d: manager.get_option_handle(o, d).get), args.reads
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python2
+#
+# Copyright (C) 2018 The Exaile developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+'''
+    Measures sorting tracks by BASE_SORT_TAGS, with the sort key cache
+    of each track empty (as on the first sort, or after the strip list
+    changed) and filled.
+
+    Run from the source directory:
+
+        EXAILE_DIR=. PYTHONPATH=. python2 tools/benchmarks/sort_tracks.py
+'''
+
+from __future__ import print_function
+
+import argparse
+import random
+import time
+
+
+def make_tracks(count):
+    from xl.trax import Track
+
+    tracks = []
+    for i in xrange(count):
+        artist = u'The Artist %d' % (i // 120)
+        album = u'Album %d' % (i // 12)
+        tr = Track(
+            'file:///music/%s/%s/%d.ogg'
+            % (artist.encode('utf-8'), album.encode('utf-8'), i),
+            scan=False,
+        )
+        tr.set_tags(
+            artist=artist,
+            album=album,
+            title=u'Title %d' % i,
+            tracknumber=u'%d/12' % (i % 12 + 1),
+            date=u'%d' % (1960 + i % 60),
+        )
+        tracks.append(tr)
+    random.shuffle(tracks)
+    return tracks
+
+
+def invalidate():
+    # what happens when collection/strip_list is changed
+    from xl.trax import Track
+
+    Track._the_cuts_cb('collection_option_set', None, 'collection/strip_list')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tracks', type=int, default=100000)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    from xl import common
+    from xl.trax import sort_tracks
+
+    print('Creating %d tracks...' % args.tracks)
+    tracks = make_tracks(args.tracks)
+
+    for label, cold in (('uncached', True), ('cached', False)):
+        best = None
+        for _ in xrange(args.runs):
+            if cold:
+                invalidate()
+            start = time.time()
+            sort_tracks(common.BASE_SORT_TAGS, tracks)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print('%-9s %8.3fs' % (label, best))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python2
+#
+# Copyright (C) 2018 The Exaile developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+'''
+    Compares load time and memory usage of the shelf-based track database
+    (Exaile 4.0 and earlier) with the column store.
+
+    Run from the source directory:
+
+        EXAILE_DIR=. PYTHONPATH=. python2 tools/benchmarks/trackdb_load.py
+'''
+
+from __future__ import print_function
+
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def make_tags(i):
+    artist = u'Artist %d' % (i // 120)
+    album = u'Album %d' % (i // 12)
+    return {
+        '__loc': 'file:///music/%s/%s/%02d - Title %d.ogg'
+        % (artist.encode('utf-8'), album.encode('utf-8'), i % 12, i),
+        '__basedir': '/music/%s/%s' % (artist.encode('utf-8'), album.encode('utf-8')),
+        '__length': 180.0 + i % 300,
+        '__bitrate': 192000,
+        '__modified': 1500000000.0 + i,
+        '__date_added': 1500000000.0 + i,
+        '__playcount': i % 7,
+        'artist': [artist],
+        'album': [album],
+        'title': [u'Title %d' % i],
+        'tracknumber': [u'%d/12' % (i % 12 + 1)],
+        'date': [u'%d' % (1960 + i % 60)],
+        'genre': [u'Genre %d' % (i % 40)],
+    }
+
+
+def create(directory, count):
+    from xl import common
+    from xl.trax import colstore
+
+    shelf = common.open_shelf(os.path.join(directory, 'shelf.db'))
+    writer = colstore.ColumnStoreWriter()
+    for i in xrange(count):
+        tags = make_tags(i)
+        shelf['tracks-%d' % i] = (tags, i, {})
+        writer.add_row(tags, i)
+    attrs = {'_key': count, 'name': 'bench', '_dbversion': 2.0}
+    for k, v in attrs.iteritems():
+        shelf[k] = v
+    shelf.close()
+    writer.write(os.path.join(directory, 'colstore.db'), attrs)
+
+
+def load_shelf(path):
+    # This is what TrackDB.load_from_location used to do
+    from xl import common
+    from xl.trax import Track
+    from xl.trax.trackdb import TrackHolder
+
+    pdata = common.open_shelf(path)
+    data = {}
+    for k in (x for x in pdata.keys() if x.startswith("tracks-")):
+        p = pdata[k]
+        tr = Track(_unpickles=p[0])
+        data[tr.get_loc_for_io()] = TrackHolder(tr, p[1], **p[2])
+    pdata.close()
+    return data
+
+
+def load_colstore(path):
+    from xl.trax import TrackDB
+
+    return TrackDB('bench', path)
+
+
+def child(fmt, path):
+    # import everything up front so that only loading is measured
+    import xl.trax  # noqa: F401
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    if fmt == 'shelf':
+        db = load_shelf(path)
+    else:
+        db = load_colstore(path)
+    elapsed = time.time() - start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        '%-9s %7d tracks  %8.3fs  %+8.1f MiB'
+        % (fmt, len(db), elapsed, (rss - rss_before) / 1024.0)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tracks', type=int, default=250000)
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    directory = tempfile.mkdtemp()
+    try:
+        print('Creating databases with %d tracks...' % args.tracks)
+        create(directory, args.tracks)
+        for fmt, name in (('shelf', 'shelf.db'), ('colstore', 'colstore.db')):
+            subprocess.check_call(
+                [
+                    sys.executable,
+                    __file__,
+                    '--child',
+                    fmt,
+                    os.path.join(directory, name),
+                ]
+            )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
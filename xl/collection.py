@@ -38,8 +38,13 @@ from collections import deque
 from gi.repository import GLib
 from gi.repository import GObject
 from gi.repository import Gio
+import itertools
 import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
 import threading
+import time
 
 from xl import common, event, settings, trax
 
@@ -47,6 +52,9 @@ logger = logging.getLogger(__name__)
 
 COLLECTIONS = set()
 
+# number of files a scan worker reads at once
+SCAN_BATCH_SIZE = 50
+
 
 def get_collection_by_loc(loc):
     """
@@ -62,6 +70,151 @@ def get_collection_by_loc(loc):
     return None
 
 
+def _scan_worker(batch):
+    """
+        Reads the tags of a batch of files for :meth:`Library.rescan`.
+        Usually runs in a worker thread.
+
+        :param batch: directory uri, list of (uri, modified, mtime) tuples
+            (see :meth:`Track._read_file_tags`), list of uris of tracks
+            that are known to be unchanged
+        :returns: directory uri, list of (uri, format class, tags) tuples,
+            list of uris of unchanged tracks
+    """
+    diruri, jobs, unchanged = batch
+    results = []
+    for uri, modified, mtime in jobs:
+        try:
+            f, ntags = trax.Track._read_file_tags(uri, modified, mtime)
+        except Exception:
+            logger.exception("Error reading tags for %s", uri)
+            f = ntags = None
+        if f is not None and not isinstance(f, type):
+            f = type(f)
+        results.append((uri, f, ntags))
+    return diruri, results, unchanged
+
+
+class _LibraryDirectories(object):
+    """
+        Remembers the directories of a library between scans, so that
+        directories that have not changed since the last scan do not have
+        to be listed again, and neither do their files.
+
+        A directory is considered unchanged if its fingerprint (modification
+        time and number of entries) is the same. Adding, removing or renaming
+        entries changes the modification time of a directory; changing a
+        file in place does not, so such changes are only picked up by
+        forced rescans (or the library monitor). The rescan buttons of the
+        collection manager say so.
+    """
+
+    def __init__(self, library, libloc, force_update):
+        self.collection = library.collection
+        self.liburi = libloc.get_uri()
+        self.prefix = self.liburi.rstrip('/') + '/'
+        self.force_update = force_update
+        #: directories listed or confirmed unchanged during this scan
+        self.found = {}
+        #: directories that could not be listed completely
+        self.failed = set()
+
+        # tracks of the library by directory, for unchanged directories
+        self.tracks = {}
+        if not force_update:
+            for loc in self.collection.tracks.keys():
+                if self.contains(loc):
+                    self.tracks.setdefault(loc.rsplit('/', 1)[0], []).append(loc)
+
+    def contains(self, uri):
+        return uri == self.liburi or uri.startswith(self.prefix)
+
+    @staticmethod
+    def get_fingerprint(directory):
+        try:
+            info = directory.query_info(
+                "time::modified,time::modified-usec", Gio.FileQueryInfoFlags.NONE, None
+            )
+            # only the names are needed, so the entries are not stat'ed
+            count = 0
+            for child in directory.enumerate_children(
+                "standard::name", Gio.FileQueryInfoFlags.NOFOLLOW_SYMLINKS, None
+            ):
+                count += 1
+        except GLib.Error:
+            return None
+        return (
+            info.get_attribute_uint64('time::modified'),
+            info.get_attribute_uint32('time::modified-usec'),
+            count,
+        )
+
+    def listdir(self, directory, root):
+        """
+            Lists a directory for :func:`common.walk_by_directory`. For
+            unchanged directories, None is returned instead of the list of
+            files, see :meth:`get_tracks`.
+        """
+        uri = directory.get_uri()
+        # taken before listing, so that changes made while listing are
+        # noticed by the next scan
+        fingerprint = self.get_fingerprint(directory)
+
+        known = self.collection._directories.get(uri)
+        if (
+            not self.force_update
+            and fingerprint is not None
+            and known is not None
+            and known[0] == fingerprint
+        ):
+            self.found[uri] = known
+            return [Gio.File.new_for_uri(subdir) for subdir in known[1]], None
+
+        subdirs, files, complete = common.list_directory(directory, root)
+        if not complete:
+            self.failed.add(uri)
+        elif fingerprint is not None:
+            self.found[uri] = (
+                fingerprint,
+                [subdir.get_uri() for subdir in subdirs],
+                len(files),
+            )
+        return subdirs, files
+
+    def in_failed(self, uri):
+        """
+            Returns whether uri is in a directory that could not be listed
+            completely, so that its existence is unknown
+        """
+        while self.failed and self.contains(uri):
+            uri = uri.rsplit('/', 1)[0]
+            if uri in self.failed:
+                return True
+        return False
+
+    def get_tracks(self, uri):
+        """
+            Returns the locations of the tracks in an unchanged directory
+        """
+        return self.tracks.get(uri, [])
+
+    def save(self):
+        """
+            Replaces the directories of the library stored in the collection
+            with the ones found during this scan
+        """
+        directories = {
+            uri: entry
+            for uri, entry in self.collection._directories.iteritems()
+            if not self.contains(uri)
+        }
+        directories.update(self.found)
+        if directories != self.collection._directories:
+            # replaced rather than modified, it may be being saved
+            self.collection._directories = directories
+            self.collection._dirty = True
+
+
 class CollectionScanThread(common.ProgressThread):
     """
         Scans the collection
@@ -139,7 +292,10 @@ class Collection(trax.TrackDB):
         self._running_total_count = 0
         self._frozen = False
         self._libraries_dirty = False
-        pickle_attrs += ['_serial_libraries']
+        # directory uri -> (fingerprint, subdirectory uris, file count),
+        # see _LibraryDirectories
+        self._directories = {}
+        pickle_attrs += ['_serial_libraries', '_directories']
         trax.TrackDB.__init__(self, name, location=location, pickle_attrs=pickle_attrs)
         COLLECTIONS.add(self)
 
@@ -641,6 +797,19 @@ class Library(object):
         """
             Counts the number of files present in this directory
         """
+        # use the directories from the last scan if there are any, walking
+        # the whole library would take about as long as the scan itself
+        if self.collection:
+            libloc = Gio.File.new_for_uri(self.location)
+            directories = _LibraryDirectories(self, libloc, True)
+            known = [
+                entry
+                for uri, entry in self.collection._directories.iteritems()
+                if directories.contains(uri)
+            ]
+            if known:
+                return sum(1 + entry[2] for entry in known)
+
         count = 0
         for file in common.walk(Gio.File.new_for_uri(self.location)):
             if self.collection:
@@ -705,7 +874,17 @@ class Library(object):
 
         ccheck[basedir][album].append(artist)
 
-    def update_track(self, gloc, force_update=False):
+    @staticmethod
+    def _is_unchanged(tr, fileinfo):
+        """
+            Returns whether the file of an existing track has not been
+            modified since its tags were read, going by fileinfo as
+            returned by :func:`common.walk_by_directory`
+        """
+        modified = tr.get_tag_raw('__modified') or 0
+        return modified >= trax.Track._get_file_mtime(fileinfo)
+
+    def update_track(self, gloc, force_update=False, fileinfo=None):
         """
             Rescan the track at a given location
 
@@ -713,6 +892,9 @@ class Library(object):
             :type gloc: :class:`Gio.File`
             :param force_update: Force update of file (default only updates file
                                  when mtime has changed)
+            :param fileinfo: the file's :class:`Gio.FileInfo` including
+                time::modified, if already known. Unchanged files are then
+                skipped without accessing them at all.
 
             returns: the Track object, None if it could not be updated
         """
@@ -722,6 +904,8 @@ class Library(object):
 
         tr = self.collection.get_track_by_loc(uri)
         if tr:
+            if not force_update and fileinfo and self._is_unchanged(tr, fileinfo):
+                return tr
             tr.read_tags(force=force_update)
         else:
             tr = trax.Track(uri)
@@ -734,10 +918,131 @@ class Library(object):
                 self.collection.add(tr)
         return tr
 
+    def _check_directory_compilations(self, dirtracks):
+        """
+            Runs the compilation heuristic on the tracks of a directory
+        """
+        ccheck = {}
+        compilations = deque()
+        for tr in dirtracks:
+            self._check_compilation(ccheck, compilations, tr)
+        for (basedir, album) in compilations:
+            base = basedir.replace('"', '\\"')
+            alb = album.replace('"', '\\"')
+            items = [
+                tr
+                for tr in dirtracks
+                if tr.get_tag_raw('__basedir') == base and
+                # FIXME: this is ugly
+                alb in "".join(tr.get_tag_raw('album') or []).lower()
+            ]
+            for item in items:
+                item.set_tag_raw('__compilation', (basedir, album))
+
+    def _get_scan_batches(self, libloc, force_update, directories, window, done):
+        """
+            Walks the library, yielding batches of files for
+            :func:`_scan_worker`
+
+            :param directories: :class:`_LibraryDirectories` of the library
+            :param window: semaphore limiting how many batches may be
+                in flight, or None
+            :param done: event set once the scan is finished or canceled
+        """
+        for directory, files in common.walk_by_directory(libloc, directories.listdir):
+            diruri = directory.get_uri()
+            if files is None:
+                # unchanged directory
+                if window is not None:
+                    window.acquire()
+                if done.is_set() or self.collection._scan_stopped:
+                    return
+                yield diruri, [], directories.get_tracks(diruri)
+                continue
+
+            # an empty batch is still sent, so that the directory is counted
+            for i in xrange(0, len(files) or 1, SCAN_BATCH_SIZE):
+                jobs = []
+                unchanged = []
+                for fil, fileinfo in files[i : i + SCAN_BATCH_SIZE]:
+                    uri = fil.get_uri()
+                    if not uri:  # we get segfaults if this check is removed
+                        continue
+                    modified = None
+                    if not force_update:
+                        tr = self.collection.get_track_by_loc(uri)
+                        if tr:
+                            if self._is_unchanged(tr, fileinfo):
+                                unchanged.append(uri)
+                                continue
+                            modified = tr.get_tag_raw('__modified') or 0
+                    jobs.append((uri, modified, trax.Track._get_file_mtime(fileinfo)))
+
+                if window is not None:
+                    window.acquire()
+                if done.is_set() or self.collection._scan_stopped:
+                    return
+                yield diruri, jobs, unchanged
+
+    def _apply_scan_result(self, uri, format, ntags):
+        """
+            Merges the result of :func:`_scan_worker` for a file into the
+            collection
+
+            returns: the Track object, None if it could not be read
+        """
+        tr = self.collection.get_track_by_loc(uri)
+        if format is None:
+            if tr:
+                tr._scan_valid = False
+            return None
+
+        if tr:
+            if ntags is not None:
+                tr._set_tags_from_file(format, ntags)
+        else:
+            # New tracks are always read (modified is None). The Track may
+            # already exist outside of the collection, see update_track.
+            tr = trax.Track(uri, scan=False)
+            tr._set_tags_from_file(format, ntags)
+            self.collection.add(tr)
+        return tr
+
+    @staticmethod
+    def _create_scan_pool():
+        """
+            Starts the worker threads that read tags during a scan.
+            Returns None if tags should be read in the scanning thread.
+
+            Threads rather than processes are used: forking the running
+            Exaile process, with its GLib, GStreamer and D-Bus threads, is
+            not safe, and reading tags is mostly waiting for I/O anyway.
+        """
+        workers = settings.get_option('collection/scan_workers', 0)
+        if workers <= 0:
+            try:
+                workers = multiprocessing.cpu_count()
+            except NotImplementedError:
+                workers = 1
+
+        if workers <= 1:
+            return None, 1
+
+        try:
+            return ThreadPool(workers), workers
+        except Exception:
+            logger.warning("Could not start scan workers", exc_info=True)
+            return None, 1
+
     def rescan(self, notify_interval=None, force_update=False):
         """
             Rescan the associated folder and add the contained files
             to the Collection
+
+            The directory tree is walked in this thread, tags are read in
+            a pool of worker threads (see the collection/scan_workers
+            option), and the results are merged back into the Collection
+            in this thread, one directory at a time.
         """
         # TODO: use gio's cancellable support
 
@@ -751,40 +1056,53 @@ class Library(object):
         self.scanning = True
         libloc = Gio.File.new_for_uri(self.location)
 
+        pool, workers = self._create_scan_pool()
+        # keep the walk from getting too far ahead of the workers
+        window = threading.Semaphore(workers * 4) if pool else None
+        done = threading.Event()
+        directories = _LibraryDirectories(self, libloc, force_update)
+        batches = self._get_scan_batches(
+            libloc, force_update, directories, window, done
+        )
+        if pool:
+            results = pool.imap(_scan_worker, batches)
+        else:
+            results = itertools.imap(_scan_worker, batches)
+
         count = 0
+        notified = 0
+        found = set()
+        started = time.time()
+        diruri = None
         dirtracks = deque()
-        compilations = deque()
-        ccheck = {}
-        for fil in common.walk(libloc):
-            count += 1
-            type = fil.query_info(
-                "standard::type", Gio.FileQueryInfoFlags.NONE, None
-            ).get_file_type()
-            if type == Gio.FileType.DIRECTORY:
-                if dirtracks:
-                    for tr in dirtracks:
-                        self._check_compilation(ccheck, compilations, tr)
-                    for (basedir, album) in compilations:
-                        base = basedir.replace('"', '\\"')
-                        alb = album.replace('"', '\\"')
-                        items = [
-                            tr
-                            for tr in dirtracks
-                            if tr.get_tag_raw('__basedir') == base and
-                            # FIXME: this is ugly
-                            alb in "".join(tr.get_tag_raw('album') or []).lower()
-                        ]
-                        for item in items:
-                            item.set_tag_raw('__compilation', (basedir, album))
-                dirtracks = deque()
-                compilations = deque()
-                ccheck = {}
-            elif type == Gio.FileType.REGULAR:
-                tr = self.update_track(fil, force_update=force_update)
-                if not tr:
-                    continue
+        try:
+            for batch_diruri, batch, unchanged in results:
+                if window is not None:
+                    window.release()
+
+                # listeners get the tag changes and additions of each
+                # batch at once
+                with event.batch_events('track_tags_changed', 'tracks_added'):
+                    if batch_diruri != diruri:
+                        if dirtracks:
+                            self._check_directory_compilations(dirtracks)
+                        diruri = batch_diruri
+                        dirtracks = deque()
+                        count += 1
+
+                    found.update(unchanged)
+                    tracks = [
+                        self.collection.get_track_by_loc(uri) for uri in unchanged
+                    ]
+                    for uri, format, ntags in batch:
+                        found.add(uri)
+                        tracks.append(self._apply_scan_result(uri, format, ntags))
+
+                for tr in tracks:
+                    count += 1
+                    if not tr or dirtracks is None:
+                        continue
 
-                if dirtracks is not None:
                     dirtracks.append(tr)
                     # do this so that if we have, say, a 4000-song folder
                     # we dont get bogged down trying to keep track of them
@@ -797,51 +1115,77 @@ class Library(object):
                         logger.debug(
                             "Too many files, skipping "
                             "compilation detection heuristic for %s",
-                            fil.get_uri(),
+                            diruri,
                         )
                         dirtracks = None
 
-            if self.collection and self.collection._scan_stopped:
-                self.scanning = False
-                logger.info("Scan canceled")
-                return
+                if self.collection and self.collection._scan_stopped:
+                    self.scanning = False
+                    logger.info("Scan canceled")
+                    return
 
-            # progress update
-            if notify_interval is not None and count % notify_interval == 0:
-                event.log_event('tracks_scanned', self, count)
+                # progress update
+                if notify_interval is not None and count - notified >= notify_interval:
+                    notified = count
+                    event.log_event('tracks_scanned', self, count)
+
+            if dirtracks:
+                self._check_directory_compilations(dirtracks)
+            if pool:
+                pool.close()
+        finally:
+            done.set()
+            if pool:
+                # wake up the walk if it is waiting for the workers
+                for i in xrange(workers * 4):
+                    window.release()
+                pool.terminate()
+                pool.join()
+
+        elapsed = time.time() - started
+        logger.info(
+            "Scanned %d files in %.1fs (%.0f files/s, %d workers)",
+            count,
+            elapsed,
+            count / elapsed if elapsed else 0,
+            workers,
+        )
 
         # final progress update
         if notify_interval is not None:
             event.log_event('tracks_scanned', self, count)
 
+        # Tracks that were not found by the walk are gone. Only tracks in
+        # directories that could not be listed need to be checked.
         removals = deque()
-        for tr in self.collection.tracks.itervalues():
-            tr = tr._track
-            loc = tr.get_loc_for_io()
-            if not loc:
+        for loc in self.collection.tracks.keys():
+            if not loc or loc in found or not directories.contains(loc):
                 continue
-            gloc = Gio.File.new_for_uri(loc)
-            try:
-                if not gloc.has_prefix(libloc):
+            if directories.in_failed(loc):
+                if Gio.File.new_for_uri(loc).query_exists(None):
                     continue
-            except UnicodeDecodeError:
-                logger.exception("Error decoding file location")
-                continue
-
-            if not gloc.query_exists(None):
+            tr = self.collection.get_track_by_loc(loc)
+            if tr:
                 removals.append(tr)
 
         for tr in removals:
             logger.debug(u"Removing %s", unicode(tr))
             self.collection.remove(tr)
 
+        directories.save()
+
         logger.info("Scan completed: %s", self.location)
         self.scanning = False
 
-    def add(self, loc, move=False):
+    def add(self, loc, move=False, cancellable=None, progress_callback=None):
         """
             Copies (or moves) a file into the library and adds it to the
             collection
+
+            :param cancellable: a :class:`Gio.Cancellable` to stop the
+                copy with
+            :param progress_callback: called with the number of bytes
+                copied so far and the size of the file
         """
         oldgloc = Gio.File.new_for_uri(loc)
 
@@ -850,9 +1194,27 @@ class Library(object):
         )
 
         if move:
-            oldgloc.move(newgloc)
+            oldgloc.move(
+                newgloc, Gio.FileCopyFlags.NONE, cancellable, progress_callback
+            )
         else:
-            oldgloc.copy(newgloc)
+            existed = newgloc.query_exists(None)
+            try:
+                oldgloc.copy(
+                    newgloc, Gio.FileCopyFlags.NONE, cancellable, progress_callback
+                )
+            except GLib.Error:
+                # Don't leave a partial copy behind when cancelled
+                if (
+                    not existed
+                    and cancellable is not None
+                    and cancellable.is_cancelled()
+                ):
+                    try:
+                        newgloc.delete(None)
+                    except GLib.Error:
+                        pass
+                raise
         tr = trax.Track(newgloc.get_uri())
         if tr._scan_valid:
             self.collection.add(tr)
@@ -897,13 +1259,37 @@ class Library(object):
         pass
 
 
+def get_file_size(track):
+    """
+        Returns the size of the file of track in bytes, or 0 if it
+        cannot be determined
+    """
+    gloc = Gio.File.new_for_uri(track.get_loc_for_io())
+    try:
+        info = gloc.query_info(
+            Gio.FILE_ATTRIBUTE_STANDARD_SIZE, Gio.FileQueryInfoFlags.NONE, None
+        )
+    except GLib.Error:
+        return 0
+    return info.get_size()
+
+
 class TransferQueue(object):
+    """
+        Copies tracks into a library, see :meth:`transfer`
+
+        Sends ``track_transfer_progress`` events with the percentage of
+        bytes transferred; 100 is sent once the transfer is over.
+    """
+
     def __init__(self, library):
         self.library = library
         self.queue = []
         self.current_pos = -1
         self.transferring = False
+        self.cancellable = None
         self._stop = False
+        self._progress = -1
 
     def enqueue(self, tracks):
         self.queue.extend(tracks)
@@ -927,31 +1313,63 @@ class TransferQueue(object):
             This is NOT asynchronous
         """
         self.transferring = True
+        self.cancellable = Gio.Cancellable()
         self.current_pos += 1
+        sizes = [get_file_size(track) for track in self.queue]
+        total = sum(sizes)
+        done = sum(sizes[: self.current_pos])
+
+        def on_copy_progress(current, size, *args):
+            self._report_progress(done + current, total)
+
         try:
             while self.current_pos < len(self.queue) and not self._stop:
                 track = self.queue[self.current_pos]
                 loc = track.get_loc_for_io()
-                self.library.add(loc)
+                try:
+                    self.library.add(
+                        loc,
+                        cancellable=self.cancellable,
+                        progress_callback=on_copy_progress,
+                    )
+                except GLib.Error:
+                    if self.cancellable.is_cancelled():
+                        break
+                    raise
 
-                # TODO: make this be based on filesize not count
-                progress = self.current_pos * 100 / len(self.queue)
-                event.log_event('track_transfer_progress', self, progress)
+                done += sizes[self.current_pos]
+                self._report_progress(done, total)
 
                 self.current_pos += 1
         finally:
             self.queue = []
             self.transferring = False
+            self.cancellable = None
             self.current_pos = -1
             self._stop = False
+            self._progress = -1
             event.log_event('track_transfer_progress', self, 100)
 
+    def _report_progress(self, done, total):
+        """
+            Sends a progress event if the percentage has changed
+        """
+        if total:
+            progress = min(int(done * 100 / total), 99)
+        else:
+            progress = 0
+        if progress != self._progress:
+            self._progress = progress
+            event.log_event('track_transfer_progress', self, progress)
+
     def cancel(self):
         """
-            Cancel the current transfer
+            Cancel the current transfer, including the file being copied
         """
-        # TODO: make this stop mid-file as well?
         self._stop = True
+        cancellable = self.cancellable
+        if cancellable is not None:
+            cancellable.cancel()
 
 
 # vim: et sts=4 sw=4
@@ -41,6 +41,7 @@ import threading
 import urllib2
 import urlparse
 import weakref
+from contextlib import contextmanager
 from functools import wraps, partial
 from collections import deque
 from UserDict import DictMixin
@@ -140,20 +141,45 @@ def sanitize_url(url):
     return url
 
 
-def get_url_contents(url, user_agent):
+_url_timeout = threading.local()
+
+
+@contextmanager
+def url_timeout(timeout):
+    """
+        Makes :func:`get_url_contents` calls of the current thread that
+        don't pass their own timeout give up after timeout seconds
+    """
+    previous = getattr(_url_timeout, 'value', None)
+    _url_timeout.value = timeout
+    try:
+        yield
+    finally:
+        _url_timeout.value = previous
+
+
+def get_url_contents(url, user_agent, timeout=None):
     '''
         Retrieves data from a URL and sticks a user-agent on it. You can use
         exaile.get_user_agent_string(pluginname) to get this.
 
         Added in Exaile 3.4
 
+        :param timeout: seconds to wait for the server, defaults to the
+            one set by :func:`url_timeout`
         :returns: Contents of page located at URL
         :raises: urllib2.URLError
     '''
 
+    if timeout is None:
+        timeout = getattr(_url_timeout, 'value', None)
+    kwargs = {}
+    if timeout is not None:
+        kwargs['timeout'] = timeout
+
     headers = {'User-Agent': user_agent}
     req = urllib2.Request(url, None, headers)
-    fp = urllib2.urlopen(req)
+    fp = urllib2.urlopen(req, **kwargs)
     data = fp.read()
     fp.close()
 
@@ -561,38 +587,84 @@ def walk(root):
         :returns: a generator object
         :rtype: :class:`Gio.File`
     """
+    for dir, files in walk_by_directory(root):
+        yield dir
+        for fil, fileinfo in files:
+            yield fil
+
+
+def walk_by_directory(root, listdir=None):
+    """
+        Walk through a Gio directory, yielding each directory along
+        with the regular files in it
+
+        Directories are enumerated in the same order as :func:`walk`.
+        Each file comes with the :class:`Gio.FileInfo` it was enumerated
+        with, which includes its type, size and modification time.
+
+        :param root: a :class:`Gio.File` representing the
+            directory to walk through
+        :param listdir: function used instead of :func:`list_directory`
+            to get the contents of a directory, e.g. to skip directories
+            known to be unchanged
+        :returns: a generator object
+        :rtype: tuple of :class:`Gio.File` and list of
+            (:class:`Gio.File`, :class:`Gio.FileInfo`) tuples
+    """
+    if listdir is None:
+        listdir = list_directory
+
     queue = deque()
     queue.append(root)
 
     while len(queue) > 0:
         dir = queue.pop()
-        yield dir
-        try:
-            for fileinfo in dir.enumerate_children(
-                "standard::type,"
-                "standard::is-symlink,standard::name,"
-                "standard::symlink-target,time::modified",
-                Gio.FileQueryInfoFlags.NONE,
-                None,
-            ):
-                fil = dir.get_child(fileinfo.get_name())
-                # FIXME: recursive symlinks could cause an infinite loop
-                if fileinfo.get_is_symlink():
-                    target = fileinfo.get_symlink_target()
-                    if "://" not in target and not os.path.isabs(target):
-                        fil2 = dir.get_child(target)
-                    else:
-                        fil2 = Gio.File.new_for_uri(target)
-                    # already in the collection, we'll get it anyway
-                    if fil2.has_prefix(root):
-                        continue
-                type = fileinfo.get_file_type()
-                if type == Gio.FileType.DIRECTORY:
-                    queue.append(fil)
-                elif type == Gio.FileType.REGULAR:
-                    yield fil
-        except GLib.Error:  # why doesnt gio offer more-specific errors?
-            logger.exception("Unhandled exception while walking on %s.", dir)
+        subdirs, files = listdir(dir, root)[:2]
+        queue.extend(subdirs)
+        yield dir, files
+
+
+def list_directory(dir, root=None):
+    """
+        Lists the contents of a Gio directory, as used by
+        :func:`walk_by_directory`
+
+        :param dir: a :class:`Gio.File` representing the directory
+        :param root: symlinks pointing into this directory are skipped
+        :returns: subdirectories, (file, file info) tuples of regular
+            files, and whether the directory could be read completely
+        :rtype: tuple of list, list and bool
+    """
+    subdirs = []
+    files = []
+    try:
+        for fileinfo in dir.enumerate_children(
+            "standard::type,"
+            "standard::is-symlink,standard::name,"
+            "standard::symlink-target,standard::size,time::modified",
+            Gio.FileQueryInfoFlags.NONE,
+            None,
+        ):
+            fil = dir.get_child(fileinfo.get_name())
+            # FIXME: recursive symlinks could cause an infinite loop
+            if fileinfo.get_is_symlink():
+                target = fileinfo.get_symlink_target()
+                if "://" not in target and not os.path.isabs(target):
+                    fil2 = dir.get_child(target)
+                else:
+                    fil2 = Gio.File.new_for_uri(target)
+                # already in the collection, we'll get it anyway
+                if root is not None and fil2.has_prefix(root):
+                    continue
+            type = fileinfo.get_file_type()
+            if type == Gio.FileType.DIRECTORY:
+                subdirs.append(fil)
+            elif type == Gio.FileType.REGULAR:
+                files.append((fil, fileinfo))
+    except GLib.Error:  # why doesnt gio offer more-specific errors?
+        logger.exception("Unhandled exception while walking on %s.", dir)
+        return subdirs, files, False
+    return subdirs, files, True
 
 
 def walk_directories(root):
@@ -35,6 +35,10 @@ from gi.repository import Gio
 import logging
 import hashlib
 import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
 
 try:
     import cPickle as pickle
@@ -57,18 +61,106 @@ class Cacher(object):
         Note that as entries are stored as
         individual files, the data being stored should be of significant
         size (several KB) or a lot of disk space will likely be wasted.
+
+        Entries are spread over subdirectories named after the first
+        two characters of their key. If a maximum size is given, the
+        least recently used entries are removed whenever the total
+        size of all entries exceeds it.
+
+        Entries are written to a temporary file that is then renamed,
+        so they can be read without holding the lock.
     """
 
-    def __init__(self, cache_dir):
+    #: Prefix of the names of entries being written
+    TEMP_PREFIX = '.tmp'
+
+    def __init__(self, cache_dir, max_size=None):
         """
             :param cache_dir: directory to use for the cache. will be
                 created if it does not exist.
+            :param max_size: maximum total size of the entries in
+                bytes, or None for no limit
         """
         try:
             os.makedirs(cache_dir)
         except OSError:
             pass
         self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        # key -> size, least recently used first; only kept with max_size
+        self.entries = None
+        self.size = 0
+        self._move_flat_entries()
+
+    def _move_flat_entries(self):
+        """
+            Moves entries stored directly in the cache directory (as
+            done by older versions) into their subdirectory
+        """
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.cache_dir, name)
+            if not os.path.isfile(path):
+                continue
+            try:
+                self._make_dir(name)
+                os.rename(path, self._get_path(name))
+            except OSError:
+                logger.warning("Could not move cache entry %s", path)
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _make_dir(self, key):
+        try:
+            os.mkdir(os.path.join(self.cache_dir, key[:2]))
+        except OSError:
+            pass
+
+    def _get_entries(self):
+        """
+            Returns the mapping of keys to entry sizes, ordered from
+            least to most recently used. Must be called with the lock
+            held.
+        """
+        if self.entries is None:
+            found = []
+            for dirpath, dirnames, filenames in os.walk(self.cache_dir):
+                for name in filenames:
+                    if name.startswith(self.TEMP_PREFIX):
+                        continue
+                    try:
+                        st = os.stat(os.path.join(dirpath, name))
+                    except OSError:
+                        continue
+                    found.append((st.st_mtime, name, st.st_size))
+            found.sort()
+            self.entries = OrderedDict((name, size) for _, name, size in found)
+            self.size = sum(self.entries.itervalues())
+        return self.entries
+
+    def _evict(self, keep):
+        """
+            Removes least recently used entries until the cache fits
+            into max_size. Must be called with the lock held.
+
+            :param keep: key of an entry that must not be removed
+        """
+        entries = self.entries
+        while self.size > self.max_size and len(entries) > 1:
+            key, size = entries.popitem(last=False)
+            if key == keep:
+                entries[key] = size
+                continue
+            self.size -= size
+            try:
+                os.remove(self._get_path(key))
+            except OSError:
+                pass
 
     def add(self, data):
         """
@@ -83,22 +175,48 @@ class Cacher(object):
         h = hashlib.sha256()
         h.update(data)
         key = h.hexdigest()
-        path = os.path.join(self.cache_dir, key)
-        with open(path, "wb") as fp:
-            fp.write(data)
+        self.set(key, data)
         return key
 
+    def set(self, key, data):
+        """
+            Stores an entry under the given key, replacing any
+            existing entry.
+
+            :param key: The key to store data for.
+            :param data: The data to store, as a bytestring.
+        """
+        self._make_dir(key)
+        path = self._get_path(key)
+        fd, temp = tempfile.mkstemp(prefix=self.TEMP_PREFIX, dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(data)
+        except Exception:
+            os.remove(temp)
+            raise
+        with self.lock:
+            os.rename(temp, path)
+            if self.max_size is None:
+                return
+            entries = self._get_entries()
+            self.size += len(data) - entries.pop(key, 0)
+            entries[key] = len(data)
+            self._evict(key)
+
     def remove(self, key):
         """
             Remove an entry from the cache.
 
             :param key: The key to remove data for.
         """
-        path = os.path.join(self.cache_dir, key)
-        try:
-            os.remove(path)
-        except OSError:
-            pass
+        with self.lock:
+            try:
+                os.remove(self._get_path(key))
+            except OSError:
+                pass
+            if self.entries is not None:
+                self.size -= self.entries.pop(key, 0)
 
     def get(self, key):
         """
@@ -107,11 +225,114 @@ class Cacher(object):
 
             :param key: The key to retrieve data for.
         """
-        path = os.path.join(self.cache_dir, key)
-        if os.path.exists(path):
+        path = self._get_path(key)
+        try:
             with open(path, "rb") as fp:
-                return fp.read()
-        return None
+                data = fp.read()
+        except IOError:
+            with self.lock:
+                if self.entries is not None:
+                    self.size -= self.entries.pop(key, 0)
+            return None
+        if self.max_size is None:
+            return data
+
+        with self.lock:
+            entries = self._get_entries()
+            try:
+                entries[key] = entries.pop(key)
+            except KeyError:
+                # removed while it was being read
+                return data
+        # Keep the order across restarts
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+
+    def set_max_size(self, max_size):
+        """
+            Changes the maximum size, removing entries if necessary
+
+            :param max_size: maximum total size of the entries in
+                bytes, or None for no limit
+        """
+        with self.lock:
+            self.max_size = max_size
+            if max_size is None:
+                self.entries = None
+            else:
+                self._get_entries()
+                self._evict(None)
+
+
+class CoverDB(object):
+    """
+        Maps album keys (see :meth:`CoverManager._get_track_key`) to
+        db_strings, plus a ``'version'`` entry.
+
+        Entries are kept in a shelf, so changes are written one entry
+        at a time and entries are only read when they are looked up.
+    """
+
+    def __init__(self, path):
+        """
+            :param path: the location of the shelf
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.shelf = common.open_shelf(path)
+
+    @staticmethod
+    def _encode(key):
+        if isinstance(key, unicode):
+            return key.encode('utf-8')
+        return key
+
+    def __getitem__(self, key):
+        with self.lock:
+            return self.shelf[self._encode(key)]
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.shelf[self._encode(key)] = value
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self.shelf[self._encode(key)]
+
+    def __contains__(self, key):
+        if key is None:
+            return False
+        with self.lock:
+            return self._encode(key) in self.shelf
+
+    def __iter__(self):
+        with self.lock:
+            keys = self.shelf.keys()
+        for key in keys:
+            if key != 'version':
+                yield key.decode('utf-8')
+
+    def get(self, key, default=None):
+        if key is None:
+            return default
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def sync(self):
+        """
+            Writes pending changes to disk
+        """
+        with self.lock:
+            self.shelf.sync()
+
+    def close(self):
+        with self.lock:
+            self.shelf.close()
 
 
 class CoverManager(providers.ProviderHandler):
@@ -121,16 +342,25 @@ class CoverManager(providers.ProviderHandler):
 
     DB_VERSION = 2
 
+    #: Sizes in pixels of the thumbnails kept for each cover
+    THUMBNAIL_SIZES = (48, 100, 300)
+
     def __init__(self, location):
         """
             :param location: The directory to load and store data in.
         """
         providers.ProviderHandler.__init__(self, "covers")
         self.__cache = Cacher(os.path.join(location, 'cache'))
+        self.__thumbnails = Cacher(
+            os.path.join(location, 'thumbnails'), self._get_thumbnail_cache_size()
+        )
+        self.thumbnailer = None
         self.location = location
         self.methods = {}
         self.order = settings.get_option('covers/preferred_order', [])
-        self.db = {'version': self.DB_VERSION}
+        #: The pickled db of version 1, until it is migrated
+        self.legacy_db = None
+        self.db = None
         self.load()
         for method in self.get_providers():
             self.on_provider_added(method)
@@ -159,6 +389,78 @@ class CoverManager(providers.ProviderHandler):
                 providers.register('covers', self.localfile_fetcher)
             else:
                 providers.unregister('covers', self.localfile_fetcher)
+        elif data == "covers/thumbnail_cache_size":
+            self.__thumbnails.set_max_size(self._get_thumbnail_cache_size())
+
+    @staticmethod
+    def _get_thumbnail_cache_size():
+        # The option is in MiB
+        return settings.get_option('covers/thumbnail_cache_size', 64) * 1024 * 1024
+
+    def set_thumbnailer(self, thumbnailer):
+        """
+            Sets the function used to create thumbnails of covers.
+            Without one, no thumbnails are kept and the original
+            cover data is returned for all sizes.
+
+            :param thumbnailer: a callable taking the image data and
+                a list of sizes, returning a list with the data of a
+                thumbnail fitting into each size (or None where it
+                failed)
+        """
+        self.thumbnailer = thumbnailer
+
+    @staticmethod
+    def _get_thumbnail_key(db_string, size):
+        if isinstance(db_string, unicode):
+            db_string = db_string.encode('utf-8')
+        return '%s-%d' % (hashlib.sha256(db_string).hexdigest(), size)
+
+    def _add_thumbnails(self, db_string, data):
+        """
+            Creates and stores the thumbnails of a cover
+
+            :returns: mapping of sizes to thumbnail data
+        """
+        thumbnailer = self.thumbnailer
+        if thumbnailer is None or not data:
+            return {}
+        try:
+            thumbnails = thumbnailer(data, self.THUMBNAIL_SIZES)
+        except Exception:
+            logger.exception("Could not create thumbnails for %s", db_string)
+            return {}
+        result = {}
+        for size, thumbnail in zip(self.THUMBNAIL_SIZES, thumbnails):
+            if thumbnail:
+                self.__thumbnails.set(
+                    self._get_thumbnail_key(db_string, size), thumbnail
+                )
+                result[size] = thumbnail
+        return result
+
+    def _get_thumbnail(self, db_string, size, data=None):
+        """
+            Gets the smallest thumbnail of a cover that is at least
+            as large as size, creating the thumbnails if necessary
+
+            :param data: the original cover data, if already loaded
+            :returns: the thumbnail data, or None if there is no
+                thumbnail that large
+        """
+        if self.thumbnailer is None:
+            return None
+        for tier in self.THUMBNAIL_SIZES:
+            if tier >= size:
+                break
+        else:
+            return None
+        thumbnail = self.__thumbnails.get(self._get_thumbnail_key(db_string, tier))
+        if thumbnail is None:
+            if data is None:
+                data = self._get_cover_data(db_string)
+            thumbnail = self._add_thumbnails(db_string, data).get(tier)
+        return thumbnail
 
     def _get_methods(self, fixed=False):
         """
@@ -294,6 +596,7 @@ class CoverManager(providers.ProviderHandler):
         method = self.methods.get(name)
         if method and method.use_cache and data:
             db_string = "cache:%s" % self.__cache.add(data)
+        self._add_thumbnails(db_string, data)
         key = self._get_track_key(track)
         if key:
             self.db[key] = db_string
@@ -311,10 +614,14 @@ class CoverManager(providers.ProviderHandler):
         if db_string:
             del self.db[key]
             self.__cache.remove(db_string)
+            for size in self.THUMBNAIL_SIZES:
+                self.__thumbnails.remove(self._get_thumbnail_key(db_string, size))
             self.timeout_save()
             event.log_event('cover_removed', self, track)
 
-    def get_cover(self, track, save_cover=True, set_only=False, use_default=False):
+    def get_cover(
+        self, track, save_cover=True, set_only=False, use_default=False, size=None
+    ):
         """
             get the cover for a given track.
             if the track has no set cover, backends are
@@ -327,13 +634,16 @@ class CoverManager(providers.ProviderHandler):
                     in the db.
             :param use_default: If True, returns the default cover instead
                     of None when no covers are found.
+            :param size: If set, returns a thumbnail fitting the given
+                    size in pixels instead of the original cover where
+                    available, see :meth:`get_cover_data`.
         """
         if track is None:
             return self.get_default_cover() if use_default else None
 
         db_string = self.get_db_string(track)
         if db_string:
-            cover = self.get_cover_data(db_string, use_default=use_default)
+            cover = self.get_cover_data(db_string, use_default=use_default, size=size)
             if cover:
                 return cover
 
@@ -346,30 +656,43 @@ class CoverManager(providers.ProviderHandler):
             data = self.get_cover_data(cover, use_default=use_default)
             if save_cover and data != self.get_default_cover():
                 self.set_cover(track, cover, data)
+                # set_cover may have stored the data under a new db_string
+                cover = self.get_db_string(track) or cover
+            if size is not None and data != self.get_default_cover():
+                data = self._get_thumbnail(cover, size, data) or data
             return data
 
         return self.get_default_cover() if use_default else None
 
-    def get_cover_data(self, db_string, use_default=False):
+    def get_cover_data(self, db_string, use_default=False, size=None):
         """
             Get the raw image data for a cover.
 
             :param db_string: The db_string identifying the cover to get.
             :param use_default: If True, returns the default cover instead
                     of None when no covers are found.
+            :param size: If set, returns the smallest thumbnail at least
+                    this many pixels wide and high instead. The original
+                    is returned if no such thumbnail can be created.
         """
-        source, data = db_string.split(":", 1)
         ret = None
-        if source == "cache":
-            ret = self.__cache.get(data)
-        else:
-            method = self.methods.get(source)
-            if method:
-                ret = method.get_cover_data(data)
+        if size is not None:
+            ret = self._get_thumbnail(db_string, size)
+        if ret is None:
+            ret = self._get_cover_data(db_string)
         if ret is None and use_default is True:
             ret = self.get_default_cover()
         return ret
 
+    def _get_cover_data(self, db_string):
+        source, data = db_string.split(":", 1)
+        if source == "cache":
+            return self.__cache.get(data)
+        method = self.methods.get(source)
+        if method:
+            return method.get_cover_data(data)
+        return None
+
     def get_default_cover(self):
         """
             Get the raw image data for the cover to show if there is no
@@ -380,7 +703,38 @@ class CoverManager(providers.ProviderHandler):
 
     def load(self):
         """
-            Load the saved db
+            Load the saved db, importing the pickled db used by
+            older versions
+        """
+        self.db = CoverDB(os.path.join(self.location, 'covers.shelf'))
+
+        if 'version' not in self.db:
+            data = self._load_legacy_db()
+            if data is None:
+                self.db['version'] = self.DB_VERSION
+            elif data.get('version', 1) == 1:
+                # Needs the collection, see migrations.database.covers_1to2
+                self.legacy_db = data
+            else:
+                logger.info("Importing covers.db into %s", self.db.path)
+                for key, value in data.iteritems():
+                    self.db[key] = value
+                self.db.sync()
+                self.remove_legacy_db()
+
+        version = self.db.get('version', 1)
+        if version > self.DB_VERSION:
+            logger.error(
+                "covers.db version (%s) higher than supported (%s); using anyway",
+                version,
+                self.DB_VERSION,
+            )
+
+    def _load_legacy_db(self):
+        """
+            Loads the db pickled by older versions
+
+            :returns: the db, or None if there is none
         """
         path = os.path.join(self.location, 'covers.db')
         data = None
@@ -396,16 +750,20 @@ class CoverManager(providers.ProviderHandler):
                 except Exception:
                     pass
             if data:
-                break
-        if data:
-            self.db = data
-        version = self.db.get('version', 1)
-        if version > self.DB_VERSION:
-            logger.error(
-                "covers.db version (%s) higher than supported (%s); using anyway",
-                version,
-                self.DB_VERSION,
-            )
+                return data
+        return None
+
+    def remove_legacy_db(self):
+        """
+            Removes the db pickled by older versions, once its
+            entries are in the current db
+        """
+        path = os.path.join(self.location, 'covers.db')
+        for loc in [path, path + ".old", path + ".new"]:
+            try:
+                os.remove(loc)
+            except OSError:
+                pass
 
     @common.glib_wait_seconds(60)
     def timeout_save(self):
@@ -415,21 +773,7 @@ class CoverManager(providers.ProviderHandler):
         """
             Save the db
         """
-        path = os.path.join(self.location, 'covers.db')
-        try:
-            with open(path + ".new", 'wb') as f:
-                pickle.dump(self.db, f, common.PICKLE_PROTOCOL)
-        except IOError:
-            return
-        try:
-            os.rename(path, path + ".old")
-        except OSError:
-            pass  # if it doesn'texist we don't care
-        os.rename(path + ".new", path)
-        try:
-            os.remove(path + ".old")
-        except OSError:
-            pass
+        self.db.sync()
 
     def on_provider_added(self, provider):
         self.methods[provider.name] = provider
@@ -473,6 +817,246 @@ class CoverManager(providers.ProviderHandler):
         return None  # No cover found
 
 
+class _CoverRequest(object):
+    """
+        A cover lookup for all tracks sharing an album key
+    """
+
+    __slots__ = ['key', 'track', 'waiters']
+
+    def __init__(self, key, track):
+        self.key = key
+        self.track = track
+        # List of (track, batch) to notify
+        self.waiters = []
+
+
+class _CoverBatch(object):
+    """
+        The tracks of one :meth:`CoverFetchScheduler.fetch` call
+    """
+
+    def __init__(self, total, callback, set_only, save_cover, size):
+        self.total = total
+        self.done = 0
+        self.callback = callback
+        self.set_only = set_only
+        self.save_cover = save_cover
+        self.size = size
+        self.condition = threading.Condition()
+
+    def deliver(self, track, data):
+        try:
+            self.callback(track, data)
+        except Exception:
+            logger.exception("Error in cover fetch callback")
+        with self.condition:
+            self.done += 1
+            self.condition.notify_all()
+
+
+class CoverFetchScheduler(object):
+    """
+        Fetches covers for many tracks on a pool of worker threads.
+
+        Each cover search method is queried by at most
+        ``method.concurrency`` threads at once. The methods are called
+        on the worker threads themselves, with the timeout applied to
+        their downloads through :func:`xl.common.url_timeout`. Tracks of
+        the same album are looked up only once, also across concurrent
+        :meth:`fetch` calls.
+    """
+
+    def __init__(self, manager=None, workers=None, timeout=None):
+        """
+            :param manager: the :class:`CoverManager` to use, defaults
+                to :data:`MANAGER`
+            :param workers: number of worker threads per :meth:`fetch`
+            :param timeout: seconds to wait for a free slot of a cover
+                search method, and for the servers it downloads from
+        """
+        self.manager = manager or MANAGER
+        if workers is None:
+            workers = settings.get_option('covers/fetch_workers', 4)
+        if timeout is None:
+            timeout = settings.get_option('covers/fetch_timeout', 15)
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        # album key -> _CoverRequest
+        self.requests = {}
+        # method name -> number of running calls
+        self.running = {}
+        self.slots = threading.Condition(self.lock)
+
+    def fetch(
+        self, tracks, callback, stopper=None, set_only=False, save_cover=True, size=None
+    ):
+        """
+            Fetches the covers of tracks, blocking until all are
+            done or the fetch is stopped.
+
+            :param tracks: the tracks to fetch covers for
+            :param callback: called as ``callback(track, data)`` from
+                a worker thread for each track, with data being None
+                if no cover was found, or if the lookup was shared with
+                a fetch that was stopped before running it. Tracks whose
+                lookup was already running when the fetch was stopped
+                may still be reported afterwards.
+            :param stopper: a :class:`threading.Event` that stops the
+                fetch when set
+            :param set_only, save_cover, size: see
+                :meth:`CoverManager.get_cover`
+            :returns: whether all tracks were processed
+        """
+        if stopper is None:
+            stopper = threading.Event()
+        tracks = list(tracks)
+        batch = _CoverBatch(len(tracks), callback, set_only, save_cover, size)
+        queue = deque()
+
+        with self.lock:
+            for track in tracks:
+                key = self.manager._get_track_key(track)
+                # Tracks without album key can't share a lookup
+                request = self.requests.get(key) if key else None
+                if request is None:
+                    request = _CoverRequest(key, track)
+                    if key:
+                        self.requests[key] = request
+                    queue.append(request)
+                request.waiters.append((track, batch))
+
+        threads = []
+        for i in xrange(min(self.workers, len(queue))):
+            thread = threading.Thread(
+                target=self._work,
+                name='CoverFetchWorker-%d' % i,
+                args=(queue, batch, stopper),
+            )
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        with batch.condition:
+            while batch.done < batch.total and not stopper.is_set():
+                batch.condition.wait(0.5)
+
+        if batch.done < batch.total:
+            # Forget requests that never ran. Other fetches may have
+            # joined them; these are told that there is no cover rather
+            # than left waiting for a lookup that never happens.
+            orphans = []
+            with self.lock:
+                while True:
+                    try:
+                        request = queue.popleft()
+                    except IndexError:
+                        break
+                    if self.requests.get(request.key) is request:
+                        del self.requests[request.key]
+                    orphans.extend(
+                        (track, waiter_batch)
+                        for track, waiter_batch in request.waiters
+                        if waiter_batch is not batch
+                    )
+                    request.waiters = []
+            for track, waiter_batch in orphans:
+                waiter_batch.deliver(track, None)
+            return False
+        return True
+
+    def _work(self, queue, batch, stopper):
+        while not stopper.is_set():
+            try:
+                request = queue.popleft()
+            except IndexError:
+                return
+            try:
+                data = self._get_cover(request.track, batch)
+            except Exception:
+                logger.exception("Error fetching cover for %s", request.track)
+                data = None
+            with self.lock:
+                if request.key and self.requests.get(request.key) is request:
+                    del self.requests[request.key]
+                waiters = request.waiters
+                request.waiters = []
+            for track, waiter_batch in waiters:
+                waiter_batch.deliver(track, data)
+
+    def _get_cover(self, track, batch):
+        """
+            Gets the cover of a track like :meth:`CoverManager.get_cover`,
+            querying the search methods through :meth:`_call`
+        """
+        manager = self.manager
+        db_string = manager.get_db_string(track)
+        if db_string:
+            source = db_string.split(":", 1)[0]
+            data = self._call(
+                source, manager.get_cover_data, db_string, size=batch.size
+            )
+            if data:
+                return data
+
+        if batch.set_only:
+            return None
+
+        for method in manager._get_methods(fixed=True):
+            covers = self._call(method.name, method.find_covers, track, limit=1)
+            if not covers:
+                continue
+            db_string = "%s:%s" % (method.name, covers[0])
+            data = self._call(method.name, method.get_cover_data, covers[0])
+            if not data:
+                continue
+            if batch.save_cover:
+                manager.set_cover(track, db_string, data)
+                # set_cover may have stored the data under a new db_string
+                db_string = manager.get_db_string(track) or db_string
+            if batch.size is not None:
+                data = manager._get_thumbnail(db_string, batch.size, data) or data
+            return data
+
+        return None
+
+    def _call(self, name, function, *args, **kwargs):
+        """
+            Calls a function of the cover search method called name
+            once it has a free slot, giving up if none is free before
+            the timeout
+
+            :returns: the result, or None on errors and timeouts
+        """
+        method = self.manager.methods.get(name)
+        if method is None:
+            # Cached covers are read directly
+            return function(*args, **kwargs)
+
+        concurrency = getattr(method, 'concurrency', CoverSearchMethod.concurrency)
+        deadline = time.time() + self.timeout
+        with self.slots:
+            while self.running.get(name, 0) >= concurrency:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    logger.debug("No free slot for cover search method %s", name)
+                    return None
+                self.slots.wait(remaining)
+            self.running[name] = self.running.get(name, 0) + 1
+
+        try:
+            with common.url_timeout(self.timeout):
+                return function(*args, **kwargs)
+        except Exception:
+            logger.exception("Error in cover search method %s", name)
+            return None
+        finally:
+            with self.slots:
+                self.running[name] -= 1
+                self.slots.notify_all()
+
+
 class CoverSearchMethod(object):
     """
         Base class for creating cover search methods.
@@ -491,6 +1075,8 @@ class CoverSearchMethod(object):
     #: Priority for fixed-position backends. Lower is earlier, non-fixed
     #  backends will always be 50.
     fixed_priority = 50
+    #: Maximum number of concurrent calls by :class:`CoverFetchScheduler`
+    concurrency = 2
 
     def find_covers(self, track, limit=-1):
         """
@@ -523,6 +1109,7 @@ class TagCoverFetcher(CoverSearchMethod):
     cover_tags = ["cover", "coverart"]
     fixed = True
     fixed_priority = 30
+    concurrency = 4
 
     def find_covers(self, track, limit=-1):
         covers = []
@@ -568,6 +1155,7 @@ class LocalFileCoverFetcher(CoverSearchMethod):
     preferred_names = []
     fixed = True
     fixed_priority = 31
+    concurrency = 4
 
     def __init__(self):
         CoverSearchMethod.__init__(self)
@@ -27,10 +27,12 @@
 import logging
 import os
 import random
+import threading
 import time
 
-from xl import xdg, providers, settings
+from xl import common, event, xdg, providers, settings
 from xl.trax import search
+from xl.unicode import shave_marks
 
 logger = logging.getLogger(__name__)
 
@@ -40,13 +42,20 @@ class DynamicManager(providers.ProviderHandler):
         handles matching of songs for dynamic playlists
     """
 
+    #: Seconds after which similar artists are looked up again
+    refresh_age = 604800  # one week
+
     def __init__(self, collection=[]):
         providers.ProviderHandler.__init__(self, "dynamic_playlists")
         self.buffersize = settings.get_option("playback/dynamic_buffer", 5)
         self.collection = collection
-        self.cachedir = os.path.join(xdg.get_cache_dir(), 'dynamic')
-        if not os.path.exists(self.cachedir):
-            os.makedirs(self.cachedir)
+        self.cache = SimilarArtistCache(
+            os.path.join(xdg.get_cache_dir(), 'dynamic.db'),
+            os.path.join(xdg.get_cache_dir(), 'dynamic'),
+        )
+        # Artist keys whose similar artists are being refreshed
+        self.refreshing = set()
+        self.refreshing_lock = threading.Lock()
 
     def find_similar_tracks(self, track, limit=-1, exclude=[]):
         """
@@ -63,82 +72,144 @@ class DynamicManager(providers.ProviderHandler):
         artists = self.find_similar_artists(track)
         if artists == []:
             return []
-        tracks = []
         random.shuffle(artists)
-        i = 0
-        while (limit > len(tracks) or limit == -1) and i < len(artists):
-            artist = artists[i][1].replace('"', '\\\"')
-            i += 1
-            searchres = search.search_tracks_from_string(
-                self.collection, 'artist=="%s"' % artist, case_sensitive=False
-            )
-            choices = [x.track for x in searchres]
-            if choices == []:
+        groups = self._group_by_artist([artist for rel, artist in artists])
+        exclude = set(exclude)
+        tracks = []
+        for rel, artist in artists:
+            if limit != -1 and len(tracks) >= limit:
+                break
+            choices = [
+                t
+                for t in groups.get(self._get_group_key(artist), ())
+                if t not in exclude
+            ]
+            if not choices:
                 continue
-            random.shuffle(choices)
-            j = 0
-            while j < len(choices):
-                track = choices[j]
-                if track not in exclude:
-                    tracks.append(track)
-                    break
-                j += 1
+            track = random.choice(choices)
+            # A track with several artists must not be picked twice
+            exclude.add(track)
+            tracks.append(track)
         return tracks
 
+    @staticmethod
+    def _get_group_key(artist):
+        # the search index of the collection ignores case and diacritics
+        return shave_marks(artist).lower()
+
+    def _group_by_artist(self, artists):
+        """
+            Returns a dict mapping the keys of artists (see
+            :meth:`_get_group_key`) to the collection tracks of each of them
+        """
+        try:
+            get_search_index = self.collection.get_search_index
+        except AttributeError:
+            groups = {}
+            for artist in artists:
+                searchres = search.search_tracks_from_string(
+                    self.collection,
+                    'artist=="%s"' % artist.replace('"', '\\\"'),
+                    case_sensitive=False,
+                )
+                groups.setdefault(self._get_group_key(artist), set()).update(
+                    x.track for x in searchres
+                )
+            return groups
+        return get_search_index().group_lowered(
+            'artist', set(self._get_group_key(artist) for artist in artists)
+        )
+
     def find_similar_artists(self, track):
-        info = self._load_saved_info(track)
-        if info == []:
-            info = self._query_sources(track)
-            self._save_info(track, info)
+        """
+            Returns the artists similar to the artist of track, as a list
+            of (relevance, artist) tuples.
 
+            Cached results are returned right away; if they are older
+            than :attr:`refresh_age`, they are refreshed in the background.
+        """
+        key = self._get_artist_key(track)
+        if not key:
+            return []
+        entry = self.cache.get(key)
+        if entry is None:
+            return self._update_info(key)
+
+        updated, info = entry
+        if time.time() - updated > self.refresh_age:
+            self._refresh_info(key)
         return info
 
-    def _query_sources(self, track):
-        info = []
+    def prefetch(self, tracks):
+        """
+            Looks up the similar artists of all artists of tracks that are
+            not cached yet, or whose cache entries are due for a refresh.
+            Runs in the calling thread; artists that are being looked up
+            by another thread already are skipped.
+
+            :param tracks: the tracks, for example the tracks just added
+                to a playlist
+        """
+        now = time.time()
+        keys = set()
+        for track in tracks:
+            key = self._get_artist_key(track)
+            if not key or key in keys:
+                continue
+            keys.add(key)
+            entry = self.cache.get(key)
+            if entry is None or now - entry[0] > self.refresh_age:
+                self._update_info_exclusive(key)
+
+    @staticmethod
+    def _get_artist_key(track):
         artist = track.get_tag_raw('artist')
         if not artist:
+            return None
+        return u','.join(artist)
+
+    @common.threaded
+    def _refresh_info(self, key):
+        self._update_info_exclusive(key)
+
+    def _update_info_exclusive(self, key):
+        """
+            Like :meth:`_update_info`, but does nothing if key is being
+            updated by another thread already
+        """
+        with self.refreshing_lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+        try:
+            self._update_info(key)
+        finally:
+            with self.refreshing_lock:
+                self.refreshing.discard(key)
+
+    def _update_info(self, key):
+        """
+            Queries the sources for the artists similar to key and caches
+            the results. Previously cached results are kept if the
+            sources come up empty.
+        """
+        info = self._query_sources(key)
+        if info != []:
+            self.cache.set(key, info)
             return info
+        entry = self.cache.get(key)
+        if entry is None:
+            return []
+        return entry[1]
+
+    def _query_sources(self, artist):
+        info = []
         for source in self.get_providers():
-            sinfo = source.get_results(','.join(artist))
+            sinfo = source.get_results(artist)
             info += sinfo
         info.sort(reverse=True)  # TODO: merge artists that are the same
         return info
 
-    def _load_saved_info(self, track):
-        artist = track.get_tag_raw('artist')
-        if not artist:
-            return []
-        filename = os.path.join(self.cachedir, ','.join(artist))
-        if not os.path.exists(filename):
-            return []
-        with open(filename) as f:
-            line = f.readline()
-            if line == '':
-                return []
-            last_update = float(line)
-            if 604800 < time.time() - last_update:  # one week
-                info = self._query_sources(track)
-                if info != []:
-                    self._save_info(track, info)
-                    return info
-            info = []
-            for line in f:
-                try:
-                    rel, artist = line.strip().split(" ", 1)
-                    info.append((rel, artist))
-                except Exception:
-                    pass
-        return info
-
-    def _save_info(self, track, info):
-        if info == []:
-            return
-        filename = os.path.join(self.cachedir, track.get_tag_raw('artist', join=True))
-        with open(filename, 'w') as f:
-            f.write("%s\n" % time.time())
-            for item in info:
-                f.write("%.2f %s\n" % item)
-
     def populate_playlist(self, playlist):
         """
             adds tracks to playlists as needed.
@@ -155,19 +226,134 @@ class DynamicManager(providers.ProviderHandler):
             needed = 1
         curr = playlist.current
 
-        starttime = time.time()
         tracks = self.find_similar_tracks(curr, needed, playlist)
 
-        remainingtime = 5 - (time.time() - starttime)
-
-        if remainingtime > 0:
-            time.sleep(remainingtime)
-
         if playlist.current_position != current_pos:
-            return  # we skipped in that 5 seconds, so ignore it
+            return  # we skipped while searching, so ignore it
         playlist.extend(tracks)
         logger.debug("Added %s tracks.", len(tracks))
 
+        # Have the similar artists ready by the time these tracks play
+        self.prefetch(tracks)
+
+
+class SimilarArtistCache(object):
+    """
+        Keeps the similar artists of each artist in a shelf.
+
+        Entries map an artist key (the artist values of a track joined
+        by commas) to an (update time, info) tuple, where info is a list
+        of (relevance, artist) tuples. Once there are more than
+        :attr:`max_entries` entries, the least recently updated ones
+        are removed.
+    """
+
+    max_entries = 5000
+
+    def __init__(self, location, legacy_dir=None):
+        """
+            :param location: the location of the shelf
+            :param legacy_dir: a directory of similar artist files
+                written by older versions, imported on first use
+        """
+        self.location = location
+        self.legacy_dir = legacy_dir
+        self.lock = threading.Lock()
+        # Opened on first use
+        self.db = None
+        self.count = 0
+        self.closed = False
+
+        event.add_callback(self.on_quit_application, 'quit_application')
+
+    def on_quit_application(self, *args):
+        with self.lock:
+            self.closed = True
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+    def _open(self):
+        # Must be called with lock held
+        if self.db is None:
+            self.db = common.open_shelf(self.location)
+            self.count = len(self.db)
+            if self.legacy_dir is not None and os.path.isdir(self.legacy_dir):
+                self._import_legacy_dir()
+        return self.db
+
+    def _import_legacy_dir(self):
+        # Must be called with lock held
+        imported = 0
+        for name in os.listdir(self.legacy_dir):
+            path = os.path.join(self.legacy_dir, name)
+            try:
+                with open(path) as f:
+                    updated = float(f.readline())
+                    info = []
+                    for line in f:
+                        try:
+                            rel, artist = line.strip().split(" ", 1)
+                            info.append((float(rel), artist.decode('utf-8')))
+                        except Exception:
+                            pass
+                key = name.decode('utf-8')
+            except Exception:
+                logger.debug("Skipping similar artist file %s", path, exc_info=True)
+            else:
+                self._store(key, (updated, info))
+                imported += 1
+            os.remove(path)
+        os.rmdir(self.legacy_dir)
+        self.db.sync()
+        logger.info("Imported %d similar artist files", imported)
+
+    def get(self, key):
+        """
+            :returns: the (update time, info) tuple of key, or None
+        """
+        with self.lock:
+            if self.closed:
+                return None
+            try:
+                return self._open()[key.encode('utf-8')]
+            except KeyError:
+                return None
+
+    def set(self, key, info):
+        """
+            Stores info as the similar artists of key, updated now
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self._open()
+            self._store(key, (time.time(), info))
+            # Allow some slack so that not every new entry causes a purge
+            if self.count > self.max_entries + self.max_entries // 10:
+                self._purge()
+            self.db.sync()
+
+    def _store(self, key, entry):
+        # Must be called with lock held
+        key = key.encode('utf-8')
+        if key not in self.db:
+            self.count += 1
+        self.db[key] = entry
+
+    def _purge(self):
+        # Must be called with lock held
+        entries = []
+        for key in self.db.keys():
+            try:
+                entries.append((float(self.db[key][0]), key))
+            except Exception:
+                entries.append((0, key))  # damaged
+        entries.sort()
+        for updated, key in entries[: len(entries) - self.max_entries]:
+            del self.db[key]
+        self.count = min(len(entries), self.max_entries)
+
 
 MANAGER = DynamicManager()
 
@@ -37,7 +37,9 @@ Events should be emitted AFTER the given event has taken place. Often the
 most appropriate spot is immediately before a return statement.
 """
 
+from collections import OrderedDict
 from inspect import ismethod
+import itertools
 import logging
 import re
 import threading
@@ -78,6 +80,31 @@ def log_event(evty, obj, data):
     EVENT_MANAGER.emit(e)
 
 
+def batch_events(*evtys):
+    """
+        Returns a context manager that holds back the events of the given
+        types sent by the current thread, and sends them when the
+        outermost batch is left. Events sent several times by the same
+        object are merged into one: sets are joined, lists are
+        concatenated, and any other data is replaced by the latest one.
+
+        Callbacks added with ``bulk=True`` are then called once with the
+        set of objects that sent the event and the merged data of all of
+        them. Other callbacks are called once for each object.
+
+        ::
+
+            with event.batch_events('track_tags_changed'):
+                for track in tracks:
+                    track.set_tags(genre=u'Jazz')
+
+        :param evtys: the *types* or *names* of the events to batch
+        :type evtys: string
+    """
+    global EVENT_MANAGER
+    return _EventBatch(EVENT_MANAGER, evtys)
+
+
 def add_callback(function, evty=None, obj=None, *args, **kwargs):
     """
         Adds a callback to an event
@@ -99,6 +126,10 @@ def add_callback(function, evty=None, obj=None, *args, **kwargs):
         :type obj: object
         :param destroy_with: (keyword arg only) If specified, this event will be
                              detached when the specified Gtk widget is destroyed
+        :param bulk: (keyword arg only) If True, the callback receives a set
+                     of objects instead of a single object, and is called
+                     only once for the events of a batch, see
+                     :func:`batch_events`
 
         Any additional parameters will be passed to the callback.
 
@@ -130,6 +161,10 @@ def add_ui_callback(function, evty=None, obj=None, *args, **kwargs):
         :type obj: object
         :param destroy_with: (keyword arg only) If specified, this event will be
                              detached when the specified Gtk widget is destroyed
+        :param bulk: (keyword arg only) If True, the callback receives a set
+                     of objects instead of a single object, and is called
+                     only once for the events of a batch, see
+                     :func:`batch_events`
 
         Any additional parameters will be passed to the callback.
 
@@ -168,22 +203,72 @@ class Event(object):
         self.data = data
 
 
+class _BulkEvent(Event):
+    """
+        Represents the events of one type sent during a batch
+    """
+
+    __slots__ = ['items']
+
+    def __init__(self, evty, items):
+        """
+            evty: the 'type' or 'name' for this Event [string]
+            items: the data of each object that sent the Event [OrderedDict]
+        """
+        Event.__init__(self, evty, None, _merge_data(items.values()))
+        self.items = items
+
+
+def _merge_data(datas):
+    """
+        Merges the data of several events into one
+    """
+    if len(datas) == 1:
+        return datas[0]
+    if all(isinstance(data, (set, frozenset)) for data in datas):
+        return set().union(*datas)
+    if all(isinstance(data, list) for data in datas):
+        return list(itertools.chain.from_iterable(datas))
+    return datas[-1]
+
+
+class _EventBatch(object):
+    """
+        Context manager returned by :func:`batch_events`
+    """
+
+    def __init__(self, manager, evtys):
+        self.manager = manager
+        self.evtys = frozenset(evtys)
+
+    def __enter__(self):
+        self.manager.begin_batch(self.evtys)
+        return self
+
+    def __exit__(self, *exc_info):
+        # the events describe things that happened, so send them
+        # even if the batch was left because of an exception
+        self.manager.end_batch()
+
+
 class Callback(object):
     """
         Represents a callback
     """
 
-    __slots__ = ['wfunction', 'time', 'args', 'kwargs']
+    __slots__ = ['wfunction', 'time', 'args', 'kwargs', 'bulk']
 
-    def __init__(self, function, time, args, kwargs):
+    def __init__(self, function, time, args, kwargs, bulk=False):
         """
             @param function: the function to call
             @param time: the time this callback was added
+            @param bulk: whether the callback takes a set of objects
         """
         self.wfunction = _getWeakRef(function)
         self.time = time
         self.args = args
         self.kwargs = kwargs
+        self.bulk = bulk
 
     def __repr__(self):
         return '<Callback %s>' % self.wfunction()
@@ -279,6 +364,41 @@ class EventManager(object):
         self.pending_ui = []
         self.pending_ui_lock = threading.Lock()
 
+        # batches are per thread, see batch_events()
+        self.batches = threading.local()
+
+    def begin_batch(self, evtys):
+        """
+            Starts holding back events of the given types sent by the
+            current thread. Batches may be nested.
+
+            evtys: the types of events to hold back [frozenset]
+        """
+        batches = self.batches
+        if not getattr(batches, 'stack', None):
+            batches.stack = []
+            # type -> object -> list of data
+            batches.pending = OrderedDict()
+        batches.stack.append(evtys)
+
+    def end_batch(self):
+        """
+            Ends the most recent batch of the current thread, and sends
+            the events held back when it was the outermost one.
+        """
+        batches = self.batches
+        batches.stack.pop()
+        if batches.stack:
+            return
+
+        pending = batches.pending
+        batches.pending = None
+        for evty, objs in pending.iteritems():
+            items = OrderedDict(
+                (obj, _merge_data(datas)) for obj, datas in objs.iteritems()
+            )
+            self.emit(_BulkEvent(evty, items))
+
     def emit(self, event):
         """
             Emits an Event, calling any registered callbacks.
@@ -286,6 +406,12 @@ class EventManager(object):
             event: the Event to emit [Event]
         """
 
+        stack = getattr(self.batches, 'stack', None)
+        if stack and any(event.type in evtys for evtys in stack):
+            objs = self.batches.pending.setdefault(event.type, OrderedDict())
+            objs.setdefault(event.object, []).append(event.data)
+            return
+
         emit_logmsg = self.use_logger and (
             not self.logger_filter or re.search(self.logger_filter, event.type)
         )
@@ -322,6 +448,10 @@ class EventManager(object):
 
     def _emit(self, event, exc_callbacks, emit_logmsg, emit_verbose):
 
+        if isinstance(event, _BulkEvent):
+            self._emit_bulk(event, exc_callbacks, emit_logmsg, emit_verbose)
+            return
+
         # Accumulate in this set to ensure callbacks only get called once
         callbacks = set()
 
@@ -339,31 +469,20 @@ class EventManager(object):
         #    they decide to run for too long
 
         for cb in callbacks:
-            try:
-                fn = cb.wfunction()
-                if fn is None:
-                    # Remove callbacks that have been garbage collected.. but
-                    # really, should be using remove_callback to clean up after
-                    # your event handler
-                    with self.lock:
-                        try:
-                            exc_callbacks[event.type][event.object].remove(cb)
-                        except (KeyError, ValueError):
-                            pass
-                else:
-                    if emit_verbose:
-                        logger.debug(
-                            "Attempting to call "
-                            "%(function)s in response "
-                            "to %(event)s." % {'function': fn, 'event': event.type}
-                        )
-                    fn.__call__(
-                        event.type, event.object, event.data, *cb.args, **cb.kwargs
-                    )
-                fn = None
-            except Exception:
-                # something went wrong inside the function we're calling
-                logger.exception("Event callback exception caught!")
+            if cb.bulk:
+                obj = {event.object}
+            else:
+                obj = event.object
+            self._call(
+                cb,
+                exc_callbacks,
+                event.type,
+                event.object,
+                event.type,
+                obj,
+                event.data,
+                emit_verbose,
+            )
 
         if emit_logmsg:
             logger.debug(
@@ -373,6 +492,97 @@ class EventManager(object):
                 event.data,
             )
 
+    def _emit_bulk(self, event, exc_callbacks, emit_logmsg, emit_verbose):
+
+        items = event.items
+
+        # callback -> (type key, object key, objects listened to or
+        # None for all of them)
+        callbacks = {}
+
+        with self.lock:
+            for tcall in [_NONE, event.type]:
+                tcb = exc_callbacks.get(tcall)
+                if tcb is None:
+                    continue
+                ocb = tcb.get(_NONE)
+                if ocb is not None:
+                    for cb in ocb:
+                        callbacks[cb] = (tcall, _NONE, None)
+                for obj in items:
+                    ocb = tcb.get(obj)
+                    if ocb is not None:
+                        for cb in ocb:
+                            callbacks.setdefault(cb, (tcall, obj, []))[2].append(obj)
+
+        for cb, (tcall, ocall, objs) in callbacks.iteritems():
+            if objs is None:
+                objs = items.keys()
+                data = event.data
+            else:
+                data = _merge_data([items[obj] for obj in objs])
+
+            if cb.bulk:
+                self._call(
+                    cb,
+                    exc_callbacks,
+                    tcall,
+                    ocall,
+                    event.type,
+                    set(objs),
+                    data,
+                    emit_verbose,
+                )
+            else:
+                for obj in objs:
+                    if not self._call(
+                        cb,
+                        exc_callbacks,
+                        tcall,
+                        ocall,
+                        event.type,
+                        obj,
+                        items[obj],
+                        emit_verbose,
+                    ):
+                        break
+
+        if emit_logmsg:
+            logger.debug(
+                "Sent '%s' event from %d objects with data %r",
+                event.type,
+                len(items),
+                event.data,
+            )
+
+    def _call(self, cb, exc_callbacks, tcall, ocall, evty, obj, data, emit_verbose):
+        """
+            Calls a callback, returns False if it has been garbage collected
+        """
+        try:
+            fn = cb.wfunction()
+            if fn is None:
+                # Remove callbacks that have been garbage collected.. but
+                # really, should be using remove_callback to clean up after
+                # your event handler
+                with self.lock:
+                    try:
+                        exc_callbacks[tcall][ocall].remove(cb)
+                    except (KeyError, ValueError):
+                        pass
+                return False
+            if emit_verbose:
+                logger.debug(
+                    "Attempting to call "
+                    "%(function)s in response "
+                    "to %(event)s." % {'function': fn, 'event': evty}
+                )
+            fn.__call__(evty, obj, data, *cb.args, **cb.kwargs)
+        except Exception:
+            # something went wrong inside the function we're calling
+            logger.exception("Event callback exception caught!")
+        return True
+
     def emit_async(self, event):
         """
             Same as emit(), but does not block.
@@ -400,6 +610,7 @@ class EventManager(object):
             all_cbs = [self.callbacks, self.all_callbacks]
 
         destroy_with = kwargs.pop('destroy_with', None)
+        bulk = kwargs.pop('bulk', False)
 
         if evty is None:
             evty = _NONE
@@ -407,7 +618,7 @@ class EventManager(object):
             obj = _NONE
 
         with self.lock:
-            cb = Callback(function, time.time(), args, kwargs)
+            cb = Callback(function, time.time(), args, kwargs, bulk)
 
             # add the specified categories if needed.
             for cbs in all_cbs:
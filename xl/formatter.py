@@ -30,13 +30,15 @@ Provides an extensible framework for processing and
 preparation of data for display in various contexts.
 """
 
+from collections import OrderedDict
 from datetime import date
 from gi.repository import GLib
 from gi.repository import GObject
 import re
 from string import Template, _TemplateMetaclass
+import threading
 
-from xl import common, providers, settings, trax
+from xl import common, event, providers, settings, trax
 from xl.common import TimeSpan
 from xl.nls import gettext as _, ngettext
 
@@ -184,6 +186,7 @@ class Formatter(GObject.GObject):
         GObject.GObject.__init__(self)
 
         self._template = ParameterTemplate(format)
+        self._compiled = None
         self._substitutions = {}
 
     def do_get_property(self, property):
@@ -202,9 +205,21 @@ class Formatter(GObject.GObject):
         if property.name == 'format':
             if value != self._template.template:
                 self._template.template = value
+                self._compiled = None
         else:
             raise AttributeError('unknown property %s' % property.name)
 
+    def _get_compiled(self):
+        """
+            Retrieves the compiled form of the current format
+        """
+        compiled = self._compiled
+
+        if compiled is None:
+            compiled = self._compiled = _compile_template(self._template)
+
+        return compiled
+
     def extract(self):
         """
             Retrieves the identifiers and their optional parameters
@@ -223,97 +238,193 @@ class Formatter(GObject.GObject):
             :returns: the extractions
             :rtype: dict
         """
-        matches = self._template.pattern.finditer(self._template.template)
-        extractions = {}
+        extractions = self._get_compiled().extractions
+
+        return dict(
+            (needle, (identifier, dict(parameters)))
+            for needle, (identifier, parameters) in extractions.iteritems()
+        )
 
-        # Extract list of identifiers and parameters from the format string
-        for match in matches:
-            groups = match.groupdict()
+    def format(self, *args):
+        """
+            Returns a string by formatting the passed data
 
-            # We only care about braced and named, not escaped and invalid
-            identifier = groups['braced'] or groups['named']
+            :param args: data to base the formatting on
+            :returns: the formatted text
+            :rtype: string
+        """
+        substitutions = self._substitutions
+        substituted = {}
+        parts = []
 
-            if identifier is None:
+        for op in self._get_compiled().ops:
+            if op.__class__ is not tuple:
+                parts.append(op)
                 continue
 
-            identifier_parts = [identifier]
-            parameters = {}
+            needle, identifier, parameters, prefix, suffix, pad, padstring, raw = op
 
-            if groups['parameters'] is not None:
-                # Split parameters on unescaped comma
-                parameters = [
-                    p.lstrip() for p in re.split(r'(?<!\\),', groups['parameters'])
-                ]
-                # Split arguments on unescaped equals sign
-                parameters = [
-                    (re.split(r'(?<!\\)=', p, 1) + [True])[:2] for p in parameters
-                ]
-                # Turn list of lists into a proper dictionary
-                parameters = dict(parameters)
+            if needle in substituted:
+                parts.append(substituted[needle])
+                continue
 
-                # Remove now obsolete escapes
-                for p in parameters:
-                    argument = parameters[p]
+            substitute = None
 
-                    if not isinstance(argument, bool):
-                        argument = argument.replace(r'\,', ',')
-                        argument = argument.replace(r'\}', '}')
-                        argument = argument.replace(r'\=', '=')
-                        parameters[p] = argument
+            if needle in substitutions:
+                substitute = substitutions[needle]
+            elif identifier in substitutions:
+                substitute = substitutions[identifier]
 
-                identifier_parts += [groups['parameters']]
+            if substitute is None:
+                parts.append(raw)
+                continue
 
-            # Required to make multiple occurences of the same
-            # identifier with different parameters work
-            extractions[':'.join(identifier_parts)] = (identifier, parameters)
+            if callable(substitute):
+                substitute = substitute(*args, **parameters)
 
-        return extractions
+            if pad > 0 and padstring:
+                # Decrease pad length by value length
+                pad = max(0, pad - len(substitute))
+                # Retrieve the maximum multiplier for the pad string
+                padcount = pad / len(padstring) + 1
+                # Generate pad string
+                padstring = padcount * padstring
+                # Clamp pad string
+                padstring = padstring[0:pad]
+                substitute = '%s%s' % (padstring, substitute)
 
-    def format(self, *args):
-        """
-            Returns a string by formatting the passed data
+            if substitute:
+                substitute = '%s%s%s' % (prefix, substitute, suffix)
 
-            :param args: data to base the formatting on
-            :returns: the formatted text
-            :rtype: string
-        """
-        extractions = self.extract()
-        substitutions = {}
+            # We use this idiom instead of str() because the latter
+            # will fail if substitute is a Unicode containing non-ASCII
+            substitute = '%s' % (substitute,)
+            substituted[needle] = substitute
+            parts.append(substitute)
 
-        for needle, (identifier, parameters) in extractions.iteritems():
-            substitute = None
+        return ''.join(parts)
+
+
+class _CompiledTemplate(object):
+    """
+        A format string split into literal text and substitutions
+
+        Literal text is stored as strings in ``ops``, substitutions
+        as tuples of ``(needle, identifier, parameters, prefix, suffix,
+        pad, padstring, raw)`` where ``raw`` is the text to use if
+        there is no substitute for the identifier.
+    """
+
+    __slots__ = ['ops', 'extractions']
+
+    def __init__(self, ops, extractions):
+        self.ops = ops
+        self.extractions = extractions
+
+
+_compiled_templates = {}
+_COMPILED_TEMPLATES_MAX = 256
+
+
+def _compile_template(template):
+    """
+        Compiles a :class:`ParameterTemplate`, reusing the result
+        for identical format strings
+
+        :param template: the template to compile
+        :type template: :class:`ParameterTemplate`
+        :rtype: :class:`_CompiledTemplate`
+    """
+    text = template.template
+
+    try:
+        return _compiled_templates[text]
+    except KeyError:
+        pass
+
+    delimiter = template.delimiter
+    ops = []
+    extractions = {}
+    position = 0
+
+    for match in template.pattern.finditer(text):
+        if match.start() > position:
+            ops.append(text[position : match.start()])
+        position = match.end()
+
+        groups = match.groupdict()
+        # We only care about braced and named, escaped
+        # and invalid expressions are left as the delimiter
+        identifier = groups['braced'] or groups['named']
+
+        if identifier is None:
+            ops.append(delimiter)
+            continue
+
+        identifier_parts = [identifier]
+        parameters = {}
+
+        if groups['parameters'] is not None:
+            parameters = _parse_parameters(groups['parameters'])
+            identifier_parts += [groups['parameters']]
 
-            if needle in self._substitutions:
-                substitute = self._substitutions[needle]
-            elif identifier in self._substitutions:
-                substitute = self._substitutions[identifier]
+        # Required to make multiple occurences of the same
+        # identifier with different parameters work
+        needle = ':'.join(identifier_parts)
+        extractions[needle] = (identifier, parameters)
 
-            if substitute is not None:
-                prefix = parameters.pop('prefix', '')
-                suffix = parameters.pop('suffix', '')
-                pad = int(parameters.pop('pad', 0))
-                padstring = parameters.pop('padstring', '')
+        if groups['named'] is not None:
+            raw = delimiter + needle
+        else:
+            raw = delimiter + '{' + needle + '}'
+
+        arguments = dict(parameters)
+        prefix = arguments.pop('prefix', '')
+        suffix = arguments.pop('suffix', '')
+        pad = int(arguments.pop('pad', 0))
+        padstring = arguments.pop('padstring', '')
+
+        ops.append((needle, identifier, arguments, prefix, suffix, pad, padstring, raw))
+
+    if position < len(text):
+        ops.append(text[position:])
+
+    if len(_compiled_templates) >= _COMPILED_TEMPLATES_MAX:
+        _compiled_templates.clear()
+
+    compiled = _compiled_templates[text] = _CompiledTemplate(ops, extractions)
 
-                if callable(substitute):
-                    substitute = substitute(*args, **parameters)
+    return compiled
 
-                if pad > 0 and padstring:
-                    # Decrease pad length by value length
-                    pad = max(0, pad - len(substitute))
-                    # Retrieve the maximum multiplier for the pad string
-                    padcount = pad / len(padstring) + 1
-                    # Generate pad string
-                    padstring = padcount * padstring
-                    # Clamp pad string
-                    padstring = padstring[0:pad]
-                    substitute = '%s%s' % (padstring, substitute)
 
-                if substitute:
-                    substitute = '%s%s%s' % (prefix, substitute, suffix)
+def _parse_parameters(parameters):
+    """
+        Parses the parameters of an identifier
+
+        :param parameters: the parameter string, e.g. ``pad=4, prefix=\,``
+        :type parameters: string
+        :returns: a mapping of parameter names to their arguments,
+            or True for parameters without argument
+        :rtype: dict
+    """
+    # Split parameters on unescaped comma
+    parameters = [p.lstrip() for p in re.split(r'(?<!\\),', parameters)]
+    # Split arguments on unescaped equals sign
+    parameters = [(re.split(r'(?<!\\)=', p, 1) + [True])[:2] for p in parameters]
+    # Turn list of lists into a proper dictionary
+    parameters = dict(parameters)
 
-                substitutions[needle] = substitute
+    # Remove now obsolete escapes
+    for p in parameters:
+        argument = parameters[p]
 
-        return self._template.safe_substitute(substitutions)
+        if not isinstance(argument, bool):
+            argument = argument.replace(r'\,', ',')
+            argument = argument.replace(r'\}', '}')
+            argument = argument.replace(r'\=', '=')
+            parameters[p] = argument
+
+    return parameters
 
 
 class ProgressTextFormatter(Formatter):
@@ -378,6 +489,18 @@ class TrackFormatter(Formatter):
         A formatter for track data
     """
 
+    def __init__(self, format, cache=False):
+        """
+            :param format: the initial format, see the documentation
+                of :class:`string.Template` for details
+            :type format: string
+            :param cache: whether to keep formatted results in the
+                shared track format cache
+            :type cache: bool
+        """
+        Formatter.__init__(self, format)
+        self._cache = cache
+
     def format(self, track, markup_escape=False):
         """
             Returns a string for places where
@@ -396,8 +519,16 @@ class TrackFormatter(Formatter):
                 'First argument to format() needs ' 'to be of type xl.trax.Track'
             )
 
-        extractions = self.extract()
+        if self._cache:
+            key = (self._template.template, markup_escape)
+            text = _TRACK_FORMAT_CACHE.get(track, key)
+
+            if text is not None:
+                return text
+
+        extractions = self._get_compiled().extractions
         self._substitutions = {}
+        cacheable = self._cache
 
         for identifier, (tag, parameters) in extractions.iteritems():
             provider = providers.get_provider('tag-formatting', tag)
@@ -406,13 +537,82 @@ class TrackFormatter(Formatter):
                 substitute = track.get_tag_display(tag)
             else:
                 substitute = provider.format(track, parameters)
+                cacheable = cacheable and not provider.volatile
 
             if markup_escape:
                 substitute = GLib.markup_escape_text(substitute).decode('utf-8')
 
             self._substitutions[identifier] = substitute
 
-        return Formatter.format(self)
+        text = Formatter.format(self)
+
+        if cacheable:
+            _TRACK_FORMAT_CACHE.set(track, key, text)
+
+        return text
+
+
+class _TrackFormatCache(object):
+    """
+        A bounded cache of formatted texts for tracks, keyed on
+        the track and the format string
+
+        Entries of a track are dropped when its tags change.
+    """
+
+    def __init__(self, size):
+        """
+            :param size: the maximum number of tracks to keep
+                results for
+            :type size: int
+        """
+        self.size = size
+        self.lock = threading.Lock()
+        self.tracks = OrderedDict()
+
+        event.add_callback(self.on_track_tags_changed, 'track_tags_changed', bulk=True)
+        event.add_callback(self.on_option_set, 'rating_option_set')
+
+    def get(self, track, key):
+        with self.lock:
+            texts = self.tracks.get(track)
+
+            if texts is None:
+                return None
+
+            # Mark as recently used
+            del self.tracks[track]
+            self.tracks[track] = texts
+
+            return texts.get(key)
+
+    def set(self, track, key, text):
+        with self.lock:
+            texts = self.tracks.get(track)
+
+            if texts is None:
+                texts = self.tracks[track] = {}
+
+                if len(self.tracks) > self.size:
+                    self.tracks.popitem(last=False)
+
+            texts[key] = text
+
+    def clear(self):
+        with self.lock:
+            self.tracks.clear()
+
+    def on_track_tags_changed(self, type, tracks, tags):
+        with self.lock:
+            for track in tracks:
+                self.tracks.pop(track, None)
+
+    def on_option_set(self, type, settings_manager, option):
+        if option == 'rating/maximum':
+            self.clear()
+
+
+_TRACK_FORMAT_CACHE = _TrackFormatCache(5000)
 
 
 class TagFormatter(object):
@@ -420,6 +620,11 @@ class TagFormatter(object):
         A formatter provider for a tag of a track
     """
 
+    #: Whether the result can change without the tags
+    #: of the track changing, e.g. because it depends
+    #: on the current date
+    volatile = False
+
     def __init__(self, name):
         """
             :param name: the name of the tag
@@ -678,6 +883,7 @@ class RatingTagFormatter(TagFormatter):
 
     def __init__(self):
         TagFormatter.__init__(self, '__rating')
+        self._maximum = settings.get_option_handle('rating/maximum', 5)
 
     def format(self, track, parameters):
         """
@@ -691,7 +897,7 @@ class RatingTagFormatter(TagFormatter):
             :rtype: string
         """
         rating = track.get_rating()
-        maximum = settings.get_option('rating/maximum', 5)
+        maximum = self._maximum.get()
 
         filled = '★' * int(rating)
         empty = '☆' * int(maximum - rating)
@@ -733,6 +939,8 @@ class DateTagFormatter(TagFormatter):
         or the respective localized date for earlier dates
     """
 
+    volatile = True
+
     def __init__(self, name):
         """
             :param name: the name of the tag
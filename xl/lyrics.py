@@ -25,14 +25,19 @@
 # from your version.
 
 from datetime import datetime, timedelta
+import logging
+from multiprocessing.pool import ThreadPool
 import os
 import re
+import time
 import zlib
 import threading
 
 from xl.nls import gettext as _
 from xl import common, event, providers, settings, xdg
 
+logger = logging.getLogger(__name__)
+
 
 class LyricsNotFoundException(Exception):
     pass
@@ -42,8 +47,18 @@ class LyricsCache:
     '''
         Basically just a thread-safe shelf for convinience.
         Supports container syntax.
+
+        Changes are kept in memory and written to the shelf in batches,
+        flush_delay seconds after the first change. Entries older than
+        the lyrics cache time are removed, and once there are more than
+        lyrics/cache_size entries, the oldest ones as well.
     '''
 
+    #: Seconds to wait before writing changes to disk
+    flush_delay = 10
+    #: Seconds to wait after startup before removing old entries
+    expire_delay = 60
+
     def __init__(self, location, default=None):
         '''
             @param location: specify the shelve file location
@@ -53,38 +68,152 @@ class LyricsCache:
         '''
         self.location = location
         self.db = common.open_shelf(location)
+        # Protects db
         self.lock = threading.Lock()
+        # Protects pending, flush_timer and writes
+        self.pending_lock = threading.Lock()
+        # key -> value, or _DELETED; not written to db yet
+        self.pending = {}
+        self.flush_timer = None
+        # Number of changes since the last expiry
+        self.writes = 0
+        self.closed = False
         self.default = default
 
         # Callback to close db
         event.add_callback(self.on_quit_application, 'quit_application')
 
+        self.expire_timer = threading.Timer(self.expire_delay, self.expire)
+        self.expire_timer.daemon = True
+        self.expire_timer.start()
+
     def on_quit_application(self, *args):
         """
             Closes db on quit application
             Gets the lock/wait operations
         """
+        self.expire_timer.cancel()
+        with self.pending_lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+        self.flush()
         with self.lock:
+            self.closed = True
             self.db.close()
 
+    def flush(self):
+        '''
+            Writes pending changes to disk
+        '''
+        with self.pending_lock:
+            pending = self.pending
+            self.pending = {}
+            self.flush_timer = None
+        if not pending:
+            return
+        with self.lock:
+            if self.closed:
+                return
+            for key, value in pending.iteritems():
+                if value is _DELETED:
+                    self.db.pop(key, None)
+                else:
+                    self.db[key] = value
+            self.db.sync()
+        with self.pending_lock:
+            self.writes += len(pending)
+            expire = self.writes >= max(100, self._get_max_entries() // 10)
+        if expire:
+            self.expire()
+
+    def expire(self):
+        '''
+            Removes entries older than the lyrics cache time, and then
+            the oldest entries above the maximum number of entries
+        '''
+        self.flush()
+        with self.pending_lock:
+            self.writes = 0
+        ttl = timedelta(hours=settings.get_option('lyrics/cache_time', 720))
+        now = datetime.now()
+
+        # Don't hold the lock while reading everything, so that
+        # lookups can go on in the meantime
+        with self.lock:
+            if self.closed:
+                return
+            keys = self.db.keys()
+        entries = []
+        for key in keys:
+            with self.lock:
+                if self.closed:
+                    return
+                try:
+                    added = self.db[key][3]
+                except Exception:
+                    added = None
+            if not isinstance(added, datetime):
+                added = datetime.min  # gone or damaged, remove first
+            entries.append((added, key))
+        entries.sort()
+
+        expired = sum(1 for added, key in entries if now - added > ttl)
+        count = max(expired, len(entries) - self._get_max_entries())
+        if count <= 0:
+            return
+
+        with self.lock:
+            if self.closed:
+                return
+            for added, key in entries[:count]:
+                self.db.pop(key, None)
+            self.db.sync()
+        logger.debug("Removed %d entries from the lyrics cache", count)
+
+    @staticmethod
+    def _get_max_entries():
+        return settings.get_option('lyrics/cache_size', 5000)
+
     def keys(self):
         '''
             Return the shelve keys
         '''
-        return self.db.keys()
+        with self.pending_lock:
+            pending = dict(self.pending)
+        with self.lock:
+            keys = set(self.db.keys())
+        for key, value in pending.iteritems():
+            if value is _DELETED:
+                keys.discard(key)
+            else:
+                keys.add(key)
+        return list(keys)
 
     def _get(self, key, default=None):
-        with self.lock:
-            try:
-                return self.db[key]
-            except Exception:
-                return default if default is not None else self.default
+        with self.pending_lock:
+            value = self.pending.get(key)
+        if value is None:
+            with self.lock:
+                try:
+                    return self.db[key]
+                except Exception:
+                    pass
+        elif value is not _DELETED:
+            return value
+        return default if default is not None else self.default
 
     def _set(self, key, value):
-        with self.lock:
-            self.db[key] = value
-            # force save, wasn't auto-saving...
-            self.db.sync()
+        with self.pending_lock:
+            self.pending[key] = value
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        # Must be called with pending_lock held
+        if self.flush_timer is None:
+            self.flush_timer = threading.Timer(self.flush_delay, self.flush)
+            self.flush_timer.daemon = True
+            self.flush_timer.start()
 
     def __getitem__(self, key):
         return self._get(key)
@@ -93,17 +222,76 @@ class LyricsCache:
         self._set(key, value)
 
     def __contains__(self, key):
-        return key in self.db
+        with self.pending_lock:
+            value = self.pending.get(key)
+        if value is None:
+            with self.lock:
+                return key in self.db
+        return value is not _DELETED
 
     def __delitem__(self, key):
-        with self.lock:
-            del self.db[key]
+        if key not in self:
+            raise KeyError(key)
+        with self.pending_lock:
+            self.pending[key] = _DELETED
+            self._schedule_flush()
 
     def __iter__(self):
-        return self.db.__iter__()
+        return iter(self.keys())
 
     def __len__(self):
-        return len(self.db)
+        return len(self.keys())
+
+
+_DELETED = object()  # marks pending deletions in LyricsCache
+
+
+class _LyricsLookup(object):
+    """
+        Looks up the lyrics of a track from one provider,
+        see :meth:`LyricsManager._start_lookups`
+    """
+
+    def __init__(self, method, result=None):
+        """
+            :param result: the answer of the provider if it is known
+                already, otherwise :meth:`run` has to be called
+        """
+        self.method = method
+        self.result = result
+        self.finished = threading.Event()
+        if result is not None:
+            self.finished.set()
+        timeout = getattr(method, 'timeout', None)
+        if timeout is None:
+            timeout = settings.get_option('lyrics/timeout', 15)
+        self.deadline = time.time() + timeout
+
+    def run(self, manager, track):
+        try:
+            # Lookups that waited in the pool for longer than their
+            # timeout are not waited for anymore
+            if time.time() < self.deadline:
+                self.result = manager._fetch_lyrics(self.method, track)
+        except LyricsNotFoundException:
+            pass
+        except Exception:
+            logger.exception("Error in lyrics provider %s", self.method.name)
+        finally:
+            self.finished.set()
+
+    def wait(self):
+        """
+            Waits for the lookup to finish, at most until its timeout
+
+            :return: the result in the format of
+                :meth:`LyricsManager.find_lyrics`, or None if the
+                provider found nothing in time
+        """
+        if not self.finished.wait(max(0, self.deadline - time.time())):
+            logger.warning("Lyrics provider %s timed out", self.method.name)
+            return None
+        return self.result
 
 
 class LyricsManager(providers.ProviderHandler):
@@ -113,10 +301,15 @@ class LyricsManager(providers.ProviderHandler):
         Manages talking to the lyrics plugins and updating the track
     """
 
+    #: How many providers are queried at once
+    lookup_workers = 4
+
     def __init__(self):
         providers.ProviderHandler.__init__(self, "lyrics")
         self.preferred_order = settings.get_option('lyrics/preferred_order', [])
         self.cache = LyricsCache(os.path.join(xdg.get_cache_dir(), 'lyrics.cache'))
+        self.lookup_pool = None
+        self.lookup_pool_lock = threading.Lock()
 
         event.add_callback(self.on_track_tags_changed, 'track_tags_changed')
 
@@ -168,20 +361,17 @@ class LyricsManager(providers.ProviderHandler):
             :raise LyricsNotFoundException: when lyrics are not
                 found
         """
-        lyrics = None
-        source = None
-        url = None
-
-        for method in self.get_providers():
-            try:
-                (lyrics, source, url) = self._find_cached_lyrics(method, track, refresh)
-            except LyricsNotFoundException:
-                continue
-            break
+        # All providers are asked at once, but the answer of a provider
+        # is only used once all providers before it found nothing
+        for method, lookup in self._start_lookups(track, refresh, first=True):
+            result = lookup.wait()
+            if result is not None:
+                break
         else:
-            # This only happens if all providers raised LyricsNotFoundException.
+            # This only happens if no provider found lyrics in time.
             raise LyricsNotFoundException()
 
+        (lyrics, source, url) = result
         lyrics = lyrics.strip()
 
         return (lyrics, source, url)
@@ -205,14 +395,11 @@ class LyricsManager(providers.ProviderHandler):
         """
         lyrics_found = []
 
-        for method in self.get_providers():
-            lyrics = None
-            source = None
-            url = None
-            try:
-                (lyrics, source, url) = self._find_cached_lyrics(method, track, refresh)
-            except LyricsNotFoundException:
+        for method, lookup in self._start_lookups(track, refresh):
+            result = lookup.wait()
+            if result is None:
                 continue
+            (lyrics, source, url) = result
             lyrics = lyrics.strip()
             lyrics_found.append((method.display_name, lyrics, source, url))
 
@@ -222,47 +409,71 @@ class LyricsManager(providers.ProviderHandler):
 
         return lyrics_found
 
-    def _find_cached_lyrics(self, method, track, refresh=False):
+    def _start_lookups(self, track, refresh, first=False):
         """
-            Checks the cache for lyrics.  If found and not expired, returns
-            cached results, otherwise tries to fetch from method.
-
-            :param method: the LyricSearchMethod to fetch lyrics from.
-
-            :param track: the track we want lyrics for, it
-                must have artist/title tags
-
-            :param refresh: if True, try to refresh cached data even if
-                not expired
-
-            :return: list of tuples in the same format as
-                find_lyric's return value
+            Starts looking up lyrics from all providers at once, on a
+            pool of lookup_workers threads. Answers in the cache are
+            used right away. Each lookup gives up after the timeout
+            attribute of its provider, or the lyrics/timeout option.
+
+            :param first: whether only the first answer in the order of
+                preference is needed; providers after the first one with
+                a cached answer are not asked then
+            :return: list of (provider, lookup), in order of preference
+        """
+        lookups = []
+        for method in self.get_providers():
+            result = None if refresh else self._get_cached_lyrics(method, track)
+            if result is not None:
+                lookups.append((method, _LyricsLookup(method, result)))
+                if first:
+                    break
+                continue
+            lookup = _LyricsLookup(method)
+            self._get_lookup_pool().apply_async(lookup.run, (self, track))
+            lookups.append((method, lookup))
+        return lookups
+
+    def _get_lookup_pool(self):
+        with self.lookup_pool_lock:
+            if self.lookup_pool is None:
+                self.lookup_pool = ThreadPool(self.lookup_workers)
+            return self.lookup_pool
+
+    def _get_cached_lyrics(self, method, track):
+        """
+            Returns the cached lyrics of track from method, if they are
+            not expired
 
-            :raise LyricsNotFoundException: when lyrics are not found
-                in cache or fetched from method
+            :return: a tuple in the same format as find_lyric's return
+                value, or None
         """
-        lyrics = None
-        source = None
-        url = None
         cache_time = settings.get_option('lyrics/cache_time', 720)  # in hours
         key = self.__get_cache_key(track, method)
+        entry = self.cache[key]
+        if entry is None:
+            return None
+        try:
+            (lyrics, source, url, added) = entry
+            if datetime.now() - added >= timedelta(hours=cache_time):
+                return None
+            lyrics = zlib.decompress(lyrics)
+        except (TypeError, ValueError, zlib.error):
+            logger.warning("Ignoring damaged cached lyrics from %s", method.name)
+            return None
+        return (lyrics.decode('utf-8', errors='replace'), source, url)
+
+    def _fetch_lyrics(self, method, track):
+        """
+            Fetches lyrics from method and caches them
 
-        # check cache for lyrics
-        if key in self.cache:
-            (lyrics, source, url, time) = self.cache[key]
-            # return if they are not expired
-            now = datetime.now()
-            if now - time < timedelta(hours=cache_time) and not refresh:
-                try:
-                    lyrics = zlib.decompress(lyrics)
-                except zlib.error as e:
-                    raise LyricsNotFoundException(e)
-                return (lyrics.decode('utf-8', errors='replace'), source, url)
-
+            :raise LyricsNotFoundException: when method found no lyrics
+        """
         (lyrics, source, url) = method.find_lyrics(track)
         assert isinstance(lyrics, unicode), (method, track)
 
         # update cache
+        key = self.__get_cache_key(track, method)
         time = datetime.now()
         self.cache[key] = (zlib.compress(lyrics.encode('utf-8')), source, url, time)
 
@@ -308,6 +519,9 @@ class LyricSearchMethod(object):
         Lyrics plugins will subclass this
     """
 
+    #: Seconds to wait for lyrics, or None for the lyrics/timeout option
+    timeout = None
+
     def find_lyrics(self, track):
         """
             Called by LyricsManager when lyrics are requested
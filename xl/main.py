@@ -417,6 +417,13 @@ def create_argument_parser():
         default=False,
         help=_("Reduce level of output"),
     )
+    group.add_argument(
+        "--dump-playback-metrics",
+        dest="DumpPlaybackMetrics",
+        # TRANSLATORS: Meta variable for --dump-playback-metrics
+        metavar=_("LOCATION"),
+        help=_('Write playback latency and error statistics to LOCATION'),
+    )
     group.add_argument(
         '--startgui', dest='StartGui', action='store_true', default=False
     )
@@ -479,6 +486,12 @@ class Exaile(object):
         if self.options.UseDataDir:
             xdg.data_dirs.insert(1, self.options.UseDataDir)
 
+        # the running instance may have a different working directory
+        if self.options.DumpPlaybackMetrics:
+            self.options.DumpPlaybackMetrics = os.path.abspath(
+                self.options.DumpPlaybackMetrics
+            )
+
         # this is useful on Win32, because you cannot set these directories
         # via environment variables
         if self.options.UseAllDataDir:
@@ -103,6 +103,20 @@ formats = {
 # pass get_loc_for_io() to this.
 
 
+def get_format_class(loc):
+    """
+        get the Format class appropriate for the file at loc, without
+        opening the file. if no suitable class can be found, None is
+        returned.
+
+        :param loc: The location to read from as a Gio URI
+    """
+    path = _get_path(loc)
+    if not path:
+        return None
+    return _get_format_class(path)
+
+
 def get_format(loc):
     """
         get a Format object appropriate for the file at loc.
@@ -110,6 +124,21 @@ def get_format(loc):
 
         :param loc: The location to read from as a Gio URI
     """
+    loc = _get_path(loc)
+    if not loc:
+        return None
+
+    formatclass = _get_format_class(loc)
+    if formatclass is None:
+        return None  # not supported
+
+    try:
+        return formatclass(loc)
+    except NotReadable:
+        return None
+
+
+def _get_path(loc):
     loc = Gio.File.new_for_uri(loc).get_path()
     if not loc:
         return None
@@ -125,8 +154,11 @@ def get_format(loc):
         loc = loc.decode('utf-8')
     except UnicodeDecodeError:
         pass
+    return loc
 
-    ext = os.path.splitext(loc)[1]
+
+def _get_format_class(path):
+    ext = os.path.splitext(path)[1]
     ext = ext[1:]  # remove the pesky .
     ext = ext.lower()
 
@@ -137,11 +169,7 @@ def get_format(loc):
 
     if formatclass is None:
         formatclass = BaseFormat
-
-    try:
-        return formatclass(loc)
-    except NotReadable:
-        return None
+    return formatclass
 
 
 # vim: et sts=4 sw=4
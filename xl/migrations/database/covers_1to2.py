@@ -65,26 +65,37 @@ def migrate():
     """Migrate covers.db version 1 to 2 (Exaile 4.0)."""
 
     man = xl.covers.MANAGER
-    if man.db.get('version', 1) != 1:
+    old_db = man.legacy_db
+    if old_db is None or old_db.get('version', 1) != 1:
         return
     logger.info("Upgrading covers.db to version 2")
 
     valid_cachefiles = set()
 
-    old_db = man.db
-    new_db = {'version': 2}
+    db = man.db
     for coll in xl.collection.COLLECTIONS:
         for tr in coll.tracks.itervalues():
             key = old_get_track_key(tr._track)
             value = old_db.get(key)
             if value:
                 new_key = man._get_track_key(tr)
-                new_db[new_key] = value
+                # Covers set since the upgrade take precedence
+                if new_key and new_key not in db:
+                    db[new_key] = value
                 if value.startswith('cache:'):
                     valid_cachefiles.add(value[6:])
-    man.db = new_db
+    for key in db:
+        value = db.get(key)
+        if value.startswith('cache:'):
+            valid_cachefiles.add(value[6:])
+    db['version'] = 2
     man.save()
+    man.legacy_db = None
+    man.remove_legacy_db()
 
+    # Cache files are stored in subdirectories, see xl.covers.Cacher
     cachedir = os.path.join(man.location, 'cache')
-    for cachefile in frozenset(os.listdir(cachedir)) - valid_cachefiles:
-        os.remove(os.path.join(cachedir, cachefile))
+    for dirpath, dirnames, filenames in os.walk(cachedir):
+        for cachefile in filenames:
+            if cachefile not in valid_cachefiles:
+                os.remove(os.path.join(dirpath, cachefile))
@@ -0,0 +1,113 @@
+# Copyright (C) 2018 The Exaile developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+"""
+    Converts a shelf-based track database (Exaile 4.0 and earlier) into
+    a column store (see :mod:`xl.trax.colstore`).
+"""
+
+import logging
+import os
+import shutil
+
+from xl import common
+from xl.trax import colstore
+
+logger = logging.getLogger(__name__)
+
+#: Files the dbm modules may create next to the path they are given
+DBM_SUFFIXES = ('.db', '.dat', '.dir', '.pag', '.bak')
+
+
+def needs_migration(path):
+    """
+        Returns whether there is a shelf-based database at path
+    """
+    if os.path.exists(path):
+        return not colstore.is_column_store(path)
+
+    # some dbm modules don't use the path we give them, see open_shelf
+    from whichdb import whichdb
+
+    return whichdb(path) is not None
+
+
+def migrate(path, dbversion):
+    """
+        Migrates the shelf at path to a column store. A copy of the old
+        database is kept next to it.
+
+        :param dbversion: the current track database version, older
+            shelves are upgraded to it first
+    """
+    logger.info("Converting %s to a column store", path)
+
+    pdata = common.open_shelf(path)
+    try:
+        version = pdata.get('_dbversion', dbversion)
+        if int(version) > int(dbversion):
+            raise common.VersionError("DB was created on a newer Exaile version.")
+
+        # keep the original around, in case something goes wrong
+        pdata.sync()
+        shutil.copyfile(path, path + os.extsep + 'shelf-%s.bak' % version)
+
+        if version < dbversion:
+            import xl.migrations.database as dbmig
+
+            dbmig.handle_migration(None, pdata, version, dbversion)
+
+        writer = colstore.ColumnStoreWriter()
+        attrs = {}
+        seen = set()
+        for k in pdata.keys():
+            if not k.startswith('tracks-'):
+                attrs[k] = pdata[k]
+                continue
+            tags, key, row_attrs = pdata[k]
+            loc = tags.get('__loc')
+            if loc in seen:
+                logger.warning("Duplicate track found: %s", loc)
+                continue
+            seen.add(loc)
+            writer.add_row(tags, key, row_attrs)
+        attrs['_dbversion'] = dbversion
+    finally:
+        pdata.close()
+
+    writer.write(path, attrs)
+
+    # open_shelf may have left other files behind for some dbm types
+    for suffix in DBM_SUFFIXES:
+        extra = path + suffix
+        if not os.path.exists(extra):
+            continue
+        try:
+            os.unlink(extra)
+        except Exception as e:
+            logger.warning("Could not delete %s: %s", extra, e)
+
+    logger.info("Converted %d tracks", len(writer))
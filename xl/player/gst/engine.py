@@ -30,6 +30,7 @@ from gi.repository import Gst
 
 import logging
 import os
+import time
 import urlparse
 
 from xl import common
@@ -56,6 +57,7 @@ class ExaileGstEngine(ExaileEngine):
         * Audio plugins to modify the output stream
         * gapless playback
         * crossfading (requires gst-plugins-bad)
+        * prerolling the next track, for quicker track changes
         * Dynamic audio device switching at runtime
 
         Notes about crossfading:
@@ -82,6 +84,12 @@ class ExaileGstEngine(ExaileEngine):
           installed). Create multiple AudioStream objects, and they have a
           DynamicAudioSink object hooked up to an interaudiosink.
 
+        In normal mode, a spare AudioStream can also keep the next track
+        of the queue prerolled in the paused state. When that track is
+        played, whether the user skips to it or the current track ends,
+        the spare stream is swapped in instead of tearing down and
+        rebuilding the pipeline of the main stream.
+
         You can register plugins to modify the output audio via the following
         providers:
 
@@ -111,6 +119,13 @@ class ExaileGstEngine(ExaileEngine):
         self.user_fade_enabled = False
         self.user_fade_duration = 1000
 
+        # Preroll the next track on a spare stream, only used when
+        # crossfade isn't enabled
+        self.preroll_enabled = False
+
+        #: Seconds it took the last track change to start playing
+        self.last_skip_latency = None
+
         # Key: option name; value: attribute on self
         options = {
             '%s/crossfading' % self.name: 'crossfade_enabled',
@@ -120,12 +135,26 @@ class ExaileGstEngine(ExaileEngine):
             '%s/custom_sink_pipe' % self.name: 'custom_sink_pipe',
             '%s/user_fade_enabled' % self.name: 'user_fade_enabled',
             '%s/user_fade' % self.name: 'user_fade_duration',
+            '%s/preroll_next' % self.name: 'preroll_enabled',
         }
 
         self.settings_unsubscribe = common.subscribe_for_settings(
             self.name, options, self
         )
 
+        # The prerolled track has to follow changes of the queue
+        self.queue_unsubscribe = [
+            event.add_ui_callback(self._on_queue_changed, evty)
+            for evty in (
+                'playlist_tracks_added',
+                'playlist_tracks_removed',
+                'playlist_current_position_changed',
+                'playlist_shuffle_mode_changed',
+                'playlist_repeat_mode_changed',
+                'queue_current_playlist_changed',
+            )
+        ]
+
     #
     # Dynamic properties
     #
@@ -139,6 +168,9 @@ class ExaileGstEngine(ExaileEngine):
         if name in ['crossfade_enabled', 'crossfade_duration']:
             self._reconfigure_crossfader()
 
+        if name in ['crossfade_enabled', 'preroll_enabled']:
+            self._reconfigure_spare()
+
         if name in ['audiosink_device', 'audiosink', 'custom_sink_pipe']:
             self._reconfigure_sink()
 
@@ -153,10 +185,15 @@ class ExaileGstEngine(ExaileEngine):
         self.main_stream = AudioStream(self)
         self.other_stream = None
         self.crossfade_out = None
+        self.spare_stream = None
+        self._prepare_id = None
+        # (time, metrics kind) of the track change that is starting
+        self._skip_start = None
 
         self.player.engine_load_volume()
 
         self._reconfigure_crossfader()
+        self._reconfigure_spare()
 
     def _reconfigure_crossfader(self):
 
@@ -179,6 +216,19 @@ class ExaileGstEngine(ExaileEngine):
 
         self.main_stream.reconfigure_fader(cf_duration, cf_duration)
 
+    def _reconfigure_spare(self):
+
+        if self.preroll_enabled and not self.crossfade_enabled:
+            if self.spare_stream is None:
+                self.spare_stream = AudioStream(self)
+                self.spare_stream.set_user_volume(self.main_stream.get_user_volume())
+                self.logger.info("Prerolling next track: enabled")
+            self._schedule_prepare()
+        elif self.spare_stream is not None:
+            self.logger.info("Prerolling next track: disabled")
+            self.spare_stream.destroy()
+            self.spare_stream = None
+
     def _reconfigure_sink(self):
 
         self.logger.info("Reconfiguring audiosinks")
@@ -186,6 +236,8 @@ class ExaileGstEngine(ExaileEngine):
         self.main_stream.reconfigure_sink()
         if self.other_stream is not None:
             self.other_stream.reconfigure_sink()
+        if self.spare_stream is not None:
+            self.spare_stream.reconfigure_sink()
 
     def destroy(self, permanent=True):
         self.main_stream.destroy()
@@ -193,8 +245,18 @@ class ExaileGstEngine(ExaileEngine):
         if self.other_stream is not None:
             self.other_stream.destroy()
 
+        if self.spare_stream is not None:
+            self.spare_stream.destroy()
+            self.spare_stream = None
+
+        if self._prepare_id is not None:
+            GLib.source_remove(self._prepare_id)
+            self._prepare_id = None
+
         if permanent:
             self.settings_unsubscribe()
+            for unsubscribe in self.queue_unsubscribe:
+                unsubscribe()
 
         object.__setattr__(self, 'initialized', False)
 
@@ -256,11 +318,18 @@ class ExaileGstEngine(ExaileEngine):
         self.main_stream.set_user_volume(volume)
         if self.other_stream is not None:
             self.other_stream.set_user_volume(volume)
+        if self.spare_stream is not None:
+            self.spare_stream.set_user_volume(volume)
 
     def stop(self):
         if self.other_stream is not None:
             self.other_stream.stop()
 
+        # Don't keep a device open while nothing is playing
+        if self.spare_stream is not None:
+            self.spare_stream.discard_prepared()
+        self._skip_start = None
+
         prior_track = self.main_stream.stop(emit_eos=False)
         self.player.engine_notify_track_end(prior_track, True)
 
@@ -307,6 +376,26 @@ class ExaileGstEngine(ExaileEngine):
         if prior_track is not None:
             self.player.engine_notify_track_end(prior_track, False)
 
+        prepared = (
+            not already_queued
+            and self.spare_stream is not None
+            and self.spare_stream.prepared_track is track
+        )
+        if prepared:
+            self.logger.debug("Switching to prerolled stream")
+            old_stream = self.main_stream
+            self.main_stream, self.spare_stream = self.spare_stream, old_stream
+            old_stream.stop(emit_eos=False)
+
+        if already_queued or paused:
+            self._skip_start = None
+        elif prior_track is None:
+            self._skip_start = (time.time(), 'start')
+        elif prepared:
+            self._skip_start = (time.time(), 'skip_prerolled')
+        else:
+            self._skip_start = (time.time(), 'skip')
+
         if self.crossfade_enabled:
             self.main_stream, self.other_stream = self.other_stream, self.main_stream
             self.main_stream.play(
@@ -331,6 +420,55 @@ class ExaileGstEngine(ExaileEngine):
 
         self.player.engine_notify_track_start(track)
 
+        if self.spare_stream is not None:
+            self._schedule_prepare()
+
+    def _on_stream_playing(self, stream):
+        if stream is not self.main_stream or self._skip_start is None:
+            return
+
+        start, kind = self._skip_start
+        self._skip_start = None
+        latency = time.time() - start
+        self.player.metrics.add_latency(kind, latency)
+        if kind != 'start':
+            self.last_skip_latency = latency
+        self.logger.debug("Starting playback took %.0fms (%s)", latency * 1000, kind)
+
+    def _on_queue_changed(self, evtype, playlist, data):
+        if not self.initialized or self.spare_stream is None:
+            return
+
+        queue = self.player.queue
+        if queue is not None and (
+            playlist is queue or playlist is queue.current_playlist
+        ):
+            self._schedule_prepare()
+
+    def _schedule_prepare(self):
+        if self._prepare_id is None:
+            self._prepare_id = GLib.idle_add(self._prepare_next)
+
+    def _prepare_next(self):
+        self._prepare_id = None
+        stream = self.spare_stream
+        if stream is None:
+            return False
+
+        track = None
+        if self.main_stream.current_track is not None:
+            track = self.player.engine_get_next_track()
+            # Streams would start buffering, and may time out
+            if track is not None and not track.is_local():
+                track = None
+
+        if track is None:
+            stream.discard_prepared()
+        elif track is not stream.prepared_track:
+            stream.prepare(track)
+
+        return False
+
 
 class AudioStream(object):
     '''
@@ -353,6 +491,15 @@ class AudioStream(object):
         self.current_track = None
         self.buffered_track = None
 
+        # track prerolled by prepare(), not playing yet
+        self.prepared_track = None
+
+        # For metrics: start time of a pending seek or gapless transition,
+        # and whether playback is waiting for buffering
+        self.seek_start = None
+        self.gapless_start = None
+        self.buffering = False
+
         # This exists because if there is a sink error, it doesn't
         # really make sense to recreate the sink -- it'll just fail
         # again. Instead, wait for the user to try to play a track,
@@ -453,6 +600,40 @@ class AudioStream(object):
         self.playbin.set_state(Gst.State.PAUSED)
         self.fader.pause()
 
+    def _setup_filters(self):
+        # For the moment, the only safe time to add/remove elements
+        # is when the playbin is NULL, so call this only then
+        if self.audio_filters.setup_elements():
+            self.logger.debug("Applying audio filters")
+            self.playbin.props.audio_filter = self.audio_filters
+        else:
+            self.logger.debug("Not applying audio filters")
+            self.playbin.props.audio_filter = None
+
+    def prepare(self, track):
+        '''
+            Prerolls track in the paused state, so that play() can start
+            it without rebuilding the pipeline
+        '''
+
+        self.stop(emit_eos=False)
+        self._setup_filters()
+
+        if self.needs_sink:
+            self.reconfigure_sink()
+
+        uri = track.get_loc_for_io()
+        self.logger.debug("Prerolling %s", common.sanitize_url(uri))
+
+        self.prepared_track = track
+        self.playbin.set_property("uri", uri)
+        self.playbin.set_state(Gst.State.PAUSED)
+
+    def discard_prepared(self):
+        if self.prepared_track is not None:
+            self.prepared_track = None
+            self.playbin.set_state(Gst.State.NULL)
+
     def play(
         self,
         track,
@@ -464,17 +645,13 @@ class AudioStream(object):
     ):
         '''fade duration is in seconds'''
 
-        if not already_queued:
-            self.stop(emit_eos=False)
+        # The pipeline is set up already if the track is prerolled
+        prepared = not already_queued and track is self.prepared_track
+        self.prepared_track = None
 
-            # For the moment, the only safe time to add/remove elements
-            # is when the playbin is NULL, so do that here..
-            if self.audio_filters.setup_elements():
-                self.logger.debug("Applying audio filters")
-                self.playbin.props.audio_filter = self.audio_filters
-            else:
-                self.logger.debug("Not applying audio filters")
-                self.playbin.props.audio_filter = None
+        if not already_queued and not prepared:
+            self.stop(emit_eos=False)
+            self._setup_filters()
 
         if self.needs_sink:
             self.reconfigure_sink()
@@ -487,7 +664,7 @@ class AudioStream(object):
         self.logger.info("Playing %s", common.sanitize_url(uri))
 
         # This is only set for gapless playback
-        if not already_queued:
+        if not already_queued and not prepared:
             self.playbin.set_property("uri", uri)
             if urlparse.urlsplit(uri)[0] == "cdda":
                 self.notify_id = self.playbin.connect(
@@ -540,6 +717,7 @@ class AudioStream(object):
         self.last_position = new_position
         self.fader.seek(value)
 
+        self.seek_start = time.time()
         return self.playbin.send_event(seek_event)
 
     def set_volume(self, volume):
@@ -555,6 +733,7 @@ class AudioStream(object):
     def stop(self, emit_eos=True):
         prior_track = self.current_track
         self.current_track = None
+        self.prepared_track = None
         self.playbin.set_state(Gst.State.NULL)
         self.fader.stop()
 
@@ -596,6 +775,7 @@ class AudioStream(object):
             uri = track.get_loc_for_io()
             self.playbin.set_property('uri', uri)
             self.buffered_track = track
+            self.gapless_start = time.time()
 
             self.logger.debug(
                 "Gapless transition: queuing %s", common.sanitize_url(uri)
@@ -613,9 +793,15 @@ class AudioStream(object):
 
         if message.type == Gst.MessageType.BUFFERING:
             percent = message.parse_buffering()
+            metrics = self.engine.player.metrics
             if not percent < 100:
                 self.logger.info('Buffering complete')
+                self.buffering = False
+            elif not self.buffering:
+                self.buffering = True
+                metrics.increment('buffering_stalls')
             if percent % 5 == 0:
+                metrics.increment('buffering')
                 event.log_event('playback_buffering', self.engine.player, percent)
 
         elif message.type == Gst.MessageType.TAG:
@@ -624,6 +810,10 @@ class AudioStream(object):
 
             current = self.current_track
 
+            # Tags of a prerolled track, which isn't playing yet
+            if current is None:
+                return
+
             if not current.is_local():
                 gst_utils.parse_stream_tags(current, message.parse_tag())
 
@@ -651,6 +841,11 @@ class AudioStream(object):
             # This handles starting the next track during gapless transition
             buffered_track = self.buffered_track
             self.buffered_track = None
+            if self.gapless_start is not None:
+                self.engine.player.metrics.add_latency(
+                    'gapless', time.time() - self.gapless_start
+                )
+                self.gapless_start = None
             play_args = self.engine.player.engine_autoadvance_notify_next(
                 buffered_track
             ) + (True, True)
@@ -664,6 +859,21 @@ class AudioStream(object):
             if message.src == self.audio_sink:
                 self.playbin.notify("volume")
 
+            elif message.src == self.playbin:
+                new_state = message.parse_state_changed()[1]
+                if new_state == Gst.State.PLAYING:
+                    self.engine._on_stream_playing(self)
+
+        elif (
+            message.type == Gst.MessageType.ASYNC_DONE
+            and message.src == self.playbin
+            and self.seek_start is not None
+        ):
+            self.engine.player.metrics.add_latency(
+                'seek', time.time() - self.seek_start
+            )
+            self.seek_start = None
+
         elif message.type == Gst.MessageType.ERROR:
             self.__handle_error_message(message)
 
@@ -708,6 +918,16 @@ class AudioStream(object):
                         ': Possible audio device error, is it plugged in?'
                     )
 
+        # Failing to preroll the next track must not stop playback; the
+        # error comes up again if the track gets played
+        if self.current_track is None and self.prepared_track is not None:
+            self.logger.warning("Could not preroll next track: %s", message_text)
+            self.engine.player.metrics.increment('preroll_errors')
+            self.discard_prepared()
+            return
+
+        self.engine.player.metrics.increment('errors')
+
         self.logger.error("Playback error: %s", message_text)
         self.logger.debug("- Extra error info: %s", debug_info)
 
@@ -0,0 +1,200 @@
+# Copyright (C) 2018 The Exaile developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+"""
+    Latency and health metrics of the playback engines
+
+    Each player has a :class:`PlayerMetrics` object, see :func:`get`,
+    that its engine records into:
+
+    * latencies: ``start`` (from playing a track while stopped until
+      audio plays), ``skip`` and ``skip_prerolled`` (from changing the
+      track while playing), ``seek``, and ``gapless`` (from queuing the
+      next track for a gapless transition until it starts)
+    * counters: ``buffering`` (buffering events sent), ``buffering_stalls``
+      (times playback had to wait for buffering), ``errors`` and
+      ``preroll_errors``
+"""
+
+import json
+import threading
+import time
+
+_METRICS = {}
+_METRICS_LOCK = threading.Lock()
+
+
+class LatencyHistogram(object):
+    """
+        Histogram of durations, with fixed buckets
+    """
+
+    #: Upper bounds of the buckets in milliseconds; the last bucket
+    #: holds everything above
+    bounds = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    __slots__ = ['count', 'total', 'min', 'max', 'buckets']
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(self.bounds) + 1)
+
+    def add(self, seconds):
+        ms = seconds * 1000
+        self.count += 1
+        self.total += ms
+        if self.min is None or ms < self.min:
+            self.min = ms
+        if self.max is None or ms > self.max:
+            self.max = ms
+        for i, bound in enumerate(self.bounds):
+            if ms <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def percentile(self, percent):
+        """
+            Estimates the duration that percent of the recorded durations
+            do not exceed, as the upper bound of the bucket it falls in
+
+            :returns: milliseconds, or None if nothing was recorded
+        """
+        if not self.count:
+            return None
+        rank = max(1, -(-self.count * percent // 100))
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                if i < len(self.bounds):
+                    return min(self.bounds[i], self.max)
+                return self.max
+
+    def as_dict(self):
+        labels = ['<=%d' % bound for bound in self.bounds]
+        labels.append('>%d' % self.bounds[-1])
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count if self.count else None,
+            'min_ms': self.min,
+            'max_ms': self.max,
+            'p50_ms': self.percentile(50),
+            'p90_ms': self.percentile(90),
+            'p99_ms': self.percentile(99),
+            'buckets_ms': zip(labels, self.buckets),
+        }
+
+
+class PlayerMetrics(object):
+    """
+        Metrics of a single player. Thread safe.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+            Forgets everything recorded so far
+        """
+        with self.lock:
+            self.since = time.time()
+            self.latencies = {}
+            self.counters = {}
+
+    def add_latency(self, kind, seconds):
+        """
+            Records a duration
+
+            :param kind: the kind of latency, such as ``'seek'``
+            :param seconds: the duration
+        """
+        with self.lock:
+            try:
+                histogram = self.latencies[kind]
+            except KeyError:
+                histogram = self.latencies[kind] = LatencyHistogram()
+            histogram.add(seconds)
+
+    def increment(self, counter):
+        """
+            Adds one to counter
+        """
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + 1
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'since': self.since,
+                'latencies': {
+                    kind: histogram.as_dict()
+                    for kind, histogram in self.latencies.iteritems()
+                },
+                'counters': dict(self.counters),
+            }
+
+
+def get(name):
+    """
+        Returns the metrics of the player called name, creating them
+        if needed
+    """
+    with _METRICS_LOCK:
+        try:
+            return _METRICS[name]
+        except KeyError:
+            metrics = _METRICS[name] = PlayerMetrics(name)
+            return metrics
+
+
+def get_all():
+    """
+        :returns: the metrics of all players, as a JSON-compatible dict
+            keyed by player name
+    """
+    with _METRICS_LOCK:
+        metrics = list(_METRICS.values())
+    return {m.name: m.as_dict() for m in metrics}
+
+
+def dump(location):
+    """
+        Writes the metrics of all players to location, as JSON
+    """
+    data = get_all()
+    with open(location, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+# vim: et sts=4 sw=4
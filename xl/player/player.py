@@ -34,6 +34,8 @@ from xl import common
 from xl import event
 from xl import settings
 
+from . import metrics
+
 import logging
 
 logger = logging.getLogger(__name__)
@@ -68,6 +70,9 @@ class ExailePlayer(object):
         self._gapless_enabled = True
         self.__volume = 1.0
 
+        #: Latency and health metrics of the engine, see :mod:`.metrics`
+        self.metrics = metrics.get(name)
+
         options = {
             '%s/auto_advance_delay' % name: '_auto_advance_delay',
             '%s/auto_advance' % name: '_auto_advance',
@@ -508,6 +513,23 @@ class ExailePlayer(object):
 
         return self.queue.get_next()
 
+    def engine_get_next_track(self):
+        '''
+            Engine calls this when it wants to prepare the track that is
+            played next, whether by auto advance or because the user
+            skips to it. Unlike engine_autoadvance_get_next_track, this
+            does not depend on the auto advance settings.
+
+            :returns: The next track of the queue, or None
+
+            .. note:: Only to be called from engine
+        '''
+
+        if self.queue is None:
+            return None
+
+        return self.queue.get_next()
+
     def engine_autoadvance_notify_next(self, track):
         '''
             Engine calls this when it has started playing the next track as
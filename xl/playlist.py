@@ -38,6 +38,7 @@ import logging
 import os
 import random
 import re
+import threading
 import time
 import urlparse
 import urllib
@@ -943,6 +944,13 @@ class Playlist(object):
             if not isinstance(track, trax.Track):
                 raise ValueError("Need trax.Track object, got %r" % type(track))
             self.__tracks.append(track)
+
+        # Running aggregates, kept up to date as tracks are added, removed
+        # and changed: track -> [number of occurrences, length counted]
+        self.__aggregate_lock = threading.Lock()
+        self.__track_counts = {}
+        self.__total_length = 0
+        self.__count_tracks(self.__tracks)
         self.__shuffle_mode = self.shuffle_modes[0]
         self.__repeat_mode = self.repeat_modes[0]
         self.__dynamic_mode = self.dynamic_modes[0]
@@ -960,6 +968,7 @@ class Playlist(object):
         self.__shuffle_history_counter = 1  # start positive so we can
         # just do an if directly on the value
         event.add_callback(self.on_playback_track_start, "playback_track_start")
+        event.add_callback(self.on_track_tags_changed, "track_tags_changed", bulk=True)
 
     ### playlist-specific API ###
 
@@ -973,6 +982,41 @@ class Playlist(object):
     #: Whether the playlist was changed or not (boolean)
     dirty = property(lambda self: self.__dirty)
 
+    def get_total_length(self):
+        """
+            Retrieves the total length of the contained tracks, without
+            going through them
+
+            :returns: the length in seconds
+            :rtype: float
+        """
+        return self.__total_length
+
+    def __count_tracks(self, tracks):
+        with self.__aggregate_lock:
+            counts = self.__track_counts
+            for track in tracks:
+                try:
+                    counts[track][0] += 1
+                    length = counts[track][1]
+                except KeyError:
+                    length = track.get_tag_raw('__length') or 0
+                    counts[track] = [1, length]
+                self.__total_length += length
+
+    def __uncount_tracks(self, tracks):
+        with self.__aggregate_lock:
+            counts = self.__track_counts
+            for track in tracks:
+                count = counts[track]
+                self.__total_length -= count[1]
+                count[0] -= 1
+                if count[0] == 0:
+                    del counts[track]
+            if not counts:
+                # Don't let rounding errors pile up
+                self.__total_length = 0
+
     def clear(self):
         """
             Removes all contained tracks
@@ -1538,7 +1582,9 @@ class Playlist(object):
 
             trs.append(track)
 
+        self.__uncount_tracks(self.__tracks)
         self.__tracks[:] = trs
+        self.__count_tracks(trs)
 
         for item, val in items.iteritems():
             if item in self.save_attrs:
@@ -1623,6 +1669,8 @@ class Playlist(object):
             removed = [(i, oldtracks)]
             added = [(i, value)]
 
+        self.__uncount_tracks(track for pos, track in removed)
+        self.__count_tracks(track for pos, track in added)
         self.on_tracks_changed()
 
         if removed:
@@ -1648,6 +1696,7 @@ class Playlist(object):
         else:
             removed = [(i, oldtracks)]
 
+        self.__uncount_tracks(track for pos, track in removed)
         self.on_tracks_changed()
         event.log_event('playlist_tracks_removed', self, removed)
         self.__adjust_current_pos(oldpos, removed, [])
@@ -1709,6 +1758,19 @@ class Playlist(object):
             if self.dynamic_mode != 'disabled':
                 self.__fetch_dynamic_tracks()
 
+    def on_track_tags_changed(self, type, tracks, tags):
+        if '__length' not in tags:
+            return
+        with self.__aggregate_lock:
+            counts = self.__track_counts
+            for track in tracks:
+                count = counts.get(track)
+                if count is None:
+                    continue
+                length = track.get_tag_raw('__length') or 0
+                self.__total_length += (length - count[1]) * count[0]
+                count[1] = length
+
     def on_tracks_changed(self, *args):
         for idx in xrange(len(self.__tracks)):
             if self.__tracks.get_meta_key(idx, "playlist_current_position"):
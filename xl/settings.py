@@ -29,6 +29,7 @@
 """
 
 from ConfigParser import RawConfigParser, NoSectionError, NoOptionError
+import copy
 import logging
 import os
 import sys
@@ -51,6 +52,67 @@ TYPE_MAPPING = {
 
 MANAGER = None
 
+_MISSING = object()  # cached for options that are not set
+
+_IMMUTABLE = (basestring, int, long, float, type(None))
+
+
+def _copy_value(value):
+    """
+        Copies list and dict values, so that callers cannot change the
+        cached value
+    """
+    if isinstance(value, list):
+        if all(isinstance(v, _IMMUTABLE) for v in value):
+            return list(value)
+    elif isinstance(value, dict):
+        if all(isinstance(v, _IMMUTABLE) for v in value.itervalues()):
+            return dict(value)
+    else:
+        return value
+    return copy.deepcopy(value)
+
+
+class OptionHandle(object):
+    """
+        A handle to read an option repeatedly, without looking it up
+        each time. Values are read again after any option was changed.
+
+        Use :meth:`SettingsManager.get_option_handle` to get one.
+    """
+
+    __slots__ = ['manager', 'option', 'default', '_state']
+
+    def __init__(self, manager, option, default=None):
+        self.manager = manager
+        self.option = option
+        self.default = default
+        # (cache of the manager when the value was read, value); kept
+        # in a single attribute so that threads never see a mismatch
+        self._state = (None, None)
+
+    def get(self):
+        """
+            Returns the value of the option, or the default
+        """
+        cache, value = self._state
+        if cache is not self.manager._cache:
+            cache = self.manager._cache
+            value = self.manager._get_cached(self.option, cache)
+            self._state = (cache, value)
+        if value is _MISSING:
+            return self.default
+        return _copy_value(value)
+
+    def set(self, value, save=True):
+        """
+            Sets the option, see :meth:`SettingsManager.set_option`
+        """
+        self.manager.set_option(self.option, value, save)
+
+    def __repr__(self):
+        return '<OptionHandle %s>' % self.option
+
 
 class SettingsManager(RawConfigParser):
     """
@@ -74,6 +136,9 @@ class SettingsManager(RawConfigParser):
         """
         RawConfigParser.__init__(self)
 
+        # option -> parsed value, replaced when options change
+        self._cache = {}
+
         self.location = location
         self._saving = False
         self._dirty = False
@@ -148,6 +213,7 @@ class SettingsManager(RawConfigParser):
             self.add_section(section)
             self.set(section, key, value)
 
+        self._cache = {}
         self._dirty = True
 
         if save:
@@ -170,6 +236,33 @@ class SettingsManager(RawConfigParser):
             :returns: the option value or *default*
             :rtype: any
         """
+        value = self._get_cached(option, self._cache)
+        if value is _MISSING:
+            return default
+        return _copy_value(value)
+
+    def get_option_handle(self, option, default=None):
+        """
+            Returns a handle to read an option quickly and repeatedly,
+            e.g. in code that runs for each track or row
+
+            :param option: the full path to an option
+            :type option: string
+            :param default: a default value to use as fallback
+            :type default: any
+            :rtype: :class:`OptionHandle`
+        """
+        return OptionHandle(self, option, default)
+
+    def _get_cached(self, option, cache):
+        """
+            Returns the parsed value of an option, or _MISSING
+        """
+        try:
+            return cache[option]
+        except KeyError:
+            pass
+
         splitvals = option.split('/')
         section, key = "/".join(splitvals[:-1]), splitvals[-1]
 
@@ -177,10 +270,13 @@ class SettingsManager(RawConfigParser):
             value = self.get(section, key)
             value = self._str_to_val(value)
         except NoSectionError:
-            value = default
+            value = _MISSING
         except NoOptionError:
-            value = default
+            value = _MISSING
 
+        # Options are changed by replacing the cache, so if that happened
+        # in the meantime, this goes to the old one and is forgotten.
+        cache[option] = value
         return value
 
     def has_option(self, option):
@@ -210,6 +306,7 @@ class SettingsManager(RawConfigParser):
         section, key = "/".join(splitvals[:-1]), splitvals[-1]
 
         RawConfigParser.remove_option(self, section, key)
+        self._cache = {}
 
     def _set_direct(self, option, value):
         """
@@ -230,6 +327,7 @@ class SettingsManager(RawConfigParser):
             self.add_section(section)
             self.set(section, key, value)
 
+        self._cache = {}
         event.log_event('option_set', self, option)
 
     def _val_to_str(self, value):
@@ -348,6 +446,7 @@ MANAGER = SettingsManager(
 )
 
 get_option = MANAGER.get_option
+get_option_handle = MANAGER.get_option_handle
 set_option = MANAGER.set_option
 
 # vim: et sts=4 sw=4
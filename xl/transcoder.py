@@ -24,10 +24,18 @@
 # do so. If you do not wish to do so, delete this exception statement
 # from your version.
 
+from gi.repository import Gio
 from gi.repository import Gst
 
-from xl.nls import gettext as _
+from collections import deque
+import functools
 import logging
+import multiprocessing
+import os
+import threading
+
+from xl import common, trax
+from xl.nls import gettext as _
 
 logger = logging.getLogger(__name__)
 
@@ -58,6 +66,17 @@ FORMATS = {
         "desc"      : _("Vorbis is an open source, lossy audio codec with "
                         "high quality output at a lower file size than MP3.")
     },
+    "Opus" : {
+        "default"   : 128000,
+        "raw_steps" : [32000, 48000, 64000, 96000, 128000, 160000,
+                       192000, 256000],
+        "kbs_steps" : [32, 48, 64, 96, 128, 160, 192, 256],
+        "command"   : "opusenc bitrate=%i ! oggmux",
+        "extension" : "opus",
+        "plugins"   : ["opusenc", "oggmux"],
+        "desc"      : _("Opus is an open source, lossy audio codec with "
+                        "high quality output at low bitrates.")
+    },
     "FLAC" : {
         "default"   : 5,
         "raw_steps" : [0, 1, 2, 3, 4, 5, 6, 7, 8],
@@ -120,6 +139,20 @@ FORMATS = {
 # manually write the tags after transcoding has completed.
 
 
+def get_output_path(directory, base, extension, used):
+    """
+        Returns the path of directory/base.extension, with a number added
+        to base if that path is in used. The path is added to used.
+    """
+    output = os.path.join(directory, '%s.%s' % (base, extension))
+    n = 1
+    while output in used:
+        n += 1
+        output = os.path.join(directory, '%s (%d).%s' % (base, n, extension))
+    used.add(output)
+    return output
+
+
 def get_formats():
     ret = {}
     for name, val in FORMATS.iteritems():
@@ -190,6 +223,7 @@ class Transcoder(object):
             self.input,
             "decodebin name=\"decoder\"",
             "audioconvert",
+            "audioresample",
             self.encoder,
             self.output,
         ]
@@ -206,14 +240,21 @@ class Transcoder(object):
         self.running = True
         return pipe
 
+    def _remove_bus_watch(self):
+        if self.bus is not None:
+            self.bus.remove_signal_watch()
+            self.bus = None
+
     def stop(self):
         self.pipe.set_state(Gst.State.NULL)
+        self._remove_bus_watch()
         self.running = False
         self.__last_time = 0.0
         self.end_cb()
 
     def on_error(self, bus, message):
         self.pipe.set_state(Gst.State.NULL)
+        self._remove_bus_watch()
         self.running = False
         gerror, message_string = message.parse_error()
         self.error_cb(gerror, message_string)
@@ -227,8 +268,10 @@ class Transcoder(object):
         if not self.running:
             return 0.0
         try:
-            tim = self.pipe.query_position(Gst.Format.TIME)[0]
-            tim = tim / Gst.SECOND
+            res, tim = self.pipe.query_position(Gst.Format.TIME)
+            if not res:
+                return self.__last_time
+            tim = tim / float(Gst.SECOND)
             self.__last_time = tim
             return tim
         except Exception:
@@ -236,3 +279,303 @@ class Transcoder(object):
 
     def is_running(self):
         return self.running
+
+
+class TranscodeJob(object):
+    """
+        A single file to transcode, see :class:`TranscodeQueue`
+
+        The state of a job is one of ``'pending'``, ``'running'``,
+        ``'done'``, ``'skipped'``, ``'failed'`` or ``'cancelled'``.
+    """
+
+    def __init__(self, input, output, length=None, raw_input=False, track=None):
+        """
+            :param input: the path of the file to transcode, or a GStreamer
+                source element description if raw_input is True
+            :param output: the path to write to
+            :param length: the length of the input in seconds, used for
+                progress; taken from track if not given
+            :param raw_input: whether input is a source element description
+            :param track: the :class:`xl.trax.Track` being transcoded. If
+                given, its tags are written to the output once done.
+        """
+        self.input = input
+        self.output = output
+        #: Where the output is written to until the job is done, so that
+        #: unfinished outputs are not taken for up-to-date ones
+        self.partial_output = output + os.extsep + 'part'
+        if length is None and track is not None:
+            length = track.get_tag_raw('__length')
+        self.length = length
+        self.raw_input = raw_input
+        self.track = track
+        self.state = 'pending'
+        self.error = None
+        self.transcoder = None
+
+    def get_progress(self):
+        """
+            :returns: how much of the job is done, between 0 and 1
+        """
+        if self.state in ('done', 'skipped'):
+            return 1.0
+        transcoder = self.transcoder
+        if self.state != 'running' or transcoder is None or not self.length:
+            return 0.0
+        return min(transcoder.get_time() / float(self.length), 1.0)
+
+    def is_up_to_date(self):
+        """
+            :returns: whether the output exists and is newer than the input
+        """
+        if self.raw_input:
+            return False
+        try:
+            return os.path.getmtime(self.output) >= os.path.getmtime(self.input)
+        except OSError:
+            return False
+
+
+class TranscodeQueue(object):
+    """
+        Transcodes files to a single format, running several GStreamer
+        pipelines at the same time.
+
+        The pipelines report back through the GLib main loop, which thus
+        has to be running; the callbacks are called from there too.
+        Jobs can be added and cancelled from any thread.
+
+        ::
+
+            queue = TranscodeQueue('Opus', 128000)
+            for track in tracks:
+                queue.add(track.get_local_path(), output_for(track), track=track)
+            queue.start()
+    """
+
+    def __init__(
+        self,
+        destformat,
+        quality,
+        workers=None,
+        job_callback=None,
+        end_callback=None,
+        skip_up_to_date=True,
+    ):
+        """
+            :param destformat: the name of the format, see :data:`FORMATS`
+            :param quality: the quality, one of the raw_steps of the format
+            :param workers: how many pipelines to run at once, the number
+                of CPUs by default
+            :param job_callback: called with the queue and the job whenever
+                a job is finished, whether it succeeded or not
+            :param end_callback: called with the queue once all jobs are
+                finished or cancelled
+            :param skip_up_to_date: whether to skip jobs whose output is
+                newer than their input
+        """
+        if workers is None:
+            try:
+                workers = multiprocessing.cpu_count()
+            except NotImplementedError:
+                workers = 1
+        self.format = destformat
+        self.quality = quality
+        self.workers = max(1, workers)
+        self.job_callback = job_callback
+        self.end_callback = end_callback
+        self.skip_up_to_date = skip_up_to_date
+
+        self.jobs = []
+        self.pending = deque()
+        self.running = set()
+        self.lock = threading.Lock()
+        self.started = False
+        self.cancelled = False
+        self.finished = threading.Event()
+
+    def add(self, input, output, **kwargs):
+        """
+            Adds a job; see :class:`TranscodeJob` for the arguments.
+            It is started right away if the queue is running.
+
+            :returns: the :class:`TranscodeJob`
+            :raises: :class:`TranscodeError` if the queue was cancelled
+        """
+        job = TranscodeJob(input, output, **kwargs)
+        with self.lock:
+            if self.cancelled:
+                raise TranscodeError("Cannot add jobs to a cancelled queue")
+            self.jobs.append(job)
+            self.pending.append(job)
+            self.finished.clear()
+        if self.started:
+            self._start_jobs()
+        return job
+
+    def start(self):
+        """
+            Starts transcoding
+        """
+        with self.lock:
+            self.started = True
+        self._start_jobs()
+
+    def cancel(self, job=None):
+        """
+            Cancels job, or all jobs that are not finished yet. The output
+            of jobs that were running is removed. Once all jobs were
+            cancelled, no more jobs can be added.
+        """
+        with self.lock:
+            if job is None:
+                self.cancelled = True
+                jobs = list(self.pending) + list(self.running)
+            else:
+                jobs = [job]
+        for j in jobs:
+            self._finish(j, 'cancelled')
+        self._start_jobs()
+
+    def wait(self, timeout=None):
+        """
+            Waits until all jobs are finished
+
+            :returns: whether all jobs are finished
+        """
+        return self.finished.wait(timeout)
+
+    def is_running(self):
+        return self.started and not self.finished.is_set()
+
+    def get_progress(self):
+        """
+            :returns: how much of all jobs is done, between 0 and 1,
+                weighted by their length
+        """
+        with self.lock:
+            jobs = list(self.jobs)
+        total = done = 0.0
+        for job in jobs:
+            weight = job.length or 1
+            total += weight
+            if job.state != 'cancelled':
+                done += weight * job.get_progress()
+        if not total:
+            return 1.0
+        return done / total
+
+    def _start_jobs(self):
+        skipped = []
+        while True:
+            with self.lock:
+                if (
+                    not self.started
+                    or self.cancelled
+                    or not self.pending
+                    or len(self.running) >= self.workers
+                ):
+                    break
+                job = self.pending.popleft()
+                if self.skip_up_to_date and job.is_up_to_date():
+                    job.state = 'skipped'
+                    skipped.append(job)
+                    continue
+                transcoder = Transcoder(
+                    self.format,
+                    self.quality,
+                    functools.partial(self._on_error, job),
+                    functools.partial(self._on_end, job),
+                )
+                if job.raw_input:
+                    transcoder.set_raw_input(job.input)
+                else:
+                    transcoder.set_input(job.input)
+                transcoder.set_output(job.partial_output)
+                job.transcoder = transcoder
+                job.state = 'running'
+                self.running.add(job)
+            try:
+                directory = os.path.dirname(job.output)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                transcoder.start_transcode()
+            except Exception as e:
+                logger.exception("Could not start transcoding %s", job.input)
+                self._finish(job, 'failed', e)
+
+        for job in skipped:
+            logger.debug("Skipping up-to-date %s", job.output)
+            self._job_finished(job)
+
+        with self.lock:
+            done = (
+                self.started
+                and not self.pending
+                and not self.running
+                and not self.finished.is_set()
+            )
+            if done:
+                self.finished.set()
+        if done and self.end_callback is not None:
+            self.end_callback(self)
+
+    def _finish(self, job, state, error=None):
+        with self.lock:
+            previous = job.state
+            if previous == 'pending':
+                self.pending.remove(job)
+            elif previous == 'running':
+                self.running.discard(job)
+            else:
+                return  # finished already
+            job.state = state
+            job.error = error
+
+        if previous == 'running' and state == 'cancelled':
+            job.transcoder.stop()
+        if previous == 'running' and state == 'done':
+            try:
+                common.replace_file(job.partial_output, job.output)
+            except Exception as e:
+                logger.exception("Could not move %s into place", job.output)
+                job.state = state = 'failed'
+                job.error = e
+        if state in ('failed', 'cancelled') and previous == 'running':
+            try:
+                os.remove(job.partial_output)
+            except OSError:
+                pass
+        elif state == 'done' and job.track is not None:
+            self._write_tags(job)
+
+        self._job_finished(job)
+
+    def _job_finished(self, job):
+        if self.job_callback is not None:
+            self.job_callback(self, job)
+
+    @staticmethod
+    def _write_tags(job):
+        tags = {
+            tag: job.track.get_tag_raw(tag)
+            for tag in job.track.list_tags()
+            if not tag.startswith('__')
+        }
+        output = trax.Track(Gio.File.new_for_path(job.output).get_uri())
+        output.set_tags(**tags)
+        if not output.write_tags():
+            logger.warning("Could not write tags to %s", job.output)
+
+    def _on_end(self, job):
+        self._finish(job, 'done')
+        self._start_jobs()
+
+    def _on_error(self, job, gerror, message_string):
+        logger.warning("Error transcoding %s: %s", job.input, message_string)
+        self._finish(job, 'failed', gerror)
+        self._start_jobs()
+
+
+# vim: et sts=4 sw=4
@@ -0,0 +1,366 @@
+# Copyright (C) 2018 The Exaile developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+"""
+Columnar, memory-mapped storage for track databases.
+
+The file consists of a small header, a pickled metadata block, a table
+of interned values and one array per tag. Each tag array holds, for
+every row (track), the index of its value in the value table. Values
+that are shared by many tracks (artist, album, genre, ...) are therefore
+stored only once, and reading the location of every track at startup
+does not require decoding any of the other tags.
+
+Layout (all integers are little-endian uint32)::
+
+    magic, version, nrows, nvalues, meta_len
+    meta                      pickled dict, see ColumnStoreWriter.write
+    value offsets             nvalues + 1 entries, relative to value data
+    value data
+    keys                      nrows entries
+    one column per tag        nrows entries, value index + 1 (0 = unset)
+"""
+
+from array import array
+import cPickle as pickle
+import mmap
+import os
+import struct
+import sys
+
+from xl import common
+
+__all__ = ['ColumnStore', 'ColumnStoreWriter', 'is_column_store']
+
+MAGIC = b'EXLCOLS\x00'
+VERSION = 1
+
+_HEADER = struct.Struct('<8s4I')
+_UINT = struct.Struct('<I')
+
+# Value encodings. The first byte of each value tells how the rest of it
+# should be decoded.
+_BYTES = b'b'
+_UNICODE = b'u'
+_UNICODE_LIST = b'l'
+_PICKLE = b'p'
+
+
+def is_column_store(path):
+    """
+        Returns whether the file at path is a column store
+    """
+    try:
+        with open(path, 'rb') as fp:
+            return fp.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+
+def _uint_array(data=b''):
+    arr = array('I')
+    if data:
+        arr.fromstring(data)
+        if sys.byteorder != 'little':
+            arr.byteswap()
+    return arr
+
+
+def _uint_bytes(arr):
+    if sys.byteorder != 'little':
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tostring()
+
+
+def encode_value(value):
+    """
+        Encodes a tag value into the byte string stored in the value table
+    """
+    if isinstance(value, unicode):
+        return _UNICODE + value.encode('utf-8')
+    elif isinstance(value, bytes):
+        return _BYTES + value
+    elif (
+        isinstance(value, list)
+        and value
+        and all(isinstance(v, unicode) and u'\x00' not in v for v in value)
+    ):
+        return _UNICODE_LIST + u'\x00'.join(value).encode('utf-8')
+    return _PICKLE + pickle.dumps(value, common.PICKLE_PROTOCOL)
+
+
+def decode_value(data):
+    """
+        Decodes a value created by :func:`encode_value`
+    """
+    kind = data[:1]
+    if kind == _UNICODE_LIST:
+        return data[1:].decode('utf-8').split(u'\x00')
+    elif kind == _UNICODE:
+        return data[1:].decode('utf-8')
+    elif kind == _BYTES:
+        return data[1:]
+    return pickle.loads(data[1:])
+
+
+class ColumnStore(object):
+    """
+        Read-only view of a column store file.
+
+        Only the location and key columns are read when the store is
+        opened; everything else is read from the memory map when a row
+        is accessed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fp = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._fp.close()
+            raise
+
+        try:
+            self._parse()
+        except Exception:
+            self.close()
+            raise
+
+    def _parse(self):
+        mm = self._map
+        magic, version, nrows, nvalues, meta_len = _HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            raise ValueError("%s is not a column store" % self.path)
+        if version > VERSION:
+            raise common.VersionError(
+                "Column store was created on a newer Exaile version."
+            )
+
+        pos = _HEADER.size
+        meta = pickle.loads(mm[pos : pos + meta_len])
+        pos += meta_len
+
+        self.nrows = nrows
+        #: Non-track data saved along with the tracks
+        self.attrs = meta['attrs']
+        self._row_attrs = meta['row_attrs']
+
+        self._value_offsets = _uint_array(mm[pos : pos + 4 * (nvalues + 1)])
+        pos += 4 * (nvalues + 1)
+        self._value_base = pos
+        pos += self._value_offsets[-1]
+
+        self._keys = _uint_array(mm[pos : pos + 4 * nrows])
+        pos += 4 * nrows
+
+        self._columns = []
+        for tag in meta['columns']:
+            self._columns.append((tag, pos))
+            pos += 4 * nrows
+
+        # Locations are needed up front to key the tracks, so read the
+        # whole column now
+        self._locs = [None] * nrows
+        for tag, pos in self._columns:
+            if tag == '__loc':
+                self._locs = [
+                    self._get_value_bytes(vid - 1) if vid else None
+                    for vid in _uint_array(mm[pos : pos + 4 * nrows])
+                ]
+                break
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._fp.close()
+
+    def __len__(self):
+        return self.nrows
+
+    def _get_value_bytes(self, vid):
+        offsets = self._value_offsets
+        start = self._value_base + offsets[vid]
+        return self._map[start : self._value_base + offsets[vid + 1]]
+
+    def get_loc(self, row):
+        """
+            Returns the location stored in a row
+        """
+        data = self._locs[row]
+        if data is not None:
+            return decode_value(data)
+
+    def get_key(self, row):
+        return self._keys[row]
+
+    def get_row_attrs(self, row):
+        return dict(self._row_attrs.get(row, {}))
+
+    def get_raw(self, row):
+        """
+            Returns the encoded values of a row, suitable for passing
+            to :meth:`ColumnStoreWriter.add_raw_row`
+        """
+        unpack_from = _UINT.unpack_from
+        mm = self._map
+        offset = 4 * row
+        raw = {}
+        for tag, pos in self._columns:
+            vid = unpack_from(mm, pos + offset)[0]
+            if vid:
+                raw[tag] = self._get_value_bytes(vid - 1)
+        return raw
+
+    def get_tags(self, row):
+        """
+            Returns the decoded tags of a row
+        """
+        return {tag: decode_value(data) for tag, data in self.get_raw(row).iteritems()}
+
+
+class ColumnStoreWriter(object):
+    """
+        Builds a column store file.
+
+        Rows are accumulated in memory, then written out all at once
+        by :meth:`write`.
+    """
+
+    def __init__(self):
+        self._values = []
+        self._value_ids = {}
+        self._tags = {}
+        self._rows = []
+        self._keys = _uint_array()
+        self._row_attrs = {}
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _intern(self, data):
+        try:
+            return self._value_ids[data]
+        except KeyError:
+            vid = self._value_ids[data] = len(self._values) + 1
+            self._values.append(data)
+            return vid
+
+    def _add(self, raw, key, attrs):
+        row = []
+        for tag, data in raw.iteritems():
+            col = self._tags.get(tag)
+            if col is None:
+                col = self._tags[tag] = len(self._tags)
+            row.append((col, self._intern(data)))
+        if attrs:
+            self._row_attrs[len(self._rows)] = attrs
+        self._rows.append(row)
+        self._keys.append(key)
+
+    def add_row(self, tags, key, attrs=None):
+        """
+            Adds a row
+
+            :param tags: the tags of a track, as returned by
+                :meth:`xl.trax.Track._pickles`
+            :param key: the key of the track in its :class:`TrackDB`
+            :param attrs: additional (picklable) data for the row
+        """
+        self._add(
+            {tag: encode_value(value) for tag, value in tags.iteritems()}, key, attrs
+        )
+
+    def add_raw_row(self, raw, key, attrs=None):
+        """
+            Adds a row that was read by :meth:`ColumnStore.get_raw`
+        """
+        self._add(raw, key, attrs)
+
+    def write(self, path, attrs):
+        """
+            Writes the store to path, replacing any existing file atomically.
+
+            :param attrs: dictionary of additional data, available as
+                :attr:`ColumnStore.attrs` once loaded
+        """
+        tmp = self.write_temp(path, attrs)
+        try:
+            common.replace_file(tmp, path)
+        except Exception:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def write_temp(self, path, attrs):
+        """
+            Writes the store to a temporary file next to path, which the
+            caller has to move to path (see :func:`xl.common.replace_file`)
+
+            :param attrs: see :meth:`write`
+            :returns: the path of the temporary file
+        """
+        nrows = len(self._rows)
+        tags = sorted(self._tags, key=self._tags.get)
+
+        columns = [_uint_array() for _ in tags]
+        for col in columns:
+            col.extend([0] * nrows)
+        for rownum, row in enumerate(self._rows):
+            for col, vid in row:
+                columns[col][rownum] = vid
+
+        offsets = _uint_array()
+        offsets.append(0)
+        total = 0
+        for data in self._values:
+            total += len(data)
+            offsets.append(total)
+
+        meta = {'attrs': attrs, 'row_attrs': self._row_attrs, 'columns': tags}
+
+        data = pickle.dumps(meta, common.PICKLE_PROTOCOL)
+
+        tmp = path + os.extsep + 'tmp'
+        with open(tmp, 'wb') as fp:
+            fp.write(_HEADER.pack(MAGIC, VERSION, nrows, len(self._values), len(data)))
+            fp.write(data)
+            fp.write(_uint_bytes(offsets))
+            for value in self._values:
+                fp.write(value)
+            fp.write(_uint_bytes(self._keys))
+            for col in columns:
+                fp.write(_uint_bytes(col))
+            fp.flush()
+            os.fsync(fp.fileno())
+        return tmp
+
+
+# vim: et sts=4 sw=4
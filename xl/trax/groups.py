@@ -0,0 +1,187 @@
+# Copyright (C) 2018 The Exaile developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+"""
+Tree of track groups used to browse a :class:`TrackDB` by levels, such as
+artist, then album, then title.
+
+Every level but the last one groups the tracks of its parent group by the
+sort values (see :meth:`Track.get_tag_sort`) of the tags of that level.
+The tags of the last level are only used to sort the tracks of a group.
+
+The tree is built in one pass over the tracks, and is kept up to date by
+:class:`TrackDB` and ``track_tags_changed`` events, so that listing the
+children of a group does not require searching the database.
+"""
+
+import threading
+
+from xl import event
+from xl.trax.track import Track
+
+
+class TrackGroup(object):
+    """
+        Tracks that have the same sort values for the tags of a level and
+        of all levels above it. Groups are changed while holding the lock
+        of their :class:`TrackGroups`, so use its methods to get their
+        tracks and children.
+    """
+
+    __slots__ = ['key', 'first', 'tracks', 'children']
+
+    def __init__(self, key, first):
+        #: sort values of the tags of the level
+        self.key = key
+        #: a track of the group, used to display it
+        self.first = first
+        self.tracks = set()
+        #: key -> TrackGroup of the next level
+        self.children = {}
+
+    def __repr__(self):
+        return '<TrackGroup %r (%d tracks)>' % (self.key, len(self.tracks))
+
+
+class TrackGroups(object):
+    """
+        Groups the tracks of a :class:`TrackDB` (or a part of them) into
+        a tree of :class:`TrackGroup`.
+    """
+
+    def __init__(self, db, levels, tracks=None):
+        """
+            :param db: the container of the tracks
+            :param levels: a list of tuples of tags, one for each level
+            :param tracks: the tracks to group, all tracks of db if None
+        """
+        self.db = db
+        self.levels = [tuple(tags) for tags in levels]
+        self.lock = threading.RLock()
+        #: the groups are keyed by sort keys of this generation
+        self.sort_generation = Track._get_sort_generation()
+        self.root = TrackGroup(None, None)
+        # track -> keys of its groups
+        self._keys = {}
+        self.add_tracks(db if tracks is None else tracks)
+        event.add_callback(self._on_track_tags_changed, 'track_tags_changed', bulk=True)
+
+    def destroy(self):
+        event.remove_callback(self._on_track_tags_changed, 'track_tags_changed')
+
+    def _get_keys(self, track):
+        return tuple(
+            tuple(track.get_tag_sort(tag) for tag in tags) for tags in self.levels[:-1]
+        )
+
+    def _add(self, track, keys):
+        self._keys[track] = keys
+        group = self.root
+        group.tracks.add(track)
+        for key in keys:
+            child = group.children.get(key)
+            if child is None:
+                child = group.children[key] = TrackGroup(key, track)
+            child.tracks.add(track)
+            group = child
+
+    def _remove(self, track):
+        keys = self._keys.pop(track)
+        group = self.root
+        group.tracks.discard(track)
+        for key in keys:
+            child = group.children[key]
+            child.tracks.discard(track)
+            if not child.tracks:
+                # the groups below only contained this track too
+                del group.children[key]
+                break
+            if child.first is track:
+                child.first = next(iter(child.tracks))
+            group = child
+
+    def add_tracks(self, tracks):
+        with self.lock:
+            for track in tracks:
+                if track not in self._keys:
+                    self._add(track, self._get_keys(track))
+
+    def remove_tracks(self, tracks):
+        with self.lock:
+            for track in tracks:
+                if track in self._keys:
+                    self._remove(track)
+
+    def _on_track_tags_changed(self, type, tracks, tags):
+        with self.lock:
+            for track in tracks:
+                oldkeys = self._keys.get(track)
+                if oldkeys is None:
+                    continue
+                keys = self._get_keys(track)
+                if keys != oldkeys:
+                    self._remove(track)
+                    self._add(track, keys)
+
+    def get_children(self, groups):
+        """
+            Returns the groups of the next level below the given groups,
+            sorted by key. Children of several groups that have the same
+            key are returned together.
+
+            :param groups: groups of the same level, or None for the
+                groups of the first level
+            :returns: list of (key, [TrackGroup])
+        """
+        if groups is None:
+            groups = [self.root]
+        children = {}
+        with self.lock:
+            for group in groups:
+                for key, child in group.children.iteritems():
+                    children.setdefault(key, []).append(child)
+        return sorted(children.iteritems())
+
+    def get_tracks(self, groups=None):
+        """
+            Returns the tracks in the given groups, or all tracks
+        """
+        if groups is None:
+            groups = [self.root]
+        with self.lock:
+            if len(groups) == 1:
+                return set(groups[0].tracks)
+            return set().union(*[group.tracks for group in groups])
+
+    def count_tracks(self, groups):
+        """
+            Returns the number of tracks in the given groups
+        """
+        with self.lock:
+            return sum(len(group.tracks) for group in groups)
+
+
+# vim: et sts=4 sw=4
@@ -0,0 +1,319 @@
+# Copyright (C) 2018 The Exaile developers
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+"""
+Inverted tag index used to speed up searches on a :class:`TrackDB`.
+
+For each tag that has been searched on, the index maps every value (as
+returned by :meth:`Track.get_tag_search`) to the tracks that have it.
+Word tokens of the values are indexed too, so that "contains" searches
+only have to look at values sharing a word with the search term.
+
+The index is built per tag the first time that tag is searched, and is
+kept up to date by :class:`TrackDB` and ``track_tags_changed`` events.
+"""
+
+import logging
+import re
+import threading
+
+from xl import event
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# get_tag_search() values that depend on other tags
+_TAG_SOURCES = {'albumartist': {'artist'}, '__basename': {'__loc'}}
+
+
+def tokenize(value):
+    """
+        Splits a (lower-case) value into word tokens
+    """
+    return _TOKEN_RE.findall(value)
+
+
+def _bucket_add(mapping, key, item):
+    # Most values only belong to a single track, so only use a set
+    # once there is more than one item
+    try:
+        bucket = mapping[key]
+    except KeyError:
+        mapping[key] = item
+        return
+    if isinstance(bucket, set):
+        bucket.add(item)
+    elif bucket is not item:
+        mapping[key] = {bucket, item}
+
+
+def _bucket_remove(mapping, key, item):
+    """
+        :returns: True if key is gone from mapping afterwards
+    """
+    bucket = mapping.get(key)
+    if bucket is None:
+        return True
+    if isinstance(bucket, set):
+        bucket.discard(item)
+        if len(bucket) == 1:
+            mapping[key] = next(iter(bucket))
+        elif not bucket:
+            del mapping[key]
+            return True
+        return False
+    if bucket is item:
+        del mapping[key]
+        return True
+    return False
+
+
+def _bucket_update(result, bucket):
+    if isinstance(bucket, set):
+        result.update(bucket)
+    elif bucket is not None:
+        result.add(bucket)
+
+
+class _TagIndex(object):
+    """
+        Index of the values of a single tag
+    """
+
+    __slots__ = ['tag', 'values', 'lowered', 'tokens', 'track_values']
+
+    def __init__(self, tag):
+        self.tag = tag
+        #: value -> track(s)
+        self.values = {}
+        #: lower-case value -> original value(s)
+        self.lowered = {}
+        #: token -> original value(s), only built when needed
+        self.tokens = None
+        #: track -> tuple of values
+        self.track_values = {}
+
+    @staticmethod
+    def get_values(track, tag):
+        values = track.get_tag_search(tag, format=False)
+        if values == '__null__':
+            return (None,)
+        if isinstance(values, list):
+            return tuple(values)
+        return (values,)
+
+    def add(self, track):
+        values = self.get_values(track, self.tag)
+        self.track_values[track] = values
+        for value in values:
+            if value not in self.values:
+                self._add_value(value)
+            _bucket_add(self.values, value, track)
+
+    def remove(self, track):
+        for value in self.track_values.pop(track, ()):
+            if _bucket_remove(self.values, value, track):
+                self._remove_value(value)
+
+    def update(self, track):
+        values = self.get_values(track, self.tag)
+        if self.track_values.get(track) != values:
+            self.remove(track)
+            self.add(track)
+
+    def _add_value(self, value):
+        if value is None:
+            return
+        lowered = value.lower()
+        _bucket_add(self.lowered, lowered, value)
+        if self.tokens is not None:
+            for token in tokenize(lowered):
+                _bucket_add(self.tokens, token, value)
+
+    def _remove_value(self, value):
+        if value is None:
+            return
+        lowered = value.lower()
+        _bucket_remove(self.lowered, lowered, value)
+        if self.tokens is not None:
+            for token in tokenize(lowered):
+                _bucket_remove(self.tokens, token, value)
+
+    def build_tokens(self):
+        if self.tokens is None:
+            self.tokens = {}
+            for value in self.values:
+                if value is not None:
+                    for token in tokenize(value.lower()):
+                        _bucket_add(self.tokens, token, value)
+
+
+class TrackIndex(object):
+    """
+        Inverted index of the tracks in a :class:`TrackDB` (or any other
+        named container of tracks, such as a playlist).
+
+        Lookups return sets of tracks that *may* match; callers still
+        have to check each of them, see :func:`xl.trax.search_tracks`.
+    """
+
+    def __init__(self, db, tracks=None):
+        """
+            :param db: the container of the tracks
+            :param tracks: the tracks to index, all tracks of db if None
+        """
+        self.db = db
+        self.lock = threading.RLock()
+        self._tracks = set(db if tracks is None else tracks)
+        self._tags = {}
+        event.add_callback(self._on_track_tags_changed, 'track_tags_changed')
+
+    def destroy(self):
+        event.remove_callback(self._on_track_tags_changed, 'track_tags_changed')
+
+    def add_tracks(self, tracks):
+        with self.lock:
+            for track in tracks:
+                if track in self._tracks:
+                    continue
+                self._tracks.add(track)
+                for tagindex in self._tags.itervalues():
+                    tagindex.add(track)
+
+    def remove_tracks(self, tracks):
+        with self.lock:
+            for track in tracks:
+                if track not in self._tracks:
+                    continue
+                self._tracks.discard(track)
+                for tagindex in self._tags.itervalues():
+                    tagindex.remove(track)
+
+    def _on_track_tags_changed(self, type, track, tags):
+        with self.lock:
+            if track not in self._tracks:
+                return
+            for tag, tagindex in self._tags.iteritems():
+                if tags & _TAG_SOURCES.get(tag, {tag}):
+                    tagindex.update(track)
+
+    def _get_tag(self, tag):
+        tagindex = self._tags.get(tag)
+        if tagindex is None:
+            logger.debug("Indexing tag %s of %s", tag, self.db.name)
+            tagindex = _TagIndex(tag)
+            for track in self._tracks:
+                tagindex.add(track)
+            self._tags[tag] = tagindex
+        return tagindex
+
+    def get_all(self):
+        """
+            Returns all indexed tracks
+        """
+        with self.lock:
+            return set(self._tracks)
+
+    def find_values(self, tag, predicate):
+        """
+            Returns the tracks having a value of tag for which predicate
+            returns True. None is passed for tracks that lack the tag.
+        """
+        with self.lock:
+            tagindex = self._get_tag(tag)
+            result = set()
+            for value, bucket in tagindex.values.iteritems():
+                if predicate(value):
+                    _bucket_update(result, bucket)
+            return result
+
+    def find_lowered(self, tag, lowered, predicate):
+        """
+            Like :meth:`find_values`, but only looks at values that are
+            equal to lowered when converted to lower case.
+        """
+        with self.lock:
+            tagindex = self._get_tag(tag)
+            values = set()
+            _bucket_update(values, tagindex.lowered.get(lowered))
+            return self._tracks_for(tagindex, values, predicate)
+
+    def group_lowered(self, tag, lowered):
+        """
+            Returns a dict mapping each of the lower-case values in
+            lowered to the set of tracks having a value of tag that is
+            equal to it when converted to lower case. Values that no
+            track has are left out.
+        """
+        with self.lock:
+            tagindex = self._get_tag(tag)
+            groups = {}
+            for key in lowered:
+                values = set()
+                _bucket_update(values, tagindex.lowered.get(key))
+                tracks = set()
+                for value in values:
+                    _bucket_update(tracks, tagindex.values.get(value))
+                if tracks:
+                    groups[key] = tracks
+            return groups
+
+    def find_containing(self, tag, content, predicate):
+        """
+            Like :meth:`find_values`, but only looks at values that contain
+            content when converted to lower case.
+        """
+        tokens = tokenize(content.lower())
+        if not tokens:
+            return self.find_values(tag, predicate)
+
+        with self.lock:
+            tagindex = self._get_tag(tag)
+            tagindex.build_tokens()
+
+            values = None
+            for piece in sorted(tokens, key=len, reverse=True):
+                found = set()
+                for token, bucket in tagindex.tokens.iteritems():
+                    if piece in token:
+                        _bucket_update(found, bucket)
+                values = found if values is None else values & found
+                if not values:
+                    break
+
+            return self._tracks_for(tagindex, values, predicate)
+
+    @staticmethod
+    def _tracks_for(tagindex, values, predicate):
+        result = set()
+        for value in values:
+            if predicate(value):
+                _bucket_update(result, tagindex.values.get(value))
+        return result
+
+
+# vim: et sts=4 sw=4
@@ -78,6 +78,26 @@ class _Matcher(object):
     def _matches(self, value):
         raise NotImplementedError
 
+    def _match_value(self, value):
+        if value is not None:
+            value = self.lower(value)
+        return self._matches(value)
+
+    def _find(self, index):
+        """
+            Returns the tracks in index that may match, or None if
+            the index cannot narrow them down
+        """
+        return index.find_values(self.tag, self._match_value)
+
+    def _is_exact(self):
+        """
+            Whether the tracks returned by :meth:`_find` are known to
+            match, so that they need not be matched again
+        """
+        # the index checks its values with _match_value
+        return True
+
 
 class _ExactMatcher(_Matcher):
     """
@@ -98,6 +118,11 @@ class _ExactMatcher(_Matcher):
             newcontent = self.content
         return newvalue == newcontent
 
+    def _find(self, index):
+        if self.content is None or self.tag.startswith("__"):
+            return _Matcher._find(self, index)
+        return index.find_lowered(self.tag, self.content.lower(), self._match_value)
+
 
 class _InMatcher(_Matcher):
     """
@@ -112,6 +137,9 @@ class _InMatcher(_Matcher):
         except TypeError:
             return False
 
+    def _find(self, index):
+        return index.find_containing(self.tag, self.content, self._match_value)
+
 
 class _RegexMatcher(_Matcher):
     """
@@ -176,6 +204,14 @@ class _NotMetaMatcher(object):
     def match(self, srtrack):
         return not self.matcher.match(srtrack)
 
+    def _find(self, index):
+        found = _find_matching(self.matcher, index)
+        if found is not None:
+            return index.get_all() - found
+
+    def _is_exact(self):
+        return _is_exact(self.matcher)
+
 
 class _OrMetaMatcher(object):
     """
@@ -191,6 +227,12 @@ class _OrMetaMatcher(object):
     def match(self, srtrack):
         return self.left.match(srtrack) or self.right.match(srtrack)
 
+    def _find(self, index):
+        return _find_any([self.left, self.right], index)
+
+    def _is_exact(self):
+        return _is_exact(self.left) and _is_exact(self.right)
+
 
 class _MultiMetaMatcher(object):
     """
@@ -209,6 +251,12 @@ class _MultiMetaMatcher(object):
                 return False
         return True
 
+    def _find(self, index):
+        return _find_all(self.matchers, index)
+
+    def _is_exact(self):
+        return all(_is_exact(ma) for ma in self.matchers)
+
 
 class _ManyMultiMetaMatcher(object):
     """
@@ -239,6 +287,13 @@ class _ManyMultiMetaMatcher(object):
                     self.tags.update(ma.tags)
         return matched
 
+    def _find(self, index):
+        return _find_any(self.matchers, index)
+
+    def _is_exact(self):
+        # match() also records which tags matched each track
+        return False
+
 
 class TracksMatcher(object):
     """
@@ -297,6 +352,19 @@ class TracksMatcher(object):
             return True
         return False
 
+    def _find(self, index):
+        return _find_all(self.matchers, index)
+
+    def _is_exact(self):
+        return all(_is_exact(ma) for ma in self.matchers)
+
+    def _get_on_tags(self):
+        """
+            Returns the on_tags that :meth:`match` gives the tracks that
+            match, if this matcher is exact
+        """
+        return [ma.tag for ma in self.matchers if ma.tag is not None]
+
     def __tokens_to_matchers(self, tokens, matchers=None):
         """
             Converts a token hierarchy to a list of matchers
@@ -513,6 +581,12 @@ class TracksInList(object):
     def match(self, track):
         return track.track in self._tracks
 
+    def _find(self, index):
+        return self._tracks
+
+    def _is_exact(self):
+        return True
+
 
 class TracksNotInList(TracksInList):
     '''
@@ -522,17 +596,90 @@ class TracksNotInList(TracksInList):
     def match(self, track):
         return track.track not in self._tracks
 
+    def _find(self, index):
+        return index.get_all() - self._tracks
+
+
+def _find_matching(matcher, index):
+    find = getattr(matcher, '_find', None)
+    if find is not None:
+        return find(index)
 
-def search_tracks(trackiter, trackmatchers):
+
+def _is_exact(matcher):
+    is_exact = getattr(matcher, '_is_exact', None)
+    return is_exact is not None and is_exact()
+
+
+def _find_all(matchers, index):
+    result = None
+    for ma in matchers:
+        found = _find_matching(ma, index)
+        if found is None:
+            continue
+        result = found if result is None else result & found
+        if not result:
+            break
+    return result
+
+
+def _find_any(matchers, index):
+    result = set()
+    for ma in matchers:
+        found = _find_matching(ma, index)
+        if found is None:
+            return None
+        result.update(found)
+    return result
+
+
+def search_tracks(trackiter, trackmatchers, index=None):
     """
         Search a set of tracks for those that match specified conditions.
 
         :param trackiter: An iterable object returning Track objects
         :param trackmatchers: A list of TrackMatcher objects
+        :param index: A :class:`xl.trax.index.TrackIndex` containing
+            all tracks of trackiter, used to skip tracks that cannot
+            match. If not given, the index of trackiter is used if it
+            is a :class:`TrackDB`.
     """
+    if index is None:
+        get_search_index = getattr(trackiter, 'get_search_index', None)
+        if get_search_index is not None:
+            index = get_search_index()
+
+    candidates = None
+    if index is not None:
+        candidates = _find_all(trackmatchers, index)
+        if candidates is not None and trackiter is index.db:
+            trackiter = list(candidates)
+
+    # Candidates found by exact matchers match, so they only need the
+    # on_tags that matching would give them
+    on_tags = None
+    if candidates is not None and all(_is_exact(tma) for tma in trackmatchers):
+        on_tags = []
+        for tma in trackmatchers:
+            if isinstance(tma, TracksMatcher):
+                for tag in tma._get_on_tags():
+                    if tag not in on_tags:
+                        on_tags.append(tag)
+
     for srtr in trackiter:
         if not isinstance(srtr, SearchResultTrack):
             srtr = SearchResultTrack(srtr)
+        if candidates is not None:
+            if srtr.track not in candidates:
+                continue
+            if on_tags is not None:
+                for tag in on_tags:
+                    if tag not in srtr.on_tags:
+                        srtr.on_tags.append(tag)
+                yield srtr
+                continue
+        # Candidates are only known to possibly match, so check them
+        # anyway. This also fills in on_tags.
         for tma in trackmatchers:
             if not tma.match(srtr):
                 break
@@ -543,13 +690,14 @@ def search_tracks(trackiter, trackmatchers):
         # peculiarities in python's GIL that means the now-cpu-bound
         # thread running the search can end up blocking other threads.
         # Calling out to time.sleep forces a release of the GIL and
-        # allows other threads to run. Benchmarks show this has no
-        # noticable effect on search speed.
-        time.sleep(0)
+        # allows other threads to run. The index leaves few tracks to
+        # check, so it is not needed then.
+        if candidates is None:
+            time.sleep(0)
 
 
 def search_tracks_from_string(
-    trackiter, search_string, case_sensitive=True, keyword_tags=None
+    trackiter, search_string, case_sensitive=True, keyword_tags=None, index=None
 ):
     """
         Convenience wrapper around search_tracks that builds matchers
@@ -563,7 +711,7 @@ def search_tracks_from_string(
             search_string, case_sensitive=case_sensitive, keyword_tags=keyword_tags
         )
     ]
-    return search_tracks(trackiter, matchers)
+    return search_tracks(trackiter, matchers, index)
 
 
 def match_track_from_string(
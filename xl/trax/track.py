@@ -29,6 +29,7 @@ from copy import deepcopy
 from gi.repository import Gio
 from gi.repository import GLib
 import logging
+import threading
 import time
 import unicodedata
 import weakref
@@ -42,6 +43,9 @@ from xl.unicode import shave_marks
 
 logger = logging.getLogger(__name__)
 
+# read for every rating that is displayed
+_RATING_MAXIMUM = settings.get_option_handle('rating/maximum', 5)
+
 # map chars to appropriate subsitutes for sorting
 _sortcharmap = {
     u'ß': u'ss',  # U+00DF
@@ -69,6 +73,9 @@ _no_set_raw = {'__basename', '__loc'} | disk_tags
 
 _unset = object()
 
+# sort key cache entry for albumartist with artist_compilations=True
+_COMPILATION_SORT_KEY = ('albumartist', True)
+
 
 class _MetadataCacher(object):
     """
@@ -133,12 +140,29 @@ class Track(object):
     """
 
     # save a little memory this way
-    __slots__ = ["__tags", "_scan_valid", "_dirty", "__weakref__", "_init"]
+    __slots__ = [
+        "__tags",
+        "_scan_valid",
+        "_dirty",
+        "__weakref__",
+        "_init",
+        "_sort_keys",
+    ]
     # this is used to enforce the one-track-per-uri rule
     __tracksdict = weakref.WeakValueDictionary()
+    # databases that create their tracks on demand, see _add_lazy_source
+    __lazy_sources = weakref.WeakSet()
+    # tracks that have been changed since they were last saved
+    __dirty_tracks = weakref.WeakSet()
+    __dirty_lock = threading.Lock()
+    # held while the tags of any track are changed or copied, so that
+    # saving in the background gets consistent snapshots (see _pickles)
+    __tags_lock = threading.Lock()
     # store a copy of the settings values here - much faster (0.25 cpu
     # seconds) (see _the_cuts_cb)
     __the_cuts = settings.get_option('collection/strip_list', [])
+    # bumped to invalidate all cached sort keys (see get_tag_sort)
+    __sort_generation = 0
 
     def __new__(cls, *args, **kwargs):
         """
@@ -200,9 +224,15 @@ class Track(object):
                         tr.set_tags(**to_set)
 
             except KeyError:
-                tr = object.__new__(cls)
-                cls.__tracksdict[uri] = tr
-                tr._init = True
+                tr = None
+                if unpickles is None:
+                    tr = cls.__get_lazy_track(uri)
+                if tr is None:
+                    tr = object.__new__(cls)
+                    cls.__tracksdict[uri] = tr
+                    tr._init = True
+                else:
+                    tr._init = False
             return tr
         else:
             # this should always fail in __init__, and will never be
@@ -226,6 +256,7 @@ class Track(object):
             return
 
         self.__tags = {}
+        self._sort_keys = None
         self._scan_valid = None  # whether our last tag read attempt worked
 
         # This is not used by write_tags, this is used by the collection to
@@ -268,7 +299,9 @@ class Track(object):
         """
         self.__unregister()
         gloc = Gio.File.new_for_commandline_arg(loc)
-        self.__tags['__loc'] = gloc.get_uri()
+        with self.__tags_lock:
+            self.__tags['__loc'] = gloc.get_uri()
+        self._sort_keys = None
         self.__register()
         if notify_changed:
             event.log_event('track_tags_changed', self, {'__loc'})
@@ -357,9 +390,10 @@ class Track(object):
 
             # now that we've written the tags to disk, remove any tags that the
             # user asked to be deleted
-            to_remove = [k for k, v in self.__tags.iteritems() if v is None]
-            for rm in to_remove:
-                self.__tags.pop(rm)
+            with self.__tags_lock:
+                to_remove = [k for k, v in self.__tags.iteritems() if v is None]
+                for rm in to_remove:
+                    self.__tags.pop(rm)
 
             return f
         except IOError:
@@ -378,57 +412,108 @@ class Track(object):
                           be modified.
 
             Returns False if unsuccessful, and a Format object from
-            `xl.metadata` otherwise.
+            `xl.metadata` otherwise (only its class if the file was not
+            modified).
         """
         loc = self.get_loc_for_io()
         try:
-            f = metadata.get_format(loc)
+            modified = None if force else self.__tags.get('__modified', 0)
+            f, ntags = self._read_file_tags(loc, modified)
             if f is None:
                 self._scan_valid = False
                 return False  # not a supported type
 
-            # Retrieve file specific metadata
-            gloc = Gio.File.new_for_uri(loc)
-            mtime = gloc.query_info(
-                "time::modified", Gio.FileQueryInfoFlags.NONE, None
-            ).get_modification_time()
-            mtime = mtime.tv_sec + (mtime.tv_usec / 100000.0)
+            if ntags is not None:
+                self._set_tags_from_file(f, ntags, notify_changed)
+            return f
+        except Exception:
+            self._scan_valid = False
+            logger.exception("Error reading tags for %s", loc)
+            return False
 
-            if not force and self.__tags.get('__modified', 0) >= mtime:
-                return f
+    @staticmethod
+    def _get_file_mtime(fileinfo):
+        """
+            Returns the modification time from a :class:`Gio.FileInfo`,
+            in the form stored in the __modified tag
+        """
+        mtime = fileinfo.get_modification_time()
+        return mtime.tv_sec + (mtime.tv_usec / 100000.0)
 
-            # Read the tags
-            ntags = f.read_all()
-            ntags['__modified'] = mtime
+    @staticmethod
+    def _read_file_tags(loc, modified=None, mtime=None):
+        """
+            Reads the tags of the file at loc, along with its modification
+            time and directory. Does not touch any Track object, so it can
+            be called from a worker thread (see :meth:`Library.rescan`).
 
-            # TODO: this probably breaks on non-local files
-            ntags['__basedir'] = gloc.get_parent().get_path()
+            :param modified: if the file has not been modified since this
+                time, the tags are not read
+            :param mtime: the modification time of the file, if already
+                known (see :meth:`_get_file_mtime`)
+            :returns: (format, tags). format is None if the file type is
+                not supported, tags is None if the file is unmodified.
+        """
+        formatclass = metadata.get_format_class(loc)
+        if formatclass is None:
+            return None, None  # not a supported type
 
-            # remove tags that could be in the file, but are in fact not
-            # in the file. Retain tags in the DB that aren't supported by
-            # the file format.
+        # Retrieve file specific metadata
+        gloc = Gio.File.new_for_uri(loc)
 
-            nkeys = set(ntags.keys())
-            ekeys = {k for k in self.__tags.keys() if not k.startswith('__')}
+        def get_mtime():
+            return Track._get_file_mtime(
+                gloc.query_info("time::modified", Gio.FileQueryInfoFlags.NONE, None)
+            )
 
-            # delete anything that wasn't in the new tags
-            to_del = ekeys - nkeys
+        if modified is not None:
+            if mtime is None:
+                mtime = get_mtime()
+            # don't even open the file if it has not changed
+            if modified >= mtime:
+                return formatclass, None
 
-            # but if not others set, only delete supported tags
-            if not f.others:
-                to_del &= set(f.tag_mapping.keys())
+        f = metadata.get_format(loc)
+        if f is None:
+            return None, None
+        if mtime is None:
+            mtime = get_mtime()
 
-            for tag in to_del:
-                ntags[tag] = None
+        # Read the tags
+        ntags = f.read_all()
+        ntags['__modified'] = mtime
 
-            self.set_tags(notify_changed=notify_changed, **ntags)
+        # TODO: this probably breaks on non-local files
+        ntags['__basedir'] = gloc.get_parent().get_path()
+        return f, ntags
 
-            self._scan_valid = True
-            return f
-        except Exception:
-            self._scan_valid = False
-            logger.exception("Error reading tags for %s", loc)
-            return False
+    def _set_tags_from_file(self, format, ntags, notify_changed=True):
+        """
+            Replaces the tags of this track with tags read by
+            :meth:`_read_file_tags`.
+
+            :param format: the format object or class the tags were read
+                with
+        """
+        # remove tags that could be in the file, but are in fact not
+        # in the file. Retain tags in the DB that aren't supported by
+        # the file format.
+
+        nkeys = set(ntags.keys())
+        ekeys = {k for k in self.__tags.keys() if not k.startswith('__')}
+
+        # delete anything that wasn't in the new tags
+        to_del = ekeys - nkeys
+
+        # but if not others set, only delete supported tags
+        if not format.others:
+            to_del &= set(format.tag_mapping.keys())
+
+        for tag in to_del:
+            ntags[tag] = None
+
+        self.set_tags(notify_changed=notify_changed, **ntags)
+        self._scan_valid = True
 
     def is_local(self):
         """
@@ -465,7 +550,8 @@ class Track(object):
 
             internal use only please
         """
-        return deepcopy(self.__tags)
+        with self.__tags_lock:
+            return deepcopy(self.__tags)
 
     def _unpickles(self, pickle_obj):
         """
@@ -473,7 +559,10 @@ class Track(object):
 
             internal use only please
         """
-        self.__tags = deepcopy(pickle_obj)
+        tags = deepcopy(pickle_obj)
+        with self.__tags_lock:
+            self.__tags = tags
+        self._sort_keys = None
 
     def list_tags(self):
         """
@@ -556,12 +645,16 @@ class Track(object):
             # dict (which was done prior to Exaile 4), otherwise we don't know that
             # the user wanted the tag to be deleted
             new_value = self._xform_set_values(tag, values)
-            if self.__tags.get(tag, _unset) != new_value:
-                changed.add(tag)
-                self.__tags[tag] = new_value
+            with self.__tags_lock:
+                if self.__tags.get(tag, _unset) != new_value:
+                    changed.add(tag)
+                    self.__tags[tag] = new_value
 
         if changed:
+            self._sort_keys = None
             self._dirty = True
+            with self.__dirty_lock:
+                self.__dirty_tracks.add(self)
             if notify_changed:
                 event.log_event("track_tags_changed", self, changed)
 
@@ -603,6 +696,28 @@ class Track(object):
             :param extend_title: If the title tag is unknown, try to
                 add some identifying information to it.
         """
+        if not join:
+            return self.__get_tag_sort(tag, join, artist_compilations)
+
+        # Computing sort keys is expensive, so they are cached until the
+        # track or the strip list changes. Only albumartist depends on
+        # artist_compilations.
+        key = tag
+        if artist_compilations and tag == 'albumartist':
+            key = _COMPILATION_SORT_KEY
+
+        keys = self._sort_keys
+        if keys is None or keys[None] != Track.__sort_generation:
+            # replaced rather than cleared, so that a value computed
+            # from outdated tags is never put into the current cache
+            keys = self._sort_keys = {None: Track.__sort_generation}
+        try:
+            return keys[key]
+        except KeyError:
+            value = keys[key] = self.__get_tag_sort(tag, join, artist_compilations)
+            return value
+
+    def __get_tag_sort(self, tag, join, artist_compilations):
         # The two magic values here are to ensure that compilations
         # and unknown values are always sorted below all normal
         # values.
@@ -870,7 +985,7 @@ class Track(object):
         except (TypeError, KeyError, ValueError):
             return 0
 
-        maximum = settings.get_option("rating/maximum", 5)
+        maximum = _RATING_MAXIMUM.get()
         rating = int(round(rating * float(maximum) / 100.0))
 
         if rating > maximum:
@@ -888,7 +1003,7 @@ class Track(object):
             Returns the scaled rating
         """
         rating = float(rating)
-        maximum = float(settings.get_option("rating/maximum", 5))
+        maximum = float(_RATING_MAXIMUM.get())
         rating = min(rating, maximum)
         rating = max(0, rating)
         rating = float(rating * 100.0 / maximum)
@@ -1040,6 +1155,17 @@ class Track(object):
         """
         if data == "collection/strip_list":
             cls._Track__the_cuts = settings.get_option('collection/strip_list', [])
+            cls._Track__sort_generation += 1
+
+    @classmethod
+    def _get_sort_generation(cls):
+        """
+            PRIVATE
+
+            returns a number that changes whenever all cached sort keys
+            become invalid
+        """
+        return cls._Track__sort_generation
 
     ### Utility method intended for TrackDB ###
 
@@ -1048,5 +1174,44 @@ class Track(object):
         '''Internal API, returns number of track objects we have'''
         return len(cls._Track__tracksdict)
 
+    @classmethod
+    def _get_dirty_tracks(cls):
+        '''Internal API, returns the tracks that have unsaved changes'''
+        with cls._Track__dirty_lock:
+            return list(cls._Track__dirty_tracks)
+
+    @classmethod
+    def _clear_dirty_tracks(cls, tracks):
+        '''Internal API, marks tracks as saved'''
+        with cls._Track__dirty_lock:
+            for track in tracks:
+                track._dirty = False
+                cls._Track__dirty_tracks.discard(track)
+
+    @classmethod
+    def _mark_dirty_tracks(cls, tracks):
+        '''Internal API, marks tracks as changed again, e.g. if saving failed'''
+        with cls._Track__dirty_lock:
+            for track in tracks:
+                track._dirty = True
+                cls._Track__dirty_tracks.add(track)
+
+    @classmethod
+    def _add_lazy_source(cls, source):
+        '''
+            Internal API, registers an object that creates tracks on
+            demand. Its _get_lazy_track(uri) method is called before a
+            new Track is created, so that tracks known to the source
+            are not scanned again.
+        '''
+        cls._Track__lazy_sources.add(source)
+
+    @classmethod
+    def __get_lazy_track(cls, uri):
+        for source in list(cls._Track__lazy_sources):
+            tr = source._get_lazy_track(uri)
+            if tr is not None:
+                return tr
+
 
 event.add_callback(Track._the_cuts_cb, 'collection_option_set')
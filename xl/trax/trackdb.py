@@ -26,13 +26,20 @@
 
 from __future__ import absolute_import
 
+import cPickle as pickle
 import logging
+import os
+import sys
+import threading
 
 from copy import deepcopy
 
 from xl import common, event
 from xl.nls import gettext as _
 
+from xl.trax import colstore
+from xl.trax.groups import TrackGroups
+from xl.trax.index import TrackIndex
 from xl.trax.track import Track
 from xl.trax.util import sort_tracks
 from xl.trax.search import search_tracks_from_string
@@ -51,6 +58,47 @@ class TrackHolder(object):
     def __getattr__(self, attr):
         return getattr(self._track, attr)
 
+    def _get_loaded_track(self):
+        """
+            Returns the track, or None if it has not been created yet
+        """
+        return self._track
+
+
+class _LazyTrackHolder(TrackHolder):
+    """
+        A TrackHolder for a row of a column store. The Track object is
+        only created the first time it is accessed.
+    """
+
+    #: Held while a track is created from its store, and while the
+    #: store of the holders is replaced (see :meth:`TrackDB.compact`)
+    lock = threading.RLock()
+
+    def __init__(self, store, row):
+        self._source = (store, row)
+        self._key = store.get_key(row)
+        self._attrs = store.get_row_attrs(row)
+
+    def __getattr__(self, attr):
+        if attr == '_track':
+            with self.lock:
+                track = self.__dict__.get('_track')
+                if track is None:
+                    store, row = self._source
+                    track = Track(_unpickles=store.get_tags(row))
+                    self._track = track
+                    self._source = None
+                return track
+        return getattr(self._track, attr)
+
+    def _get_raw(self):
+        store, row = self._source
+        return store.get_raw(row)
+
+    def _get_loaded_track(self):
+        return self.__dict__.get('_track')
+
 
 class TrackDBIterator(object):
     def __init__(self, track_iterator):
@@ -109,7 +157,13 @@ class TrackDB(object):
         self._key = 0
         self._dbversion = 2.0
         self._dbminorversion = 0
-        self._deleted_keys = []
+        self._store = None
+        # changes that are not in the store yet, see save_to_location
+        self._added_locs = set()
+        self._removed_locs = set()
+        self._journal_count = 0
+        self._search_index = None
+        self._track_groups = None
         if location:
             self.load_from_location()
             self._timeout_save()
@@ -131,14 +185,25 @@ class TrackDB(object):
         """
         return len(self.tracks)
 
+    #: number of journal records after which the journal is folded
+    #: back into the store
+    journal_compact_threshold = 20000
+
     @common.glib_wait_seconds(300)
     def _timeout_save(self):
         """
             Callback for auto-saving.
         """
-        self.save_to_location()
+        self._save_in_background()
         return True
 
+    @common.threaded
+    def _save_in_background(self):
+        try:
+            self.save_to_location()
+        except Exception:
+            logger.exception("Exception occurred while saving %s", self.name)
+
     def set_name(self, name):
         """
             Sets the name of this :class:`TrackDB`
@@ -170,8 +235,11 @@ class TrackDB(object):
     @common.synchronized
     def load_from_location(self, location=None):
         """
-            Restores :class:`TrackDB` state from the pickled representation
-            stored at the specified location.
+            Restores :class:`TrackDB` state from the column store (see
+            :mod:`xl.trax.colstore`) at the specified location. Databases
+            in the old shelf format are converted first.
+
+            Track objects are only created when they are first accessed.
 
             :param location: the location to load the data from
             :type location: string
@@ -185,67 +253,232 @@ class TrackDB(object):
 
         logger.debug("Loading %s DB from %s.", self.name, location)
 
-        pdata = common.open_shelf(location)
+        from xl.migrations.database import to_colstore
 
-        if "_dbversion" in pdata:
-            if int(pdata['_dbversion']) > int(self._dbversion):
-                raise common.VersionError("DB was created on a newer Exaile version.")
-            elif pdata['_dbversion'] < self._dbversion:
-                logger.info("Upgrading DB format....")
-                import shutil
+        if to_colstore.needs_migration(location):
+            logger.info("Upgrading DB format....")
+            to_colstore.migrate(location, self._dbversion)
 
-                shutil.copyfile(location, location + "-%s.bak" % pdata['_dbversion'])
-                import xl.migrations.database as dbmig
+        if not os.path.exists(location):
+            self._dirty = False
+            return
 
-                dbmig.handle_migration(
-                    self, pdata, pdata['_dbversion'], self._dbversion
-                )
+        store = colstore.ColumnStore(location)
+        if int(store.attrs.get('_dbversion', 0)) > int(self._dbversion):
+            store.close()
+            raise common.VersionError("DB was created on a newer Exaile version.")
 
         for attr in self.pickle_attrs:
             try:
                 if 'tracks' == attr:
                     data = {}
-                    for k in (x for x in pdata.keys() if x.startswith("tracks-")):
-                        p = pdata[k]
-                        tr = Track(_unpickles=p[0])
-                        loc = tr.get_loc_for_io()
+                    for row in xrange(len(store)):
+                        loc = store.get_loc(row)
                         if loc not in data:
-                            data[loc] = TrackHolder(tr, p[1], **p[2])
+                            data[loc] = _LazyTrackHolder(store, row)
                         else:
                             logger.warning("Duplicate track found: %s", loc)
-                            # presumably the second track was written because of an error,
-                            # so use the first track found.
-                            del pdata[k]
 
                     setattr(self, attr, data)
-                else:
-                    setattr(self, attr, pdata.get(attr, getattr(self, attr)))
+                elif attr in store.attrs:
+                    setattr(self, attr, store.attrs[attr])
             except Exception:
                 # FIXME: Do something about this
                 logger.exception("Exception occurred while loading %s", location)
 
-        pdata.close()
+        self._close_store()
+        self._store = store
+        Track._add_lazy_source(self)
+
+        self._added_locs.clear()
+        self._removed_locs.clear()
+        self._journal_count = self._replay_journal(location)
+        self._reset_indexes()
 
         self._dirty = False
 
+    @staticmethod
+    def _get_journal_location(location):
+        return location + os.extsep + 'journal'
+
+    def _replay_journal(self, location):
+        """
+            Applies the changes recorded in the journal of the store at
+            location, e.g. after Exaile did not shut down cleanly.
+
+            :returns: the number of records read
+        """
+        path = self._get_journal_location(location)
+        if not os.path.exists(path):
+            return 0
+
+        count = 0
+        with open(path, 'r+b') as fp:
+            while True:
+                pos = fp.tell()
+                try:
+                    record = pickle.load(fp)
+                except EOFError:
+                    break
+                except Exception:
+                    # The last record may be incomplete if we crashed
+                    # while writing it. Cut it off, otherwise records
+                    # appended later could not be read.
+                    logger.warning("Ignoring damaged end of %s", path)
+                    fp.truncate(pos)
+                    break
+
+                count += 1
+                kind = record[0]
+                if kind == 'track':
+                    tags, key, attrs = record[1:]
+                    tr = Track(_unpickles=tags)
+                    self.tracks[tr.get_loc_for_io()] = TrackHolder(tr, key, **attrs)
+                    # in case the journal lacks the attrs record of the add
+                    self._key = max(self._key, key + 1)
+                elif kind == 'remove':
+                    self.tracks.pop(record[1], None)
+                elif kind == 'attrs':
+                    for attr, value in record[1].iteritems():
+                        setattr(self, attr, value)
+
+        logger.info("Replayed %d records from %s", count, path)
+        return count
+
+    def _close_store(self):
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+    def _get_lazy_track(self, loc):
+        """
+            Returns the track at loc if it is in this database but has
+            not been created yet. Used by :class:`xl.trax.Track`.
+        """
+        holder = self.tracks.get(loc)
+        if holder is not None and holder._get_loaded_track() is None:
+            return holder._track
+
+    def _get_dirty_tracks(self):
+        """
+            Returns the changed tracks that belong to this database
+        """
+        tracks = []
+        for track in Track._get_dirty_tracks():
+            holder = self.tracks.get(track.get_loc_for_io())
+            if holder is not None and holder._get_loaded_track() is track:
+                tracks.append(track)
+        return tracks
+
+    def _get_attrs(self):
+        attrs = {}
+        for attr in self.pickle_attrs:
+            if 'tracks' != attr:
+                attrs[attr] = deepcopy(getattr(self, attr))
+        attrs['_dbversion'] = self._dbversion
+        return attrs
+
     @common.synchronized
     def save_to_location(self, location=None):
         """
-            Saves a pickled representation of this :class:`TrackDB` to the
-            specified location.
+            Saves this :class:`TrackDB` as a column store at the specified
+            location.
+
+            When saving to the location the database was loaded from, only
+            the changes since the last save are appended to a journal next
+            to the store. Once the journal has grown large enough, it is
+            folded back into the store.
 
             :param location: the location to save the data to
             :type location: string
         """
-        if not self._dirty:
-            for track in self.tracks.itervalues():
-                if track._track._dirty:
-                    self._dirty = True
-                    break
+        if not location:
+            location = self.location
+        if not location:
+            raise AttributeError(_("You did not specify a location to save the db"))
+
+        if self._saving:
+            return
 
-        if not self._dirty:
+        if location != self.location:
+            self.compact(location)
+        elif self._store is None:
+            if self._has_changes():
+                self.compact(location)
+        elif self._journal_count >= self.journal_compact_threshold:
+            self.compact(location)
+        else:
+            self._append_journal(location)
+
+    def _has_changes(self):
+        return bool(
+            self._dirty
+            or self._added_locs
+            or self._removed_locs
+            or self._get_dirty_tracks()
+        )
+
+    def _append_journal(self, location):
+        dirty = self._get_dirty_tracks()
+        if not (dirty or self._dirty or self._added_locs or self._removed_locs):
             return
 
+        self._saving = True
+
+        # Clear the flags before taking a copy of the tags, so that
+        # changes made while we write are picked up by the next save
+        Track._clear_dirty_tracks(dirty)
+
+        records = []
+        if self._dirty:
+            records.append(('attrs', self._get_attrs()))
+        for loc in self._removed_locs:
+            records.append(('remove', loc))
+        written = set()
+        for track in dirty:
+            written.add(track.get_loc_for_io())
+        written.update(loc for loc in self._added_locs if loc in self.tracks)
+        for loc in written:
+            holder = self.tracks[loc]
+            records.append(
+                (
+                    'track',
+                    holder._track._pickles(),
+                    holder._key,
+                    deepcopy(holder._attrs),
+                )
+            )
+
+        path = self._get_journal_location(location)
+        logger.debug("Appending %d records to %s.", len(records), path)
+
+        try:
+            with open(path, 'ab') as fp:
+                for record in records:
+                    pickle.dump(record, fp, common.PICKLE_PROTOCOL)
+                fp.flush()
+                os.fsync(fp.fileno())
+        except Exception:
+            logger.exception("Failed to write music DB journal.")
+            Track._mark_dirty_tracks(dirty)
+            self._saving = False
+            return
+
+        self._journal_count += len(records)
+        self._added_locs.clear()
+        self._removed_locs.clear()
+        self._dirty = False
+        self._saving = False
+
+    @common.synchronized
+    def compact(self, location=None):
+        """
+            Writes the whole database to the store at location, and removes
+            the journal.
+
+            :param location: the location to save the data to
+            :type location: string
+        """
         if not location:
             location = self.location
         if not location:
@@ -258,41 +491,90 @@ class TrackDB(object):
         logger.debug("Saving %s DB to %s.", self.name, location)
 
         try:
-            pdata = common.open_shelf(location)
-            if pdata.get('_dbversion', self._dbversion) > self._dbversion:
-                raise common.VersionError("DB was created on a newer Exaile.")
+            if colstore.is_column_store(location):
+                existing = colstore.ColumnStore(location)
+                newer = int(existing.attrs.get('_dbversion', 0)) > int(self._dbversion)
+                existing.close()
+                if newer:
+                    raise common.VersionError("DB was created on a newer Exaile.")
         except Exception:
             logger.exception("Failed to open music DB for writing.")
+            self._saving = False
             return
 
-        for attr in self.pickle_attrs:
-            # bad hack to allow saving of lists/dicts of Tracks
-            if 'tracks' == attr:
-                for k, track in self.tracks.iteritems():
-                    key = "tracks-%s" % track._key
-                    if track._track._dirty or key not in pdata:
-                        pdata[key] = (
-                            track._track._pickles(),
-                            track._key,
-                            deepcopy(track._attrs),
-                        )
+        # Changes are only considered saved when writing our own store
+        own = location == self.location
+        dirty = self._get_dirty_tracks() if own else []
+        Track._clear_dirty_tracks(dirty)
+
+        writer = colstore.ColumnStoreWriter()
+        holders = []
+        for holder in self.tracks.itervalues():
+            track = holder._get_loaded_track()
+            if track is None:
+                writer.add_raw_row(holder._get_raw(), holder._key, holder._attrs)
+                holders.append(holder)
             else:
-                pdata[attr] = deepcopy(getattr(self, attr))
+                writer.add_row(track._pickles(), holder._key, deepcopy(holder._attrs))
+                holders.append(None)
 
-        pdata['_dbversion'] = self._dbversion
-
-        for key in self._deleted_keys:
-            key = "tracks-%s" % key
-            if key in pdata:
-                del pdata[key]
+        try:
+            tmp = writer.write_temp(location, self._get_attrs())
+        except Exception:
+            logger.exception("Failed to save music DB.")
+            Track._mark_dirty_tracks(dirty)
+            self._saving = False
+            return
 
-        pdata.sync()
-        pdata.close()
+        rebind = own and self._store is not None
+        # No track may be read from the store while it is replaced
+        with _LazyTrackHolder.lock:
+            if rebind and sys.platform == 'win32':
+                # the file cannot be replaced while it is mapped
+                self._close_store()
 
-        for track in self.tracks.itervalues():
-            track._track._dirty = False
+            try:
+                common.replace_file(tmp, location)
+                written = True
+            except Exception:
+                logger.exception("Failed to save music DB.")
+                Track._mark_dirty_tracks(dirty)
+                written = False
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+
+            if rebind:
+                # Tracks that were not created yet have to be read from the
+                # new file. The old mapping is released once nothing uses it.
+                store = colstore.ColumnStore(location)
+                for row, holder in enumerate(holders):
+                    source = holder is not None and holder._source
+                    if source:
+                        holder._source = (store, row if written else source[1])
+                self._store = store
+
+        if not written:
+            self._saving = False
+            return
 
-        self._dirty = False
+        # Everything in the journal is in the store now
+        journal = self._get_journal_location(location)
+        if os.path.exists(journal):
+            try:
+                os.unlink(journal)
+            except OSError:
+                logger.exception("Could not remove %s", journal)
+
+        if own:
+            if self._store is None:
+                self._store = colstore.ColumnStore(location)
+                Track._add_lazy_source(self)
+            self._journal_count = 0
+            self._added_locs.clear()
+            self._removed_locs.clear()
+            self._dirty = False
         self._saving = False
 
     def get_track_by_loc(self, loc, raw=False):
@@ -340,6 +622,7 @@ class TrackDB(object):
             Like add(), but takes a list of :class:`xl.trax.Track`
         """
         locations = []
+        added = []
         now = time()
         for tr in tracks:
             if not tr.get_tag_raw('__date_added'):
@@ -351,8 +634,16 @@ class TrackDB(object):
             locations += [location]
             self.tracks[location] = TrackHolder(tr, self._key)
             self._key += 1
+            added.append(tr)
+
+        if self._search_index is not None:
+            self._search_index.add_tracks(added)
+        if self._track_groups is not None:
+            self._track_groups.add_tracks(added)
 
         if locations:
+            self._added_locs.update(locations)
+            self._removed_locs.difference_update(locations)
             event.log_event('tracks_added', self, locations)
             self._dirty = True
 
@@ -370,20 +661,70 @@ class TrackDB(object):
             Like remove(), but takes a list of :class:`xl.trax.Track`
         """
         locations = []
+        removed = []
 
         for tr in tracks:
             location = tr.get_loc_for_io()
             locations += [location]
-            self._deleted_keys.append(self.tracks[location]._key)
             del self.tracks[location]
+            removed.append(tr)
 
-        event.log_event('tracks_removed', self, locations)
+        if self._search_index is not None:
+            self._search_index.remove_tracks(removed)
+        if self._track_groups is not None:
+            self._track_groups.remove_tracks(removed)
 
-        self._dirty = True
+        self._removed_locs.update(locations)
+        self._added_locs.difference_update(locations)
+        event.log_event('tracks_removed', self, locations)
 
     def get_tracks(self):
         return list(self)
 
+    @common.synchronized
+    def get_search_index(self):
+        """
+            Returns the :class:`xl.trax.index.TrackIndex` of this
+            database, creating it if needed. It is kept up to date
+            as tracks are added, removed and changed.
+        """
+        if self._search_index is None:
+            self._search_index = TrackIndex(self)
+        return self._search_index
+
+    def _reset_indexes(self):
+        if self._search_index is not None:
+            self._search_index.destroy()
+            self._search_index = None
+        if self._track_groups is not None:
+            self._track_groups.destroy()
+            self._track_groups = None
+
+    @common.synchronized
+    def get_track_groups(self, levels):
+        """
+            Returns a :class:`xl.trax.groups.TrackGroups` of all tracks
+            of this database, creating it if needed. It is kept up to
+            date as tracks are added, removed and changed.
+
+            Only the groups for the most recently requested levels are
+            kept. They are built again when the way tags are sorted
+            changes, see the collection/strip_list option.
+
+            :param levels: a list of tuples of tags, one for each level
+        """
+        levels = [tuple(tags) for tags in levels]
+        groups = self._track_groups
+        if (
+            groups is None
+            or groups.levels != levels
+            or groups.sort_generation != Track._get_sort_generation()
+        ):
+            if groups is not None:
+                groups.destroy()
+            groups = self._track_groups = TrackGroups(self, levels)
+        return groups
+
     def search(self, query, sort_fields=[], return_lim=-1, tracks=None, reverse=False):
         """
             DEPRECATED, DO NOT USE IN NEW CODE
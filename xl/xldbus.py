@@ -96,6 +96,7 @@ def check_exit(options, args, manager):
             'GetVolume',
             'Query',
             'FormatQuery',
+            'DumpPlaybackMetrics',
         ]:
             if getattr(options, command):
                 return "command"
@@ -129,6 +130,7 @@ def run_commands(options, manager):
         'SetRating',
         'Add',
         'ExportPlaylist',
+        'DumpPlaybackMetrics',
     )
 
     for command in argument_commands:
@@ -278,6 +280,12 @@ INTROSPECTION = '''
     <method name='GetState'>
       <arg name='return' type='s' direction='out' />
     </method>
+    <method name='GetPlaybackMetrics'>
+      <arg name='return' type='s' direction='out' />
+    </method>
+    <method name='DumpPlaybackMetrics'>
+      <arg name='location' type='s' direction='in' />
+    </method>
     <signal name='StateChanged' />
     <signal name='TrackChanged' />
   </interface>
@@ -788,6 +796,30 @@ class DbusObject:
 
         return player.PLAYER.get_state()
 
+    def GetPlaybackMetrics(self):
+        """
+            Returns the latency histograms and counters recorded by the
+            playback engines, see :mod:`xl.player.metrics`
+
+            :returns: the metrics of each player, as JSON
+            :rtype: string
+        """
+        import json
+        from xl.player import metrics
+
+        return json.dumps(metrics.get_all(), sort_keys=True)
+
+    def DumpPlaybackMetrics(self, location):
+        """
+            Writes the playback metrics to a file, as JSON
+
+            :param location: where to write the metrics to
+            :type location: string
+        """
+        from xl.player import metrics
+
+        metrics.dump(location)
+
     def StateChanged(self):  # signal
         """
             Emitted when state change occurs: 'playing' 'paused' 'stopped'
@@ -29,6 +29,7 @@ import os
 import os.path
 import tempfile
 import threading
+import time
 
 import cairo
 from gi.repository import Gio
@@ -38,7 +39,7 @@ from gi.repository import GLib
 from gi.repository import GObject
 from gi.repository import Gtk
 
-from xl import common, event, providers, settings, xdg
+from xl import common, covers, event, formatter, providers, settings, xdg
 from xl.covers import MANAGER as COVER_MANAGER
 from xl.nls import gettext as _
 from xlgui.widgets import dialogs, menu
@@ -64,6 +65,36 @@ def save_pixbuf(pixbuf, path, type_):
     pixbuf.savev(path, type_, [None], [])
 
 
+def make_thumbnails(data, sizes):
+    """Create thumbnails of a cover, see CoverManager.set_thumbnailer.
+
+    :param data: Image data of the cover
+    :type data: bytes
+    :param sizes: Maximum width and height of each thumbnail
+    :type sizes: list of int
+    :return: PNG data of the thumbnails
+    :rtype: list of bytes
+    """
+    pixbuf = pixbuf_from_data(data)
+    if pixbuf is None:
+        return []
+    width, height = pixbuf.get_width(), pixbuf.get_height()
+    thumbnails = []
+    for size in sizes:
+        scale = min(1.0, size / float(max(width, height)))
+        thumbnail = pixbuf.scale_simple(
+            max(1, int(width * scale)),
+            max(1, int(height * scale)),
+            GdkPixbuf.InterpType.BILINEAR,
+        )
+        success, buffer = thumbnail.save_to_bufferv('png', [], [])
+        thumbnails.append(buffer if success else None)
+    return thumbnails
+
+
+COVER_MANAGER.set_thumbnailer(make_thumbnails)
+
+
 class CoverManager(GObject.GObject):
     """
         Cover manager window
@@ -96,6 +127,8 @@ class CoverManager(GObject.GObject):
 
         self.outstanding_text = _('{outstanding} covers left to fetch')
         self.completed_text = _('All covers fetched')
+        # TRANSLATORS: Estimated time left while fetching covers
+        self.eta_text = _('about {time} left')
         self.cover_size = (90, 90)
         self.default_cover_pixbuf = pixbuf_from_data(
             COVER_MANAGER.get_default_cover(), self.cover_size
@@ -132,6 +165,8 @@ class CoverManager(GObject.GObject):
         self.window.show_all()
 
         self.stopper = threading.Event()
+        self.closed = False
+        self.fetcher = covers.CoverFetchScheduler(COVER_MANAGER)
         thread = threading.Thread(
             target=self.prefetch, name='CoverPrefetch', args=(collection,)
         )
@@ -168,37 +203,33 @@ class CoverManager(GObject.GObject):
 
         albums = sorted(albums)
 
-        outstanding = []
         # Speed up the following loop
-        get_cover = COVER_MANAGER.get_cover
         default_cover_pixbuf = self.default_cover_pixbuf
-        cover_size = self.cover_size
 
         self.emit('prefetch-started')
 
-        for i, album in enumerate(albums):
-            if self.stopper.is_set():
-                return
-
-            cover_data = get_cover(self.album_tracks[album][0], set_only=True)
-            cover_pixbuf = pixbuf_from_data(cover_data) if cover_data else None
-
-            try:
-                thumbnail_pixbuf = cover_pixbuf.scale_simple(
-                    *cover_size, interp_type=GdkPixbuf.InterpType.BILINEAR
-                )
-            except AttributeError:  # cover_pixbuf is None
-                thumbnail_pixbuf = default_cover_pixbuf
-                outstanding.append(album)
-
+        for album in albums:
             label = u'{0} - {1}'.format(*album)
-            iter = self.model.append((album, thumbnail_pixbuf, label))
+            iter = self.model.append((album, default_cover_pixbuf, label))
             self.model_path_cache[album] = self.model.get_path(iter)
 
-            self.emit('prefetch-progress', i + 1)
+        self.progress_start = time.time()
+        self.progress = 0
+        self.outstanding = []
+        tracks = [self.album_tracks[album][0] for album in albums]
+        track_albums = dict(zip(tracks, albums))
 
-        self.outstanding = outstanding
-        self.emit('prefetch-completed', len(self.outstanding))
+        def on_cover(track, cover_data):
+            pixbuf = self.get_thumbnail_pixbuf(cover_data)
+            GLib.idle_add(self.on_cover_prefetched, track_albums[track], pixbuf)
+
+        self.fetcher.fetch(
+            tracks, on_cover, self.stopper, set_only=True, size=self.cover_size[0]
+        )
+
+        if not self.stopper.is_set():
+            # Runs after the pending on_cover_prefetched calls
+            GLib.idle_add(self.on_prefetch_done)
 
     def fetch(self):
         """
@@ -206,34 +237,106 @@ class CoverManager(GObject.GObject):
         """
         self.emit('fetch-started', len(self.outstanding))
 
-        # Speed up the following loop
-        get_cover = COVER_MANAGER.get_cover
-        save = COVER_MANAGER.save
+        self.progress_start = time.time()
+        self.progress = 0
+        albums = list(self.outstanding)
+        tracks = [self.album_tracks[album][0] for album in albums]
+        track_albums = dict(zip(tracks, albums))
 
-        for i, album in enumerate(self.outstanding[:]):
-            if self.stopper.is_set():
-                # Allow for "fetch-completed" signal to be emitted
-                break
+        def on_cover(track, cover_data):
+            pixbuf = self.get_thumbnail_pixbuf(cover_data)
+            GLib.idle_add(self.on_cover_fetched, track_albums[track], pixbuf)
 
-            cover_data = get_cover(self.album_tracks[album][0], save_cover=True)
-            cover_pixbuf = pixbuf_from_data(cover_data) if cover_data else None
+        self.fetcher.fetch(
+            tracks, on_cover, self.stopper, save_cover=True, size=self.cover_size[0]
+        )
 
-            self.emit('fetch-progress', i + 1)
+        logger.debug('Saving cover database')
+        COVER_MANAGER.save()
 
-            if not cover_pixbuf:
-                continue
+        # Runs after the pending on_cover_fetched calls
+        GLib.idle_add(self.on_fetch_done)
 
-            self.outstanding.remove(album)
-            self.emit('cover-fetched', album, cover_pixbuf)
+    def get_thumbnail_pixbuf(self, cover_data):
+        """
+            Creates the pixbuf shown for a cover
 
-            if i % 50 == 0:
-                logger.debug('Saving cover database')
-                save()
+            :returns: the pixbuf, or None if there is no cover
+        """
+        cover_pixbuf = pixbuf_from_data(cover_data) if cover_data else None
 
-        logger.debug('Saving cover database')
-        save()
+        if cover_pixbuf is None:
+            return None
+
+        return cover_pixbuf.scale_simple(
+            *self.cover_size, interp_type=GdkPixbuf.InterpType.BILINEAR
+        )
+
+    def get_eta_text(self, total):
+        """
+            Estimates the time left for the current (pre)fetch
+
+            :param total: the number of albums to process
+            :returns: the text to show, or an empty string
+                if there is nothing to estimate yet
+        """
+        if self.progress == 0 or self.progress >= total:
+            return ''
 
-        self.emit('fetch-completed', len(self.outstanding))
+        elapsed = time.time() - self.progress_start
+        remaining = elapsed / self.progress * (total - self.progress)
+
+        return self.eta_text.format(
+            time=formatter.TimeTagFormatter.format_value(remaining, 'long')
+        )
+
+    def on_cover_prefetched(self, album, pixbuf):
+        """
+            Updates the album after looking up its stored cover
+        """
+        if self.closed:
+            return
+
+        if pixbuf is None:
+            self.outstanding.append(album)
+        else:
+            self.model[self.model_path_cache[album]][1] = pixbuf
+
+        self.progress += 1
+        self.emit('prefetch-progress', self.progress)
+
+    def on_prefetch_done(self):
+        """
+            Finishes the prefetch
+        """
+        if self.closed:
+            return
+
+        # Keep the order of the albums
+        self.outstanding.sort()
+        self.emit('prefetch-completed', len(self.outstanding))
+
+    def on_cover_fetched(self, album, pixbuf):
+        """
+            Updates the album after fetching its cover
+        """
+        if self.closed:
+            return
+
+        self.progress += 1
+
+        if pixbuf is not None and album in self.outstanding:
+            self.outstanding.remove(album)
+            self.emit('cover-fetched', album, pixbuf)
+
+        self.emit('fetch-progress', self.progress)
+
+    def on_fetch_done(self):
+        """
+            Finishes the fetch
+        """
+        if not self.closed:
+            self.emit('fetch-completed', len(self.outstanding))
 
     def show_cover(self):
         """
@@ -311,7 +414,12 @@ class CoverManager(GObject.GObject):
         """
             Updates the wiedgets to reflect the processed album
         """
-        fraction = progress / float(len(self.album_tracks))
+        total = len(self.album_tracks)
+        eta = self.get_eta_text(total)
+        self.progress_bar.set_text(
+            _('Collecting albums and covers...') + (' (%s)' % eta if eta else '')
+        )
+        fraction = progress / float(total)
         self.progress_bar.set_fraction(fraction)
 
     def do_fetch_started(self, outstanding):
@@ -346,6 +454,9 @@ class CoverManager(GObject.GObject):
 
         if outstanding > 0:
             progress_text = self.outstanding_text.format(outstanding=outstanding)
+            eta = self.get_eta_text(self.progress_bar.outstanding_total)
+            if eta:
+                progress_text = '%s (%s)' % (progress_text, eta)
         else:
             progress_text = self.completed_text
 
@@ -447,6 +558,7 @@ class CoverManager(GObject.GObject):
             Stops the current fetching process and closes the dialog
         """
         self.stopper.set()
+        self.closed = True
         self.window.destroy()
 
         # Free some memory
@@ -569,7 +681,8 @@ class CoverWidget(Gtk.EventBox):
         def __get_cover():
 
             fetch = not settings.get_option('covers/automatic_fetching', True)
-            cover_data = COVER_MANAGER.get_cover(track, set_only=fetch)
+            width = settings.get_option('gui/cover_width', 100)
+            cover_data = COVER_MANAGER.get_cover(track, set_only=fetch, size=width)
 
             if not cover_data:
                 return
@@ -586,7 +699,7 @@ class CoverWidget(Gtk.EventBox):
         if not self.cover_data:
             return
 
-        pixbuf = pixbuf_from_data(self.cover_data)
+        pixbuf = pixbuf_from_data(self.get_original_cover_data())
 
         if pixbuf:
             savedir = Gio.File.new_for_uri(self.__track.get_loc_for_io()).get_parent()
@@ -600,6 +713,18 @@ class CoverWidget(Gtk.EventBox):
             )
             window.show_all()
 
+    def get_original_cover_data(self):
+        """
+            Gets the full size cover of the current track, as the
+            displayed cover may be a thumbnail
+        """
+        cover_data = None
+
+        if self.__track is not None:
+            cover_data = COVER_MANAGER.get_cover(self.__track, set_only=True)
+
+        return cover_data or self.cover_data
+
     def fetch_cover(self):
         """
             Fetches a cover for the current track
@@ -696,7 +821,7 @@ class CoverWidget(Gtk.EventBox):
         if self.filename is None:
             self.filename = tempfile.mkstemp(prefix='exaile_cover_')[1]
 
-        pixbuf = pixbuf_from_data(self.cover_data)
+        pixbuf = pixbuf_from_data(self.get_original_cover_data())
         save_pixbuf(pixbuf, self.filename, 'png')
         selection.set_uris([Gio.File.new_for_path(self.filename).get_uri()])
 
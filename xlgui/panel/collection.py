@@ -34,6 +34,7 @@ import logging
 
 from xl.nls import gettext as _
 from xl import common, event, formatter, settings, trax
+from xl.trax.groups import TrackGroups
 import xlgui
 from xlgui import guiutil, icons, panel
 from xlgui.panel import menus
@@ -75,7 +76,9 @@ class Order(object):
     def __init__(self, name, levels, use_compilations=True):
         self.__name = name
         self.__levels = map(self.__parse_level, levels)
-        self.__formatters = [formatter.TrackFormatter(l[1]) for l in self.__levels]
+        self.__formatters = [
+            formatter.TrackFormatter(l[1], cache=True) for l in self.__levels
+        ]
         self.__use_compilations = use_compilations
 
     @staticmethod
@@ -179,6 +182,9 @@ class CollectionPanel(panel.Panel):
         self._show_collection_empty_message = _show_collection_empty_message
         self.collection = collection
         self.use_alphabet = settings.get_option('gui/use_alphabet', True)
+        self._sync_on_tag_change = settings.get_option_handle(
+            'gui/sync_on_tag_change', True
+        )
         self.panel_stack = self.builder.get_object('CollectionPanel')
         self.panel_content = self.builder.get_object('CollectionPanelContent')
         self.panel_empty = self.builder.get_object('CollectionPanelEmpty')
@@ -194,8 +200,13 @@ class CollectionPanel(panel.Panel):
         self._setup_images()
         self._connect_events()
         self.order = None
-        self.tracks = []
-        self.sorted_tracks = []
+        # groups of the tracks shown in the tree
+        self.groups = None
+        # whether the groups were made for a search, rather than being
+        # those of the collection
+        self._search_groups = False
+        # track -> tags matching the keyword
+        self._on_tags = {}
 
         event.add_ui_callback(
             self._check_collection_empty, 'libraries_modified', collection
@@ -252,9 +263,11 @@ class CollectionPanel(panel.Panel):
             }
         )
         self.tree.connect('key-release-event', self.on_key_released)
-        event.add_ui_callback(self.refresh_tags_in_tree, 'track_tags_changed')
         event.add_ui_callback(
-            self.refresh_tracks_in_tree, 'tracks_added', self.collection
+            self.refresh_tags_in_tree, 'track_tags_changed', bulk=True
+        )
+        event.add_ui_callback(
+            self.refresh_tracks_in_tree, 'tracks_added', self.collection, bulk=True
         )
         event.add_ui_callback(
             self.refresh_tracks_in_tree, 'tracks_removed', self.collection
@@ -406,7 +419,10 @@ class CollectionPanel(panel.Panel):
             (lambda m, i, d: m.get_value(i, 1) is None), None
         )
 
-        self.model = Gtk.TreeStore(GdkPixbuf.Pixbuf, str, object)
+        # columns: icon, text, search string, and the list of groups
+        # of the row, or a list with the track of the row at the bottom
+        # of the tree
+        self.model = Gtk.TreeStore(GdkPixbuf.Pixbuf, str, object, object)
 
         self.tree.connect("row-expanded", self.on_expanded)
 
@@ -414,11 +430,12 @@ class CollectionPanel(panel.Panel):
         """
             finds tracks matching a given iter.
         """
-        self.load_subtree(iter)
-        search = self.get_node_search_terms(iter)
-        matcher = trax.TracksMatcher(search)
-        srtrs = trax.search_tracks(self.tracks, [matcher])
-        return [x.track for x in srtrs]
+        nodes = self.model.get_value(iter, 3)
+        if not nodes:
+            return []
+        if self.model.iter_depth(iter) == len(self.order) - 1:
+            return list(nodes)
+        return list(self.groups.get_tracks(nodes))
 
     def append_to_playlist(self, item=None, event=None, replace=False):
         """
@@ -467,11 +484,14 @@ class CollectionPanel(panel.Panel):
 
         return " ".join(queries)
 
-    def refresh_tags_in_tree(self, type, track, tags):
+    def refresh_tags_in_tree(self, type, tracks, tags):
         if (
-            settings.get_option('gui/sync_on_tag_change', True)
+            self._sync_on_tag_change.get()
             and bool(tags & self.order.all_sort_tags())
-            and self.collection.loc_is_member(track.get_loc_for_io())
+            and any(
+                self.collection.loc_is_member(track.get_loc_for_io())
+                for track in tracks
+            )
         ):
             self._refresh_tags_in_tree()
 
@@ -488,18 +508,9 @@ class CollectionPanel(panel.Panel):
         # so we delay it until we're done scanning.
         if self.collection._scanning:
             return True
-        self.resort_tracks()
         self.load_tree()
         return False
 
-    def resort_tracks(self):
-        # import time
-        # print("sorting...", time.clock())
-        self.sorted_tracks = trax.sort_tracks(
-            self.order.get_sort_tags(0), self.collection.get_tracks()
-        )
-        # print("sorted.", time.clock())
-
     def load_tree(self):
         """
             Loads the Gtk.TreeView for this collection panel.
@@ -513,25 +524,32 @@ class CollectionPanel(panel.Panel):
         self.model.clear()
 
         self.root = None
-        oldorder = self.order
         self.order = self.orders[self.choice.get_active()]
 
-        if not oldorder or oldorder != self.order:
-            self.resort_tracks()
-
         # save the active view setting
         settings.set_option('gui/collection_active_view', self.choice.get_active())
 
+        levels = [self.order.get_sort_tags(i) for i in xrange(len(self.order))]
         keyword = self.keyword.strip()
-        tags = list(SEARCH_TAGS)
-        tags += self.order.all_search_tags()
-        tags = list(set(tags))  # uniquify list to speed up search
+        if self._search_groups:
+            # the groups of the previous search are not needed anymore
+            self.groups.destroy()
 
-        self.tracks = list(
-            trax.search_tracks_from_string(
-                self.sorted_tracks, keyword, case_sensitive=False, keyword_tags=tags
+        if keyword:
+            tags = list(SEARCH_TAGS)
+            tags += self.order.all_search_tags()
+            tags = list(set(tags))  # uniquify list to speed up search
+
+            srtrs = trax.search_tracks_from_string(
+                self.collection, keyword, case_sensitive=False, keyword_tags=tags
             )
-        )
+            self._on_tags = dict((srtr.track, srtr.on_tags) for srtr in srtrs)
+            self.groups = TrackGroups(self.collection, levels, self._on_tags)
+            self._search_groups = True
+        else:
+            self._on_tags = {}
+            self.groups = self.collection.get_track_groups(levels)
+            self._search_groups = False
 
         self.load_subtree(None)
 
@@ -592,16 +610,8 @@ class CollectionPanel(panel.Panel):
         if previously_loaded:
             return
 
-        search = self.get_node_search_terms(parent)
-
         try:
             tags = self.order.get_sort_tags(depth)
-            matchers = [trax.TracksMatcher(search)]
-            srtrs = trax.search_tracks(self.tracks, matchers)
-            # sort only if we are not on top level, because tracks are
-            # already sorted by fist order
-            if depth > 0:
-                srtrs = trax.sort_result_tracks(tags, srtrs)
         except IndexError:
             return  # at the bottom of the tree
         try:
@@ -612,68 +622,88 @@ class CollectionPanel(panel.Panel):
         if depth == len(self.order) - 1:
             bottom = True
 
+        nodes = None
+        if parent is not None:
+            nodes = self.model.get_value(parent, 3)
+        if bottom:
+            tracks = trax.sort_tracks(tags, self.groups.get_tracks(nodes))
+            entries = [(track, [track]) for track in tracks]
+        else:
+            entries = [
+                (children[0].first, children)
+                for key, children in self.groups.get_children(nodes)
+            ]
+
+        # tags of the levels below, which cause a node to be expanded
+        # when they match the keyword
+        alltags = []
+        for i in range(depth + 1, len(self.order)):
+            alltags.extend(self.order.get_sort_tags(i))
+
         display_counts = settings.get_option('gui/display_track_counts', True)
         draw_seps = settings.get_option('gui/draw_separators', True)
         last_char = ''
-        last_val = ''
         last_dval = ''
         last_matchq = ''
         count = 0
         first = True
         path = None
+        row_nodes = None
         expanded = False
         to_expand = []
 
-        for srtr in srtrs:
-            stagvals = [unicode(srtr.track.get_tag_sort(x)) for x in tags]
-            stagval = " ".join(stagvals)
-            if last_val != stagval or bottom:
-                tagval = self.order.format_track(depth, srtr.track)
-                match_query = " ".join(
-                    [srtr.track.get_tag_search(t, format=True) for t in tags]
+        for track, children in entries:
+            tagval = self.order.format_track(depth, track)
+            match_query = " ".join([track.get_tag_search(t, format=True) for t in tags])
+            if bottom:
+                match_query += " " + track.get_tag_search("__loc", format=True)
+
+            # Different *sort tags can cause groups to differ but the
+            # below code will produce identical entries in the displayed
+            # tree.  This condition checks to ensure that new entries are
+            # added if and only if they will display different results,
+            # avoiding that problem.
+            if match_query != last_matchq or tagval != last_dval or bottom:
+                if display_counts and path and not bottom:
+                    iter = self.model.get_iter(path)
+                    val = self.model.get_value(iter, 1)
+                    val = "%s (%s)" % (val, count)
+                    self.model.set_value(iter, 1, val)
+                    count = 0
+
+                last_dval = tagval
+                if depth == 0 and draw_seps:
+                    val = track.get_tag_sort(tags[0])
+                    char = first_meaningful_char(val)
+                    if first:
+                        last_char = char
+                    else:
+                        if char != last_char and last_char != '':
+                            self.model.append(parent, [None, None, None, None])
+                        last_char = char
+                first = False
+
+                last_matchq = match_query
+                row_nodes = list(children)
+                iter = self.model.append(
+                    parent, [image, tagval, match_query, row_nodes]
                 )
-                if bottom:
-                    match_query += " " + srtr.track.get_tag_search("__loc", format=True)
-
-                # Different *sort tags can cause stagval to not match
-                # but the below code will produce identical entries in
-                # the displayed tree.  This condition checks to ensure
-                # that new entries are added if and only if they will
-                # display different results, avoiding that problem.
-                if match_query != last_matchq or tagval != last_dval or bottom:
-                    if display_counts and path and not bottom:
-                        iter = self.model.get_iter(path)
-                        val = self.model.get_value(iter, 1)
-                        val = "%s (%s)" % (val, count)
-                        self.model.set_value(iter, 1, val)
-                        count = 0
-
-                    last_val = stagval
-                    last_dval = tagval
-                    if depth == 0 and draw_seps:
-                        val = srtr.track.get_tag_sort(tags[0])
-                        char = first_meaningful_char(val)
-                        if first:
-                            last_char = char
-                        else:
-                            if char != last_char and last_char != '':
-                                self.model.append(parent, [None, None, None])
-                            last_char = char
-                    first = False
-
-                    last_matchq = match_query
-                    iter = self.model.append(parent, [image, tagval, match_query])
-                    path = self.model.get_path(iter)
-                    expanded = False
-                    if not bottom:
-                        self.model.append(iter, [None, None, None])
-            count += 1
-            if not expanded:
-                alltags = []
-                for i in range(depth + 1, len(self.order)):
-                    alltags.extend(self.order.get_sort_tags(i))
-                for t in alltags:
-                    if t in srtr.on_tags:
+                path = self.model.get_path(iter)
+                expanded = False
+                if not bottom:
+                    self.model.append(iter, [None, None, None, None])
+            else:
+                row_nodes.extend(children)
+
+            if bottom:
+                count += 1
+            else:
+                count += self.groups.count_tracks(children)
+
+            if not expanded and alltags and self._on_tags:
+                for tr in self.groups.get_tracks(children):
+                    on_tags = self._on_tags.get(tr, ())
+                    if any(t in on_tags for t in alltags):
                         # keep original path intact for following block
                         newpath = path
                         if depth > 0:
@@ -684,6 +714,7 @@ class CollectionPanel(panel.Panel):
                             )
                         to_expand.append(newpath)
                         expanded = True
+                        break
 
         if display_counts and path and not bottom:
             iter = self.model.get_iter(path)
@@ -772,10 +803,8 @@ class CollectionDragTreeView(DragTreeView):
             :return: list of tracks [xl.trax.Track]
         """
         it = self.get_model().get_iter(path)
-        search = self.container.get_node_search_terms(it)
-        matcher = trax.TracksMatcher(search)
-        for i in trax.search_tracks(self.container.tracks, [matcher]):
-            yield i.track
+        for track in self.container._find_tracks(it):
+            yield track
 
 
 # vim: et sts=4 sw=4
@@ -107,6 +107,7 @@ def __create_collection_panel_context_menu():
     items.append(
         menuitems.OpenDirectoryMenuItem('open-directory', after=[items[-1].name])
     )
+    items.append(menuitems.ConvertMenuItem('convert', after=[items[-1].name]))
     items.append(
         menuitems.TrashMenuItem(
             'trash-tracks',
@@ -158,6 +159,7 @@ def __create_files_panel_context_menu():
     items.append(
         menuitems.OpenDirectoryMenuItem('open-directory', after=[items[-1].name])
     )
+    items.append(menuitems.ConvertMenuItem('convert', after=[items[-1].name]))
     items.append(
         menuitems.TrashMenuItem(
             'trash-tracks', after=[items[-1].name], trash_tracks_func=trash_tracks_func
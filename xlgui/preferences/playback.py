@@ -169,6 +169,11 @@ class GaplessPlayback(widgets.CheckPreference):
     name = 'player/gapless_playback'
 
 
+class PrerollNextTrack(widgets.CheckPreference):
+    default = False
+    name = 'player/preroll_next'
+
+
 class EngineConditional(widgets.Conditional):
     """
         True if the specified engine is selected
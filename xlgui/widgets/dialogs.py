@@ -34,8 +34,8 @@ import logging
 from gi.repository import Pango
 import os.path
 
-from xl import metadata, providers, settings, xdg
-from xl.common import clamp
+from xl import metadata, providers, settings, transcoder, xdg
+from xl.common import clamp, SimpleProgressThread
 from xl.playlist import (
     is_valid_playlist,
     import_playlist,
@@ -45,6 +45,7 @@ from xl.playlist import (
 )
 from xl.nls import gettext as _
 
+import xlgui
 from xlgui.guiutil import GtkTemplate
 from threading import Thread
 
@@ -1849,3 +1850,96 @@ def export_playlist_files(playlist, parent=None):
     dialog.connect('uris-selected', lambda widget, uris: _on_uri(uris[0]))
     dialog.run()
     dialog.destroy()
+
+
+def convert_tracks(tracks, parent=None):
+    """
+        Asks for a directory and a format, and transcodes the local tracks
+        among tracks into it
+    """
+    tracks = [track for track in tracks if track.is_local()]
+    if not tracks:
+        return
+
+    formats = transcoder.get_formats()
+    if not formats:
+        error(parent, _('No transcoding formats are available.'))
+        return
+    names = sorted(formats)
+    format_name = settings.get_option('transcode/format', 'Ogg Vorbis')
+    if format_name not in formats:
+        format_name = names[0]
+
+    format_combo = Gtk.ComboBoxText()
+    for name in names:
+        format_combo.append(name, name)
+    quality_combo = Gtk.ComboBoxText()
+
+    def on_format_changed(combo):
+        fmt = formats[combo.get_active_id()]
+        quality = settings.get_option('transcode/quality', fmt['default'])
+        if quality not in fmt['raw_steps']:
+            quality = fmt['default']
+        quality_combo.remove_all()
+        for raw, kbs in zip(fmt['raw_steps'], fmt['kbs_steps']):
+            quality_combo.append(str(raw), _('%d kbps') % kbs)
+        quality_combo.set_active(fmt['raw_steps'].index(quality))
+
+    format_combo.connect('changed', on_format_changed)
+    format_combo.set_active_id(format_name)
+
+    box = Gtk.Box(spacing=6)
+    box.pack_start(Gtk.Label(label=_('Format:')), False, False, 0)
+    box.pack_start(format_combo, False, False, 0)
+    box.pack_start(Gtk.Label(label=_('Quality:')), False, False, 0)
+    box.pack_start(quality_combo, False, False, 0)
+    box.show_all()
+
+    def on_uris_selected(widget, uris):
+        format_name = format_combo.get_active_id()
+        fmt = formats[format_name]
+        quality = fmt['raw_steps'][quality_combo.get_active()]
+        settings.set_option('transcode/format', format_name)
+        settings.set_option('transcode/quality', quality)
+        directory = Gio.File.new_for_uri(uris[0]).get_path()
+        _convert_tracks(tracks, directory, format_name, quality)
+
+    dialog = DirectoryOpenDialog(
+        title=_('Choose directory to convert tracks to'),
+        parent=parent,
+        select_multiple=False,
+    )
+    dialog.set_local_only(True)
+    dialog.set_extra_widget(box)
+    dialog.connect('uris-selected', on_uris_selected)
+    dialog.run()
+    dialog.destroy()
+
+
+def _convert_tracks(tracks, directory, format_name, quality):
+    extension = transcoder.FORMATS[format_name]['extension']
+    queue = transcoder.TranscodeQueue(format_name, quality)
+    used = set()
+    for track in tracks:
+        path = track.get_local_path()
+        base = os.path.splitext(os.path.basename(path))[0]
+        output = transcoder.get_output_path(directory, base, extension, used)
+        queue.add(path, output, track=track)
+
+    def run():
+        queue.start()
+        try:
+            while not queue.wait(0.5):
+                yield queue.get_progress() * 100
+        finally:
+            queue.cancel()
+
+        failed = [job for job in queue.jobs if job.state == 'failed']
+        if failed:
+            message = _('%d tracks could not be converted.') % len(failed)
+            GLib.idle_add(error, None, message)
+
+    thread = SimpleProgressThread(run)
+    xlgui.get_controller().progress_manager.add_monitor(
+        thread, _('Converting tracks...'), 'document-save'
+    )
@@ -429,7 +429,7 @@ class StatusbarTextFormatter(formatter.Formatter):
             return ''
 
         playlist_count = len(page.playlist)
-        selection_count = len(page.view.get_selected_tracks())
+        selection_count = page.view.get_selection_count()
 
         if selection == 'none':
             count = playlist_count
@@ -479,12 +479,12 @@ class StatusbarTextFormatter(formatter.Formatter):
         if not isinstance(page, playlist.PlaylistPage):
             return ''
 
-        playlist_duration = sum(t.get_tag_raw('__length') or 0 for t in page.playlist)
-        selection_tracks = page.view.get_selected_tracks()
-        selection_count = len(selection_tracks)
-        selection_duration = sum(
-            t.get_tag_raw('__length') or 0 for t in selection_tracks
-        )
+        playlist_duration = page.playlist.get_total_length()
+        selection_count = page.view.get_selection_count()
+        if selection_count > 1:
+            selection_duration = page.view.get_selection_length()
+        else:
+            selection_duration = 0
 
         if selection == 'none':
             duration = playlist_duration
@@ -206,6 +206,25 @@ def OpenDirectoryMenuItem(name, after, get_tracks_func=generic_get_tracks_func):
     )
 
 
+def _convert_cb(widget, name, parent, context, get_tracks_func):
+    from xlgui import main
+
+    tracks = get_tracks_func(parent, context)
+    if tracks:
+        dialogs.convert_tracks(tracks, main.mainwindow().window)
+
+
+def ConvertMenuItem(name, after, get_tracks_func=generic_get_tracks_func):
+    return menu.simple_menu_item(
+        name,
+        after,
+        _("_Convert..."),
+        'document-save-as',
+        _convert_cb,
+        callback_args=[get_tracks_func],
+    )
+
+
 def generic_trash_tracks_func(parent, context, tracks):
     for track in tracks:
         gfile = Gio.File.new_for_uri(track.get_loc_for_io())
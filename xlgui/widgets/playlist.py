@@ -31,12 +31,14 @@ from gi.repository import GObject
 from gi.repository import Gtk
 from gi.repository import Pango
 
+from collections import OrderedDict
 import logging
 import sys
 
 from xl.nls import gettext as _
 from xl.playlist import Playlist, is_valid_playlist, import_playlist
 from xl import common, event, main, player, providers, settings, trax, xdg
+from xl.trax.index import TrackIndex
 
 from xlgui.widgets.common import AutoScrollTreeView
 from xlgui.widgets.notebook import NotebookPage
@@ -421,6 +423,8 @@ def __create_playlist_context_menu():
         )
     )
 
+    items.append(menuitems.ConvertMenuItem('convert', [items[-1].name]))
+
     for item in items:
         providers.register('playlist-context-menu', item)
 
@@ -771,15 +775,12 @@ class PlaylistPage(PlaylistPageBase):
         '''Called when tracks are being loaded into the model'''
         if loading:
             if self.loading is None and self.loading_timer is None:
-                self.view.set_model(None)
                 self.loading_timer = GLib.timeout_add(500, self.on_data_loading_timer)
         else:
             if self.loading_timer is not None:
                 GLib.source_remove(self.loading_timer)
                 self.loading_timer = None
 
-            self.view.set_model(self.view.modelfilter)
-
             if self.loading is not None:
                 guiutil.gtk_widget_replace(self.loading, self.playlist_window)
                 self.loading.destroy()
@@ -825,6 +826,17 @@ class PlaylistPage(PlaylistPageBase):
             self.tab_menu.popup(None, None, None, None, e.button, e.time)
 
 
+def _is_filter_refinement(previous, filter_string):
+    '''
+        Returns whether all tracks matching filter_string also match the
+        previous filter string. This is only known to be the case when
+        words were appended to a filter made only of words.
+    '''
+    return filter_string.startswith(previous) and not any(
+        c in filter_string for c in '=<>~!|()"\\'
+    )
+
+
 class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
     __gsignals__ = {}
 
@@ -842,6 +854,8 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
         self.dragging = False
         self.pending_event = None
         self._insert_focusing = False
+        # whether the filter is shown again once the model is loaded
+        self._reattach_model = False
 
         self._hack_is_osx = sys.platform == 'darwin'
         self._hack_osx_control_mask = False
@@ -854,8 +868,18 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
         self.set_enable_search(True)
         self.selection = self.get_selection()
         self.selection.set_mode(Gtk.SelectionMode.MULTIPLE)
+        # total length of the selected tracks, None until needed
+        self._selection_length = None
+        self.selection.connect('changed', self._on_selection_aggregates_changed)
 
         self._filter_matcher = None
+        # filter string, keyword tags, matching tracks and all tracks that
+        # were checked, of the last completed filter
+        self._filter_state = None
+        # incremented to cancel running filters
+        self._filter_generation = 0
+        # tracks whose tags changed while a filter is running, or None
+        self._filter_changed = None
 
         self._sort_columns = list(common.BASE_SORT_TAGS)  # Column sort order
 
@@ -887,6 +911,12 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
             self.player,
             destroy_with=self,
         )
+        event.add_ui_callback(
+            self.on_track_tags_changed,
+            "track_tags_changed",
+            destroy_with=self,
+            bulk=True,
+        )
         self._cursor_changed = self.connect("cursor-changed", self.on_cursor_changed)
         self.connect("row-activated", self.on_row_activated)
         self.connect("key-press-event", self.on_key_press_event)
@@ -916,10 +946,17 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
 
             The filter will search any currently enabled columns AND the
             default columns.
+
+            Matching tracks are searched for on another thread, using the
+            search index of the model. When the filter only adds words to
+            the previous one, only the previous matches are searched.
         '''
+        self._filter_generation += 1
 
         if filter_string is None:
             self._filter_matcher = None
+            self._filter_state = None
+            self._filter_changed = None
             self._refilter()
         else:
             # Merge default columns and currently enabled columns
@@ -927,19 +964,90 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
                 playlist_columns.DEFAULT_COLUMNS
                 + [c.name for c in self.get_columns()[1:]]
             )
-            self._filter_matcher = trax.TracksMatcher(
+            matcher = trax.TracksMatcher(
                 filter_string, case_sensitive=False, keyword_tags=keyword_tags
             )
+
+            previous = None
+            state = self._filter_state
+            if (
+                state is not None
+                and state[1] == keyword_tags
+                and _is_filter_refinement(state[0], filter_string)
+            ):
+                previous = state[2:]
+
             logger.debug(
                 "Filtering playlist %r by %r.", self.playlist.name, filter_string
             )
-            self._refilter()
-            logger.debug(
-                "Filtering playlist %r by %r completed.",
-                self.playlist.name,
+            self._filter_changed = set()
+            self._filter_tracks_thread(
+                self._filter_generation,
                 filter_string,
+                keyword_tags,
+                matcher,
+                self.model.get_search_index(),
+                previous,
             )
 
+    @common.threaded
+    def _filter_tracks_thread(
+        self, generation, filter_string, keyword_tags, matcher, index, previous
+    ):
+        checked = index.get_all()
+        if previous is None:
+            tracks = checked
+        else:
+            # tracks that did not match the previous filter cannot match
+            # this one, but tracks added since then have to be checked
+            tracks = previous[0] | (checked - previous[1])
+
+        def _tracks():
+            for track in tracks:
+                if generation != self._filter_generation:
+                    return
+                yield track
+
+        matches = set(
+            srtr.track for srtr in trax.search_tracks(_tracks(), [matcher], index)
+        )
+        if generation != self._filter_generation:
+            return
+
+        GLib.idle_add(
+            self._filter_tracks_done,
+            generation,
+            matcher,
+            (filter_string, keyword_tags, matches, checked),
+        )
+
+    def _filter_tracks_done(self, generation, matcher, state):
+        if generation != self._filter_generation:
+            return
+        self._filter_matcher = matcher
+        self._filter_state = state
+        # the thread may have seen the old tags of these
+        self._forget_filter_results(self._filter_changed)
+        self._filter_changed = None
+        self._refilter()
+        logger.debug(
+            "Filtering playlist %r by %r completed.", self.playlist.name, state[0]
+        )
+
+    def _forget_filter_results(self, tracks):
+        '''
+            Makes the visibility of tracks be decided by the filter
+            again, instead of by the results of the last filter run
+        '''
+        state = self._filter_state
+        if state is not None and tracks:
+            self._filter_state = state[:2] + (state[2] - tracks, state[3] - tracks)
+
+    def on_track_tags_changed(self, type, tracks, tags):
+        if self._filter_changed is not None:
+            self._filter_changed.update(tracks)
+        self._forget_filter_results(tracks)
+
     def get_selection_count(self):
         '''
             Returns the number of items currently selected in the
@@ -948,6 +1056,29 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
         '''
         return self.get_selection().count_selected_rows()
 
+    def get_selection_length(self):
+        '''
+            Returns the total length in seconds of the tracks currently
+            selected in the playlist, without building a list of them.
+            The result is kept until the selection or a row changes.
+        '''
+        if self._selection_length is None:
+            if self.get_selection_count() == len(self.playlist):
+                length = self.playlist.get_total_length()
+            else:
+                lengths = []
+                self.selection.selected_foreach(
+                    lambda model, path, iter: lengths.append(
+                        model.get_value(iter, 0).get_tag_raw('__length') or 0
+                    )
+                )
+                length = sum(lengths)
+            self._selection_length = length
+        return self._selection_length
+
+    def _on_selection_aggregates_changed(self, *args):
+        self._selection_length = None
+
     def get_selected_tracks(self):
         """
             Returns a list of :class:`xl.trax.Track`
@@ -1162,14 +1293,37 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
     def _setup_models(self):
         self.model = PlaylistModel(self.playlist, [], self.player, self)
         self.model.connect('row-inserted', self.on_row_inserted)
+        self.model.connect('row-changed', self._on_selection_aggregates_changed)
+        self.model.connect('data-loading', self._on_model_data_loading)
 
         self.modelfilter = self.model.filter_new()
         self.modelfilter.set_visible_func(self._modelfilter_visible_func)
         self.set_model(self.modelfilter)
 
+    def _on_model_data_loading(self, model, loading):
+        '''
+            The model does not signal the rows it loads one by one, so the
+            filter is detached while loading and built again afterwards
+        '''
+        if loading:
+            self._reattach_model = self.get_model() is self.modelfilter
+            if self._reattach_model:
+                self.set_model(None)
+        else:
+            self.modelfilter = self.model.filter_new()
+            self.modelfilter.set_visible_func(self._modelfilter_visible_func)
+            if self._reattach_model:
+                self.set_model(self.modelfilter)
+
     def _modelfilter_visible_func(self, model, iter, data):
         if self._filter_matcher is not None:
             track = model.get_value(iter, 0)
+            matches, checked = self._filter_state[2:]
+            if track in matches:
+                return True
+            if track in checked:
+                return False
+            # added after the filter was applied
             return self._filter_matcher.match(trax.SearchResultTrack(track))
         return True
 
@@ -1592,8 +1746,7 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
                 insert_position = len(self.playlist) - len(tracks)
 
         # Select inserted items
-        if 0 <= insert_position < len(self.playlist) and 0 < len(tracks) <= 500:
-            # More than 500 songs are loaded threaded, so ignore it
+        if 0 <= insert_position < len(self.playlist) and tracks:
             self.selection.unselect_all()
             self.selection.select_range(
                 self.model.get_path(self.model.iter_nth_child(None, insert_position)),
@@ -1698,9 +1851,9 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
             settings.set_option('gui/columns', columns)
 
 
-class PlaylistModel(Gtk.ListStore):
+class PlaylistModel(GObject.GObject, Gtk.TreeModel):
     '''
-        This ListStore contains all the information needed to render a playlist
+        This model contains all the information needed to render a playlist
         via a PlaylistView. There are five columns:
         
         * xl.trax.Track
@@ -1716,6 +1869,11 @@ class PlaylistModel(Gtk.ListStore):
         The cache keys are populated by the playlist columns. This arrangement
         ensures that we don't have to recreate the playlist model each time the
         columns are changed.
+
+        Rows are not stored: the model follows the tracks of the playlist,
+        and the values of a row are only computed when the view asks for
+        them. Tag caches are kept for the ROW_CACHE_SIZE most recently
+        shown tracks, so memory use does not grow with the playlist.
     '''
 
     __gsignals__ = {
@@ -1731,21 +1889,50 @@ class PlaylistModel(Gtk.ListStore):
 
     PARAM_COLS = (COL_PIXBUF, COL_SENSITIVE, COL_WEIGHT)
 
+    COLUMN_TYPES = (
+        GObject.TYPE_PYOBJECT,
+        GObject.TYPE_PYOBJECT,
+        GdkPixbuf.Pixbuf,
+        GObject.TYPE_BOOLEAN,
+        Pango.Weight,
+    )
+
+    # number of tracks whose tag cache is kept
+    ROW_CACHE_SIZE = 1000
+
     def __init__(self, playlist, column_names, player, parent):
-        # columns: Track, Pixbuf, dict (cache)
-        Gtk.ListStore.__init__(
-            self, object, object, GdkPixbuf.Pixbuf, bool, Pango.Weight
-        )
+        GObject.GObject.__init__(self)
         self.playlist = playlist
         self.player = player
 
         self._set_columns(column_names)
 
+        # Copy of the tracks of the playlist. The playlist can change on
+        # other threads, but the model must only change together with
+        # the signals that tell the view about it.
+        self._tracks = list(playlist)
+        # track -> positions, built when needed
+        self._positions = None
+        # track -> tag cache, least recently used first
+        self._row_cache = OrderedDict()
+        # position -> (pixbuf, sensitive, weight), see _get_row_params
+        self._row_params = {}
+        # changes to the rows invalidate the iters
+        self._stamp = 0
+        # created when the playlist is first filtered
+        self._search_index = None
+        self._track_counts = None
+
+        # Set while many tracks are added at once. The rows added then are
+        # not signalled one by one, so views must not show the model
+        # during 'data-loading' and must reread it afterwards.
         self.data_loading = False
-        self.data_load_queue = []
 
         self._redraw_timer = None
         self._redraw_queue = []
+        self._sync_on_tag_change = settings.get_option_handle(
+            'gui/sync_on_tag_change', True
+        )
 
         event.add_ui_callback(
             self.on_tracks_added, "playlist_tracks_added", playlist, destroy_with=parent
@@ -1793,15 +1980,15 @@ class PlaylistModel(Gtk.ListStore):
             destroy_with=parent,
         )
         event.add_ui_callback(
-            self.on_track_tags_changed, "track_tags_changed", destroy_with=parent
+            self.on_track_tags_changed,
+            "track_tags_changed",
+            destroy_with=parent,
+            bulk=True,
         )
 
         event.add_ui_callback(self.on_option_set, "gui_option_set", destroy_with=parent)
 
         self._setup_icons()
-        self.on_tracks_added(
-            None, self.playlist, list(enumerate(self.playlist))
-        )  # populate the list
 
     def _set_columns(self, column_names):
         self.column_names = set(column_names)
@@ -1850,12 +2037,7 @@ class PlaylistModel(Gtk.ListStore):
 
     def _refresh_icons(self):
         self._setup_icons()
-        itr = self.get_iter_first()
-        position = 0
-        while itr:
-            self.set(itr, self.PARAM_COLS, self._compute_row_params(position))
-            itr = self.iter_next(itr)
-            position += 1
+        self._rows_changed(0, len(self._tracks))
 
     def on_option_set(self, typ, obj, data):
         if data == "gui/playlist_font":
@@ -1908,20 +2090,181 @@ class PlaylistModel(Gtk.ListStore):
 
         return pixbuf, sensitive, weight
 
+    def _get_row_params(self, position):
+        # the view asks for each column of a row separately
+        try:
+            return self._row_params[position]
+        except KeyError:
+            if len(self._row_params) >= self.ROW_CACHE_SIZE:
+                self._row_params.clear()
+            params = self._compute_row_params(position)
+            self._row_params[position] = params
+            return params
+
     def update_row_params(self, position):
-        itr = self.iter_nth_child(None, position)
-        if itr is not None:
-            self.set(itr, self.PARAM_COLS, self._compute_row_params(position))
+        if 0 <= position < len(self._tracks):
+            self._rows_changed(position, position + 1)
+
+    def _rows_changed(self, start, end):
+        for position in xrange(start, end):
+            self._row_params.pop(position, None)
+            self.row_changed(Gtk.TreePath((position,)), self._get_iter(position))
+
+    def _get_row_cache(self, track):
+        cache = self._row_cache
+        try:
+            row = cache.pop(track)
+        except KeyError:
+            row = {}
+            if len(cache) >= self.ROW_CACHE_SIZE:
+                cache.popitem(last=False)
+        cache[track] = row
+        return row
+
+    def _get_positions(self, track):
+        if self._positions is None:
+            positions = {}
+            for position, tr in enumerate(self._tracks):
+                positions.setdefault(tr, []).append(position)
+            self._positions = positions
+        return self._positions.get(track, ())
+
+    def get_search_index(self):
+        '''
+            Returns a :class:`xl.trax.index.TrackIndex` of the tracks
+            of this model, used to filter the playlist
+        '''
+        if self._search_index is None:
+            counts = {}
+            for track in self._tracks:
+                counts[track] = counts.get(track, 0) + 1
+            self._track_counts = counts
+            self._search_index = TrackIndex(self.playlist, counts)
+        return self._search_index
+
+    ### Gtk.TreeModel implementation ###
+
+    def _get_iter(self, position):
+        itr = Gtk.TreeIter()
+        itr.stamp = self._stamp
+        # user_data is a pointer, so 0 cannot be stored
+        itr.user_data = position + 1
+        return itr
+
+    def _get_position(self, itr):
+        return itr.user_data - 1
+
+    def do_get_flags(self):
+        return Gtk.TreeModelFlags.LIST_ONLY
+
+    def do_get_n_columns(self):
+        return len(self.COLUMN_TYPES)
+
+    def do_get_column_type(self, column):
+        return self.COLUMN_TYPES[column]
+
+    def do_get_iter(self, path):
+        indices = path.get_indices()
+        if len(indices) == 1 and 0 <= indices[0] < len(self._tracks):
+            return True, self._get_iter(indices[0])
+        return False, None
+
+    def do_get_path(self, itr):
+        return Gtk.TreePath((self._get_position(itr),))
+
+    def do_get_value(self, itr, column):
+        position = self._get_position(itr)
+        if column == self.COL_TRACK:
+            return self._tracks[position]
+        elif column == self.COL_CACHE:
+            return self._get_row_cache(self._tracks[position])
+        return self._get_row_params(position)[column - self.COL_PIXBUF]
+
+    def do_iter_next(self, itr):
+        position = self._get_position(itr) + 1
+        if position < len(self._tracks):
+            itr.user_data = position + 1
+            return True
+        return False
+
+    def do_iter_previous(self, itr):
+        position = self._get_position(itr) - 1
+        if position >= 0:
+            itr.user_data = position + 1
+            return True
+        return False
+
+    def do_iter_children(self, parent):
+        if parent is None and self._tracks:
+            return True, self._get_iter(0)
+        return False, None
+
+    def do_iter_has_child(self, itr):
+        return False
+
+    def do_iter_n_children(self, itr):
+        if itr is None:
+            return len(self._tracks)
+        return 0
+
+    def do_iter_nth_child(self, parent, n):
+        if parent is None and 0 <= n < len(self._tracks):
+            return True, self._get_iter(n)
+        return False, None
+
+    def do_iter_parent(self, child):
+        return False, None
 
     ### Event callbacks to keep the model in sync with the playlist ###
 
     def on_tracks_added(self, event_type, playlist, tracks):
-        self._load_data(tracks)
+        # the view is detached while many rows are inserted
+        loading = len(tracks) > 500
+        if loading:
+            self.data_loading = True
+            self.emit('data-loading', True)
+
+        self._positions = None
+        self._row_params.clear()
+        if self._search_index is not None:
+            counts = self._track_counts
+            for position, track in tracks:
+                counts[track] = counts.get(track, 0) + 1
+            self._search_index.add_tracks(track for position, track in tracks)
+
+        if loading:
+            # Not signalled row by row: the view builds a new filter of
+            # the model once loading is done
+            for position, track in tracks:
+                self._tracks.insert(position, track)
+            self._stamp += 1
+        else:
+            for position, track in tracks:
+                self._tracks.insert(position, track)
+                self._stamp += 1
+                self.row_inserted(Gtk.TreePath((position,)), self._get_iter(position))
+
+        if loading:
+            self.data_loading = False
+            self.emit('data-loading', False)
 
     def on_tracks_removed(self, event_type, playlist, tracks):
-        tracks.reverse()
-        for position, track in tracks:
-            self.remove(self.iter_nth_child(None, position))
+        self._positions = None
+        self._row_params.clear()
+        for position, track in reversed(tracks):
+            del self._tracks[position]
+            self._stamp += 1
+            self.row_deleted(Gtk.TreePath((position,)))
+
+        if self._search_index is not None:
+            counts = self._track_counts
+            removed = []
+            for position, track in tracks:
+                counts[track] -= 1
+                if not counts[track]:
+                    del counts[track]
+                    removed.append(track)
+            self._search_index.remove_tracks(removed)
 
     def on_current_position_changed(self, event_type, playlist, positions):
         for position in positions:
@@ -1930,36 +2273,26 @@ class PlaylistModel(Gtk.ListStore):
             self.update_row_params(position)
 
     def on_spat_position_changed(self, event_type, playlist, positions):
-        pos = min(positions)
-
-        if pos < 0:
-            pos = 0
-            itr = self.get_iter_first()
-        else:
-            itr = self.iter_nth_child(None, pos)
-
-        while itr:
-            self.set(itr, self.PARAM_COLS, self._compute_row_params(pos))
-            itr = self.iter_next(itr)
-            pos += 1
+        pos = max(min(positions), 0)
+        self._rows_changed(pos, len(self._tracks))
 
     def on_playback_state_change(self, event_type, player_obj, track):
         position = self.playlist.current_position
-        if position < 0 or position >= len(self):
+        if position < 0 or position >= len(self._tracks):
             return
         self.update_row_params(position)
 
-    def on_track_tags_changed(self, type, track, tags):
+    def on_track_tags_changed(self, type, tracks, tags):
         if (
-            not track
-            or not settings.get_option('gui/sync_on_tag_change', True)
+            not tracks
+            or not self._sync_on_tag_change.get()
             or not (tags & self.column_names)
         ):
             return
 
         if self._redraw_timer:
             GLib.source_remove(self._redraw_timer)
-        self._redraw_queue.append(track)
+        self._redraw_queue.extend(tracks)
         self._redraw_timer = GLib.timeout_add(100, self._on_track_tags_changed)
 
     def _on_track_tags_changed(self):
@@ -1967,65 +2300,7 @@ class PlaylistModel(Gtk.ListStore):
         redraw_queue = set(self._redraw_queue)
         self._redraw_queue = []
 
-        COL_TRACK = self.COL_TRACK
-        COL_CACHE = self.COL_CACHE
-
-        for row in self:
-            if row[COL_TRACK] in redraw_queue:
-                row[COL_CACHE].clear()
-                self.row_changed(row.path, row.iter)
-
-    #
-    # Loading data into the playlist:
-    #
-    # - Profiler reveals that most of the playlist loading time is spent in two
-    #   places
-    #   - Formatting values
-    #   - Converting them to GValue objects for insert into the treeview
-    #
-    # Now, the program is annoyingly blocked when this happens, so we need to
-    # process new tracks on a different thread, and show some kind of loading
-    # indicator instead. That's what these four functions help us do.
-    #
-
-    def _load_data(self, tracks):
-
-        # Don't allow race condition between adds.. there's probably a race
-        # condition for removal
-        if self.data_loading:
-            self.data_load_queue.extend(tracks)
-            return
-
-        self.data_loading = True
-        self.emit('data-loading', True)
-
-        if len(tracks) > 500:
-            self._load_data_thread(tracks)
-        else:
-            render_data = self._load_data_fn(tracks)
-            self._load_data_done(render_data)
-
-    @common.threaded
-    def _load_data_thread(self, tracks):
-        render_data = self._load_data_fn(tracks)
-        GLib.idle_add(self._load_data_done, render_data)
-
-    def _load_data_fn(self, tracks):
-        indices = (0, 1, 2, 3, 4)
-        return [
-            (position, indices, (track, {}) + self._compute_row_params(position))
-            for position, track in tracks
-        ]
-
-    def _load_data_done(self, render_data):
-        for args in render_data:
-            self.insert_with_valuesv(*args)
-
-        self.data_loading = False
-        self.emit('data-loading', False)
-
-        if self.data_load_queue:
-            tracks = self.data_load_queue
-            self.data_load_queue = []
-
-            self._load_data(tracks)
+        for track in redraw_queue:
+            self._row_cache.pop(track, None)
+            for position in self._get_positions(track):
+                self.update_row_params(position)
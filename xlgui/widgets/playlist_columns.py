@@ -49,7 +49,7 @@ class Column(Gtk.TreeViewColumn):
     display = ''
     menu_title = classproperty(lambda c: c.display)
     renderer = Gtk.CellRendererText
-    formatter = classproperty(lambda c: TrackFormatter('$%s' % c.name))
+    formatter = classproperty(lambda c: TrackFormatter('$%s' % c.name, cache=True))
     size = 10  # default size
     autoexpand = False  # whether to expand to fit space in Autosize mode
     datatype = str
@@ -528,7 +528,7 @@ class CommentColumn(Column):
     size = 200
     autoexpand = True
     # Remove the newlines to fit into the vertical space of rows
-    formatter = TrackFormatter('${comment:newlines=strip}')
+    formatter = TrackFormatter('${comment:newlines=strip}', cache=True)
 
 
 providers.register('playlist-columns', CommentColumn)